@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Measure WebSocket ping latency while a burst of password hashes runs.
+
+A TentEventsConsumer is connected in-process and pinged continuously while
+`--burst` signup-style hashes run on worker threads, first inline on the
+request worker (the old behaviour) and then through the hashing pool.
+
+    python benchmarks/bench_auth_burst.py --burst 50 --threads 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'goldenhorde.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.contrib.auth.hashers import make_password  # noqa: E402
+from hordes.consumers import TentEventsConsumer  # noqa: E402
+from membership.hashing import PasswordHashingService  # noqa: E402
+
+User = get_user_model()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[max(0, int(len(values) * pct) - 1)] * 1000
+
+
+async def measure(hash_fn, burst, threads):
+    user, _ = await asyncio.to_thread(User.objects.get_or_create, username="bench_user")
+    communicator = WebsocketCommunicator(TentEventsConsumer.as_asgi(), "/ws/tent-events/")
+    communicator.scope["user"] = user
+    await communicator.connect()
+    await communicator.receive_json_from()  # current_tent_users
+
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=threads)
+    hashes = [loop.run_in_executor(pool, hash_fn, f"password-{i}") for i in range(burst)]
+    done = asyncio.gather(*hashes)
+
+    latencies = []
+    while not done.done():
+        start = time.perf_counter()
+        await communicator.send_json_to({"type": "ping", "ts": start})
+        await communicator.receive_json_from(timeout=30)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+    await done
+    pool.shutdown()
+    await communicator.disconnect()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    service = PasswordHashingService(workers=args.workers, max_pending=args.burst, timeout=120)
+    service.make_password("warmup")
+    for label, hash_fn in (("inline", make_password), ("process pool", service.make_password)):
+        latencies = asyncio.run(measure(hash_fn, args.burst, args.threads))
+        print(f"{label:>12}: {len(latencies):5d} pings  p50 {percentile(latencies, 0.5):7.2f} ms  "
+              f"p99 {percentile(latencies, 0.99):7.2f} ms  max {max(latencies) * 1000:7.2f} ms")
+    service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Compare channel layer backends: `UnixSocketChannelLayer`, `RedisChannelLayer`
+(one list push per group member) and `RedisPubSubChannelLayer` (one PUBLISH
+per group_send).
+
+The Unix socket broker runs in its own process, as it does under `runworkers`.
+For each backend two layer instances (a sender and a receiver) measure:
+
+    send          latency from send() to the receiver's receive() returning
+    group_send    for each of `--group-sizes`: the sender-side cost of the
+                  group_send() call, and the delivery latency until every
+                  member of the group has received the message
+
+    python benchmarks/bench_channel_layers.py --iterations 2000 --group-sizes 1,10,100,1000
+    python benchmarks/bench_channel_layers.py --redis-url redis://127.0.0.1:6379/1 --backends redis,redis-pubsub
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'goldenhorde.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from goldenhorde.channel_layers import ChannelBroker, UnixSocketChannelLayer  # noqa: E402
+
+
+def run_broker(path):
+    asyncio.run(ChannelBroker(path=path, capacity=10000).serve_forever())
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    return f"p50 {statistics.median(samples) * 1e3:7.3f} ms  p99 {p99 * 1e3:7.3f} ms"
+
+
+async def bench_send(sender, receiver, iterations):
+    channel = await receiver.new_channel()
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        await sender.send(channel, {"type": "bench.message", "i": i, "sdp": "x" * 512})
+        await receiver.receive(channel)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def bench_group_send(sender, receiver, iterations, group_size):
+    group = f"bench_{group_size}"
+    channels = [await receiver.new_channel() for _ in range(group_size)]
+    for channel in channels:
+        await receiver.group_add(group, channel)
+    # Receivers wait first so pub/sub delivery is not lost to a late subscribe
+    calls, deliveries = [], []
+    for i in range(iterations):
+        pending = [asyncio.ensure_future(receiver.receive(channel)) for channel in channels]
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        await sender.group_send(group, {"type": "bench.message", "i": i})
+        calls.append(time.perf_counter() - start)
+        await asyncio.gather(*pending)
+        deliveries.append(time.perf_counter() - start)
+    for channel in channels:
+        await receiver.group_discard(group, channel)
+    return calls, deliveries
+
+
+async def run(name, make_layer, args):
+    sender, receiver = make_layer(), make_layer()
+    await bench_send(sender, receiver, 50)  # warm up connections
+    send = await bench_send(sender, receiver, args.iterations)
+    print(f"{name:12s} send              {summarize(send)}")
+    for group_size in args.group_sizes:
+        iterations = max(10, args.iterations // group_size)
+        calls, deliveries = await bench_group_send(sender, receiver, iterations, group_size)
+        print(f"{name:12s} group_send {group_size:5d}  call {summarize(calls)}  delivery {summarize(deliveries)}")
+    for layer in (sender, receiver):
+        await layer.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--group-sizes", default="1,10,100,1000",
+                        type=lambda value: [int(size) for size in value.split(",")])
+    parser.add_argument("--backends", default="unix,redis,redis-pubsub", type=lambda value: value.split(","))
+    parser.add_argument("--socket", default=f"/tmp/bench-channels-{os.getpid()}.sock")
+    parser.add_argument("--redis-url", default=os.environ.get("REDIS_URL"), help="skip Redis when not set")
+    args = parser.parse_args()
+
+    if "unix" in args.backends:
+        broker = multiprocessing.Process(target=run_broker, args=(args.socket,), daemon=True)
+        broker.start()
+        try:
+            deadline = time.time() + 10
+            while not os.path.exists(args.socket) and time.time() < deadline:
+                time.sleep(0.05)
+            asyncio.run(run("unix", lambda: UnixSocketChannelLayer(path=args.socket, capacity=10000), args))
+        finally:
+            broker.terminate()
+
+    if not args.redis_url:
+        print("--redis-url not set, skipping Redis backends")
+        return
+    if "redis" in args.backends:
+        from channels_redis.core import RedisChannelLayer
+        asyncio.run(run("redis", lambda: RedisChannelLayer(hosts=[args.redis_url], capacity=10000), args))
+    if "redis-pubsub" in args.backends:
+        from channels_redis.pubsub import RedisPubSubChannelLayer
+        asyncio.run(run("redis-pubsub", lambda: RedisPubSubChannelLayer(hosts=[args.redis_url]), args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark the sync HordesViewSet against the async read views.
+
+Requests are driven in-process through the real ASGI `application`, so the
+numbers include the sync-to-async bridge the viewset pays under daphne.
+
+    python benchmarks/bench_hordes_api.py --requests 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'goldenhorde.settings')
+
+from goldenhorde.asgi import application  # noqa: E402  (runs django.setup())
+from django.contrib.auth import get_user_model  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+User = get_user_model()
+
+
+def get_bench_token():
+    user, _ = User.objects.get_or_create(username="bench_user")
+    token, _ = Token.objects.get_or_create(user=user)
+    return token.key
+
+
+async def asgi_get(path, query_string, token_key):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string.encode(),
+        "headers": [
+            (b"host", b"localhost"),
+            (b"authorization", f"Token {token_key}".encode()),
+        ],
+        "client": ("127.0.0.1", 12345),
+        "server": ("127.0.0.1", 8000),
+    }
+    sent = False
+    status_code = None
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+
+    await application(scope, receive, send)
+    return status_code
+
+
+async def run(path, query_string, token_key, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            status_code = await asgi_get(path, query_string, token_key)
+            latencies.append(time.perf_counter() - start)
+            if status_code != 200:
+                raise RuntimeError(f"{path} returned {status_code}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--include", default="", help="e.g. occupancy,participants")
+    args = parser.parse_args()
+
+    token_key = get_bench_token()
+    for label, path in (("sync viewset", "/api/hordes/"), ("async views", "/api/hordes/async/")):
+        # warm up connections and URL resolution
+        asyncio.run(run(path, f"include={args.include}", token_key, 20, 10))
+        result = asyncio.run(run(path, f"include={args.include}", token_key, args.requests, args.concurrency))
+        print(f"{label:>14}: {result['rps']:8.1f} req/s  p50 {result['p50']:7.2f} ms  p99 {result['p99']:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Call-setup latency during a presence storm, with and without priority lanes.
+
+Two users join one tent. While `--storm-rate` presence events per second
+(`user_joined`/`user_left` for `--storm-users` distinct users) are broadcast
+into the tent's group, the caller repeatedly sends an SDP offer and times
+how long it takes for the callee's answer to come back. The run is done once
+with presence sent straight to the socket (PRESENCE_FLUSH_INTERVAL = 0), and
+once through the presence lane.
+
+    python benchmarks/bench_priority_lanes.py --storm-rate 20000 --calls 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_ws_load import InProcessClient, join, percentiles, prepare_fixtures  # noqa: E402
+from channels.layers import get_channel_layer  # noqa: E402
+from hordes import lanes  # noqa: E402
+
+
+async def storm(tent_id, rate, users, stop):
+    layer = get_channel_layer()
+    sent = 0
+    start = time.perf_counter()
+    while not stop.is_set():
+        # Stay on the requested rate, in bursts of up to 100 events
+        due = int((time.perf_counter() - start) * rate) - sent
+        for _ in range(min(due, 100)):
+            event = "user_joined" if sent % 2 else "user_left"
+            await layer.group_send(f"voice_chat_{tent_id}", {"type": "tent_event", "data": {
+                "type": event, "tent_id": tent_id, "username": f"storm_{sent % users}"}})
+            sent += 1
+        await asyncio.sleep(0)
+    return sent / (time.perf_counter() - start)
+
+
+async def callee_loop(callee):
+    while True:
+        message = await callee.receive_json()
+        if message.get("type") == "offer":
+            await callee.send_json({"type": "answer", "target_user": message["sender"], "sender": callee.username,
+                                    "n": message["n"]})
+
+
+async def measure(voice_users, args, interval):
+    lanes.FLUSH_INTERVAL = interval
+    (caller, _), (callee, _) = await asyncio.gather(*(join(InProcessClient, *user) for user in voice_users))
+    await asyncio.sleep(0.2)
+    answering = asyncio.ensure_future(callee_loop(callee))
+    stop = asyncio.Event()
+    storming = asyncio.ensure_future(storm(caller.tent_id, args.storm_rate, args.storm_users, stop))
+    await asyncio.sleep(0.5)
+
+    setups, presence = [], 0
+    for n in range(args.calls):
+        start = time.perf_counter()
+        await caller.send_json({"type": "offer", "target_user": callee.username, "sender": caller.username,
+                                "sdp": "v=0" * 200, "n": n})
+        while True:
+            message = await caller.receive_json()
+            if message.get("type") == "answer" and message.get("n") == n:
+                break
+            presence += 1
+        setups.append(time.perf_counter() - start)
+    stop.set()
+    rate = await storming
+    answering.cancel()
+    await asyncio.gather(caller.close(), callee.close(), return_exceptions=True)
+    label = f"lane ({interval * 1000:.0f}ms)" if interval else "no lane"
+    print(f"{label:14s} storm {rate:8.0f} ev/s  presence seen by caller {presence:6d}  call setup {percentiles(setups)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--storm-rate", type=float, default=20000, help="presence events per second")
+    parser.add_argument("--storm-users", type=int, default=200)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.05, help="presence flush interval with the lane")
+    args = parser.parse_args()
+
+    voice_users, _ = prepare_fixtures(2, 2, 0)
+
+    async def run():
+        for interval in (0, args.interval):
+            await measure(voice_users, args, interval)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Time the main DB-dependent paths at increasing data volumes.
+
+For each scale, `generate_synthetic_data` is re-run with that many users, then
+each query is executed `--repeat` times and the median wall time and query
+count are reported:
+
+    tent_events snapshot    TentEventsConsumer.get_all_participants
+    hordes list             HordesViewSet queryset + serializer (base and ?include=occupancy)
+    voice chat connect      get_tent, get_other_users, is_tent_participant on the largest tent
+    signup uniqueness       username and case-insensitive email lookups
+
+    python benchmarks/bench_queries.py --scales 1000,10000,100000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'goldenhorde.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from asgiref.sync import async_to_sync  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.models import Count  # noqa: E402
+from goldenhorde.middlewares import QueryProfile  # noqa: E402
+from hordes.consumers import TentEventsConsumer, VoiceChatConsumer  # noqa: E402
+from hordes.management.commands.generate_synthetic_data import synthetic_users  # noqa: E402
+from hordes.models import Tent  # noqa: E402
+from hordes.serializers import HordeWithOccupancySerializer, HordeWithTentsSerializer  # noqa: E402
+from hordes.views import get_hordes_queryset  # noqa: E402
+from membership.views import get_user_by_email  # noqa: E402
+
+User = get_user_model()
+
+
+def measure(fn, repeat):
+    timings = []
+    profile = QueryProfile()
+    for _ in range(repeat):
+        profile.queries.clear()
+        start = time.perf_counter()
+        with connection.execute_wrapper(profile):
+            fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, profile.count
+
+
+def bench_cases(prefix):
+    largest = Tent.objects.annotate(n=Count("participants")).order_by("-n").first()
+    member = largest.participants.select_related("user").first().user if largest and largest.n else None
+    sample_user = synthetic_users(prefix).order_by("?").first()
+
+    cases = {
+        "tent_events snapshot": lambda: async_to_sync(TentEventsConsumer.get_all_participants)(),
+        "hordes list": lambda: HordeWithTentsSerializer(get_hordes_queryset(set()), many=True).data,
+        "hordes list ?include=occupancy": lambda: HordeWithOccupancySerializer(
+            get_hordes_queryset({"occupancy"}), many=True).data,
+        "signup username check": lambda: User.objects.filter(username=sample_user.username).exists(),
+        "signup email lookup": lambda: get_user_by_email(sample_user.email.upper()),
+    }
+    if member is not None:
+        cases.update({
+            "connect get_tent": lambda: async_to_sync(VoiceChatConsumer.get_tent)(largest.pk),
+            "connect get_other_users": lambda: async_to_sync(VoiceChatConsumer.get_other_users)(largest, member),
+            "signal is_tent_participant": lambda: async_to_sync(VoiceChatConsumer.is_tent_participant)(
+                largest.pk, member.username),
+        })
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1000,10000,100000", help="comma-separated user counts")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--prefix", default="synthbench")
+    parser.add_argument("--distribution", default="powerlaw", choices=["uniform", "powerlaw"])
+    parser.add_argument("--copy", action="store_true", help="load with COPY on PostgreSQL")
+    args = parser.parse_args()
+
+    for scale in (int(value) for value in args.scales.split(",")):
+        generate = ["generate_synthetic_data", "--reset", "--users", str(scale), "--prefix", args.prefix,
+                    "--hordes", str(max(1, scale // 100)), "--distribution", args.distribution, "--seed", "1"]
+        if args.copy:
+            generate.append("--copy")
+        call_command(*generate, stdout=open(os.devnull, "w"))
+        print(f"\n== {scale} users ==")
+        for name, fn in bench_cases(args.prefix).items():
+            median_ms, queries = measure(fn, args.repeat)
+            print(f"{name:<34} {median_ms:10.2f} ms  {queries:4d} queries")
+
+
+if __name__ == "__main__":
+    main()
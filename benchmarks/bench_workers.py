@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Throughput scaling of `manage.py runworkers` with the number of workers.
+
+For each worker count the supervisor is started on a free port, then several
+load-generator processes hammer one path over keep-alive HTTP/1.1
+connections for `--duration` seconds. Load generators run in their own
+processes so the client side is not the bottleneck.
+
+    python benchmarks/bench_workers.py --workers 1,2,4,8 --path /metrics
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(port, path, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1) as s:
+                s.sendall(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+                if s.recv(12).startswith(b"HTTP/1.1"):
+                    return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+async def client(port, path, deadline, counts):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    request = f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode()
+    while time.time() < deadline:
+        writer.write(request)
+        await writer.drain()
+        headers = await reader.readuntil(b"\r\n\r\n")
+        length = next(int(line.split(b":")[1]) for line in headers.split(b"\r\n")
+                      if line.lower().startswith(b"content-length"))
+        await reader.readexactly(length)
+        counts[0] += 1
+    writer.close()
+
+
+def load_process(port, path, connections, duration, result_queue):
+    counts = [0]
+    deadline = time.time() + duration
+
+    async def run():
+        await asyncio.gather(*(client(port, path, deadline, counts) for _ in range(connections)))
+    asyncio.run(run())
+    result_queue.put(counts[0])
+
+
+def measure(workers, args):
+    port = free_port()
+    env = dict(os.environ, METRICS_DIR=os.path.join("/tmp", f"bench-metrics-{port}"))
+    server = subprocess.Popen(
+        [sys.executable, "manage.py", "runworkers", "--workers", str(workers), "--bind", "127.0.0.1",
+         "--port", str(port), "--grace", "5"],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready(port, args.path)
+        results = multiprocessing.Queue()
+        loaders = [multiprocessing.Process(target=load_process, args=(port, args.path, args.connections, args.duration, results))
+                   for _ in range(args.load_procs)]
+        for loader in loaders:
+            loader.start()
+        total = sum(results.get() for _ in loaders)
+        for loader in loaders:
+            loader.join()
+        return total / args.duration
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--path", default="/metrics")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--connections", type=int, default=32, help="connections per load process")
+    parser.add_argument("--load-procs", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in (int(value) for value in args.workers.split(",")):
+        rps = measure(workers, args)
+        baseline = baseline or rps
+        print(f"{workers:3d} workers: {rps:10.1f} req/s  ({rps / baseline:4.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+WebSocket load generation against the real ASGI `application`.
+
+Clients are driven in-process with channels' WebsocketCommunicator by default,
+or over real sockets against a running daphne with `--url` (requires the
+optional `websockets` package). Users, tokens and tents are created up front.
+
+Scenarios:
+    join_leave  every user joins a tent concurrently, then all leave
+    mesh        full-mesh SDP offer/answer plus ICE candidates inside every tent
+    ping        steady-state pings from every connection for --duration seconds
+    fanout      tent-events watchers receiving the user_joined broadcast of each join
+
+    python benchmarks/bench_ws_load.py mesh --users 200 --tent-size 8
+    python benchmarks/bench_ws_load.py fanout --watchers 500 --users 50 --redis redis://127.0.0.1:6379/1
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'goldenhorde.settings')
+
+from goldenhorde.asgi import application  # noqa: E402  (runs django.setup())
+from channels.layers import channel_layers  # noqa: E402
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+from hordes.models import Horde, Tent, TentParticipant  # noqa: E402
+
+User = get_user_model()
+
+RECEIVE_TIMEOUT = 30
+
+
+def percentiles(values):
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    pick = lambda pct: values[min(len(values) - 1, int(len(values) * pct))] * 1000  # noqa: E731
+    return f"p50 {pick(0.50):.2f}ms  p95 {pick(0.95):.2f}ms  p99 {pick(0.99):.2f}ms  max {values[-1] * 1000:.2f}ms"
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class InProcessClient:
+    def __init__(self, path, token):
+        self.communicator = WebsocketCommunicator(
+            application, f"{path}?token={token}", headers=[(b"origin", b"http://localhost"), (b"host", b"localhost")],
+        )
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=RECEIVE_TIMEOUT)
+        return connected
+
+    async def send_json(self, data):
+        await self.communicator.send_to(text_data=json.dumps(data))
+
+    async def receive_json(self):
+        return json.loads(await self.communicator.receive_from(timeout=RECEIVE_TIMEOUT))
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketClient:
+    base_url = None
+
+    def __init__(self, path, token):
+        self.url = f"{self.base_url.rstrip('/')}{path}?token={token}"
+        self.socket = None
+
+    async def connect(self):
+        import websockets
+        self.socket = await websockets.connect(self.url, open_timeout=RECEIVE_TIMEOUT)
+        return True
+
+    async def send_json(self, data):
+        await self.socket.send(json.dumps(data))
+
+    async def receive_json(self):
+        return json.loads(await asyncio.wait_for(self.socket.recv(), RECEIVE_TIMEOUT))
+
+    async def close(self):
+        await self.socket.close()
+
+
+def prepare_fixtures(users, tent_size, watchers):
+    """Create (or reuse) bench users with tokens, and enough tents for `tent_size` users each."""
+    khan, _ = User.objects.get_or_create(username="bench_khan")
+    horde, _ = Horde.objects.get_or_create(name="bench horde", greatkhan=khan)
+    names = [f"bench_{i}" for i in range(users + watchers)]
+    existing = set(User.objects.filter(username__in=names).values_list("username", flat=True))
+    User.objects.bulk_create([User(username=name) for name in names if name not in existing], batch_size=1000)
+    bench_users = list(User.objects.filter(username__in=names).order_by("id"))
+    with_token = set(Token.objects.filter(user__in=bench_users).values_list("user_id", flat=True))
+    Token.objects.bulk_create([Token(user=u) for u in bench_users if u.pk not in with_token], batch_size=1000)
+    tokens = dict(Token.objects.filter(user__in=bench_users).values_list("user__username", "key"))
+    TentParticipant.objects.filter(user__in=bench_users).delete()
+
+    tent_count = max(1, -(-users // tent_size))
+    tents = list(Tent.objects.filter(horde=horde).order_by("id")[:tent_count])
+    tents += [Tent.objects.create(name=f"bench tent {i}", horde=horde) for i in range(len(tents), tent_count)]
+    voice_users = [(name, tokens[name], tents[i // tent_size].pk) for i, name in enumerate(names[:users])]
+    watcher_tokens = [tokens[name] for name in names[users:]]
+    return voice_users, watcher_tokens
+
+
+async def join(client_class, username, token, tent_id):
+    client = client_class(f"/ws/voice_chat/{tent_id}/", token)
+    start = time.perf_counter()
+    if not await client.connect():
+        raise RuntimeError(f"{username} was rejected")
+    info = await client.receive_json()
+    assert info["type"] == "connect_info", info
+    client.username, client.tent_id = username, tent_id
+    return client, time.perf_counter() - start
+
+
+async def join_all(client_class, voice_users):
+    results = await asyncio.gather(*(join(client_class, *user) for user in voice_users))
+    return [client for client, _ in results], [latency for _, latency in results]
+
+
+async def drain(client, stop_type=None, until=None):
+    """Receive until a message of `stop_type` arrives; returns the messages seen."""
+    seen = []
+    while True:
+        message = await client.receive_json()
+        seen.append(message)
+        if stop_type and message.get("type") == stop_type and (until is None or until(message)):
+            return seen
+
+
+async def scenario_join_leave(client_class, voice_users, args):
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    clients, latencies = await join_all(client_class, voice_users)
+    join_elapsed = time.perf_counter() - start
+    rss_per_connection = (rss_bytes() - rss_before) / len(clients)
+    start = time.perf_counter()
+    await asyncio.gather(*(client.close() for client in clients))
+    leave_elapsed = time.perf_counter() - start
+    print(f"joined {len(clients)} in {join_elapsed:.2f}s ({len(clients) / join_elapsed:.1f} conn/s)")
+    print(f"connect latency: {percentiles(latencies)}")
+    print(f"memory per connection: {rss_per_connection / 1024:.1f} KiB")
+    print(f"left {len(clients)} in {leave_elapsed:.2f}s")
+
+
+async def scenario_mesh(client_class, voice_users, args):
+    clients, latencies = await join_all(client_class, voice_users)
+    by_tent = {}
+    for client in clients:
+        by_tent.setdefault(client.tent_id, []).append(client)
+
+    async def negotiate(client, peers):
+        # Offer to every peer with a higher username, answer every offer received, trickle ICE both ways
+        expected = 0
+        for peer in peers:
+            if peer.username > client.username:
+                await client.send_json({"type": "offer", "target_user": peer.username, "sender": client.username,
+                                        "sdp": "v=0" * 200})
+                expected += 1  # answer
+            else:
+                expected += 1  # offer
+            for i in range(args.candidates):
+                await client.send_json({"type": "ice-candidate", "target_user": peer.username, "sender": client.username,
+                                        "candidate": f"candidate:{i}"})
+            expected += args.candidates
+        received = 0
+        while received < expected:
+            message = await client.receive_json()
+            if message.get("type") == "offer":
+                await client.send_json({"type": "answer", "target_user": message["sender"], "sender": client.username,
+                                        "sdp": "v=0" * 200})
+            if message.get("type") in ("offer", "answer", "ice-candidate"):
+                received += 1
+        return received
+
+    start = time.perf_counter()
+    totals = await asyncio.gather(*(
+        negotiate(client, [peer for peer in peers if peer is not client])
+        for peers in by_tent.values() for client in peers
+    ))
+    elapsed = time.perf_counter() - start
+    print(f"{len(by_tent)} tents, {len(clients)} peers, {sum(totals)} signaling messages in {elapsed:.2f}s "
+          f"({sum(totals) / elapsed:.1f} msg/s)")
+    print(f"connect latency: {percentiles(latencies)}")
+    await asyncio.gather(*(client.close() for client in clients))
+
+
+async def scenario_ping(client_class, voice_users, args):
+    clients, _ = await join_all(client_class, voice_users)
+    # Discard the join broadcasts before measuring
+    await asyncio.sleep(0.5)
+    rtts = []
+    deadline = time.perf_counter() + args.duration
+
+    async def pinger(client):
+        while time.perf_counter() < deadline:
+            sent = time.perf_counter()
+            await client.send_json({"type": "ping", "ts": sent})
+            await drain(client, "pong", until=lambda m: m.get("ts") == sent)
+            rtts.append(time.perf_counter() - sent)
+            await asyncio.sleep(args.ping_interval)
+
+    await asyncio.gather(*(pinger(client) for client in clients))
+    print(f"{len(rtts)} pings from {len(clients)} connections ({len(rtts) / args.duration:.1f} msg/s)")
+    print(f"ping rtt: {percentiles(rtts)}")
+    await asyncio.gather(*(client.close() for client in clients))
+
+
+async def scenario_fanout(client_class, voice_users, watcher_tokens, args):
+    watchers = [client_class("/ws/tent-events/", token) for token in watcher_tokens]
+    await asyncio.gather(*(watcher.connect() for watcher in watchers))
+    await asyncio.gather(*(watcher.receive_json() for watcher in watchers))  # current_tent_users
+
+    delivery = []
+    joined_at = {}
+
+    async def watch(watcher):
+        seen = 0
+        while seen < len(voice_users):
+            message = await watcher.receive_json()
+            if message.get("type") == "user_joined":
+                delivery.append(time.perf_counter() - joined_at[message["username"]])
+                seen += 1
+
+    watch_tasks = [asyncio.ensure_future(watch(watcher)) for watcher in watchers]
+    clients = []
+    start = time.perf_counter()
+    for username, token, tent_id in voice_users:
+        joined_at[username] = time.perf_counter()
+        client, _ = await join(client_class, username, token, tent_id)
+        clients.append(client)
+    await asyncio.gather(*watch_tasks)
+    elapsed = time.perf_counter() - start
+    print(f"{len(voice_users)} joins fanned out to {len(watchers)} watchers: {len(delivery)} deliveries "
+          f"in {elapsed:.2f}s ({len(delivery) / elapsed:.1f} msg/s)")
+    print(f"join -> watcher delivery: {percentiles(delivery)}")
+    await asyncio.gather(*(client.close() for client in clients + watchers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=["join_leave", "mesh", "ping", "fanout"])
+    parser.add_argument("--users", type=int, default=100, help="voice chat participants")
+    parser.add_argument("--tent-size", type=int, default=6)
+    parser.add_argument("--watchers", type=int, default=0, help="tent-events connections (fanout)")
+    parser.add_argument("--candidates", type=int, default=4, help="ICE candidates per peer pair (mesh)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds (ping)")
+    parser.add_argument("--ping-interval", type=float, default=1.0)
+    parser.add_argument("--redis", default=None, help="use RedisChannelLayer at this URL instead of the configured layer")
+    parser.add_argument("--pubsub", action="store_true", help="with --redis, use RedisPubSubChannelLayer")
+    parser.add_argument("--url", default=None, help="drive real sockets against daphne, e.g. ws://127.0.0.1:8000")
+    args = parser.parse_args()
+
+    if args.redis:
+        backend = "channels_redis.pubsub.RedisPubSubChannelLayer" if args.pubsub else "channels_redis.core.RedisChannelLayer"
+        settings.CHANNEL_LAYERS = {"default": {"BACKEND": backend,
+                                               "CONFIG": {"hosts": [args.redis]}}}
+        channel_layers.backends = {}
+    client_class = InProcessClient
+    if args.url:
+        SocketClient.base_url = args.url
+        client_class = SocketClient
+
+    watchers = args.watchers if args.scenario == "fanout" else 0
+    voice_users, watcher_tokens = prepare_fixtures(args.users, args.tent_size, watchers)
+    print(f"scenario {args.scenario}: {len(voice_users)} users, tent size {args.tent_size}, "
+          f"layer {settings.CHANNEL_LAYERS['default']['BACKEND']}, {'sockets' if args.url else 'in-process'}")
+
+    if args.scenario == "fanout":
+        asyncio.run(scenario_fanout(client_class, voice_users, watcher_tokens, args))
+    else:
+        scenario = {"join_leave": scenario_join_leave, "mesh": scenario_mesh, "ping": scenario_ping}[args.scenario]
+        asyncio.run(scenario(client_class, voice_users, args))
+
+
+if __name__ == "__main__":
+    main()
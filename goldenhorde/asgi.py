@@ -7,6 +7,7 @@ django.setup()
 
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 from hordes.routing import websocket_urlpatterns
 from .middlewares import HeaderTokenAuthMiddleware
@@ -20,4 +21,12 @@ application = ProtocolTypeRouter(
             HeaderTokenAuthMiddleware(URLRouter(websocket_urlpatterns))
         ),
     }
-)
\ No newline at end of file
+)
+
+if getattr(settings, "DRAIN_ON_SIGTERM", True):
+    from hordes.drain import DrainMiddleware
+    application = DrainMiddleware(application)
+
+if getattr(settings, "LOOP_WATCHDOG_ENABLED", False):
+    from .loopwatch import LoopWatchdogMiddleware
+    application = LoopWatchdogMiddleware(application)
\ No newline at end of file
@@ -0,0 +1,390 @@
+"""
+Channel layer backends: a single-host layer over a Unix domain socket, and a
+consistently hashed variant of `RedisChannelLayer` for several Redis shards.
+
+Several daphne processes on one box need cross-process signaling, which
+`InMemoryChannelLayer` cannot do, but Redis is an extra hop and an extra
+service for a small deployment. `ChannelBroker` is a small asyncio server that
+holds channel queues and group membership in memory; every worker talks to it
+through `UnixSocketChannelLayer`. `runworkers` hosts the broker itself when
+this backend is configured, or it can be run on its own with
+`manage.py runchannelbroker`.
+
+Semantics follow channels_redis: per-channel capacity (with `channel_capacity`
+patterns) raising `ChannelFull` on send, message expiry, group membership that
+expires after `group_expiry`, and group_send silently skipping full channels.
+Frames are length-prefixed msgpack, the same serialization channels_redis uses.
+
+Messages whose type is in `lossy_types` (presence `tent_event` and
+`tent_event_batch` by default) go to a separate low-priority lane per
+channel: receivers get them only when no other message is waiting, and when
+the lane is full the oldest is dropped instead of raising `ChannelFull`, so
+presence never takes signaling's capacity.
+
+    CHANNEL_LAYERS = {"default": {
+        "BACKEND": "goldenhorde.channel_layers.UnixSocketChannelLayer",
+        "CONFIG": {"path": "/run/goldenhorde/channels.sock", "capacity": 1500, "expiry": 3600},
+    }}
+"""
+import asyncio
+import itertools
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+import weakref
+from collections import defaultdict, deque
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from channels_redis.core import RedisChannelLayer
+from .sharding import shard_index
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = "/tmp/goldenhorde-channels.sock"
+HEADER = struct.Struct("!I")
+SWEEP_INTERVAL = 5
+
+
+def pack(obj):
+    body = msgpack.packb(obj, use_bin_type=True)
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(HEADER.size)
+    body = await reader.readexactly(HEADER.unpack(header)[0])
+    return msgpack.unpackb(body, raw=False)
+
+
+class ChannelBroker:
+    """In-memory channel queues and groups shared by the processes connected to one socket."""
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 lossy_types=("tent_event", "tent_event_batch"), lossy_capacity=None):
+        self.path = path
+        self.group_expiry = group_expiry
+        self.lossy_types = set(lossy_types)
+        self.lossy_capacity = lossy_capacity or capacity
+        # Reuse the base layer's capacity pattern matching and expiry bookkeeping
+        self.limits = BaseChannelLayer(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.channels = defaultdict(deque)  # channel -> deque of (expires_at, message)
+        self.lossy = defaultdict(deque)  # channel -> low-priority deque of (expires_at, message)
+        self.waiters = defaultdict(deque)  # channel -> deque of (writer, request id)
+        self.groups = defaultdict(dict)  # group -> {channel: expires_at}
+        self.server = None
+        self.sweeper = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle_client, path=self.path)
+        os.chmod(self.path, 0o600)
+        self.sweeper = asyncio.ensure_future(self.sweep())
+        logger.info("Channel broker listening on %s", self.path)
+
+    async def close(self):
+        self.sweeper.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def sweep(self):
+        while self.server is not None and self.server.is_serving():
+            await asyncio.sleep(SWEEP_INTERVAL)
+            now = time.time()
+            for queues in (self.channels, self.lossy):
+                for channel in list(queues):
+                    self.expire(queues[channel], now)
+                    if not queues[channel]:
+                        del queues[channel]
+            for group in list(self.groups):
+                members = self.groups[group]
+                for channel in [c for c, expires in members.items() if expires < now]:
+                    del members[channel]
+                if not members:
+                    del self.groups[group]
+
+    @staticmethod
+    def expire(queue, now):
+        while queue and queue[0][0] < now:
+            queue.popleft()
+
+    def deliver(self, channel, message):
+        """Hand a message to a waiting receiver or queue it; False when the channel is full"""
+        waiters = self.waiters.get(channel)
+        while waiters:
+            writer, rid = waiters.popleft()
+            if not writer.is_closing():
+                writer.write(pack(("ok", rid, message)))
+                return True
+        now = time.time()
+        if message.get("type") in self.lossy_types:
+            queue = self.lossy[channel]
+            self.expire(queue, now)
+            if len(queue) >= self.lossy_capacity:
+                queue.popleft()
+            queue.append((now + self.limits.expiry, message))
+            return True
+        queue = self.channels[channel]
+        self.expire(queue, now)
+        if len(queue) >= self.limits.get_capacity(channel):
+            return False
+        queue.append((now + self.limits.expiry, message))
+        return True
+
+    def receive(self, writer, rid, channel):
+        now = time.time()
+        for queues in (self.channels, self.lossy):
+            queue = queues.get(channel)
+            if queue:
+                self.expire(queue, now)
+            if queue:
+                writer.write(pack(("ok", rid, queue.popleft()[1])))
+                return
+        self.waiters[channel].append((writer, rid))
+
+    def cancel(self, writer, rid):
+        for waiters in self.waiters.values():
+            if (writer, rid) in waiters:
+                waiters.remove((writer, rid))
+                return
+
+    def group_send(self, group, message):
+        now = time.time()
+        members = self.groups.get(group, {})
+        for channel, expires in list(members.items()):
+            if expires < now:
+                del members[channel]
+            elif not self.deliver(channel, message):
+                logger.debug("Channel %s is full, dropping group message for %s", channel, group)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                op, rid, *args = await read_frame(reader)
+                if op == "receive":
+                    self.receive(writer, rid, *args)
+                    continue
+                if op == "cancel":
+                    self.cancel(writer, rid)
+                    continue
+                if op == "send":
+                    if not self.deliver(*args):
+                        writer.write(pack(("full", rid, args[0])))
+                        continue
+                elif op == "group_add":
+                    group, channel = args
+                    self.groups[group][channel] = time.time() + self.group_expiry
+                elif op == "group_discard":
+                    group, channel = args
+                    self.groups.get(group, {}).pop(channel, None)
+                elif op == "group_send":
+                    self.group_send(*args)
+                elif op == "flush":
+                    self.channels.clear()
+                    self.lossy.clear()
+                    self.groups.clear()
+                writer.write(pack(("ok", rid, None)))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            for waiters in self.waiters.values():
+                for waiter in [w for w in waiters if w[0] is writer]:
+                    waiters.remove(waiter)
+            writer.close()
+
+
+def start_broker_thread(timeout=10, **config):
+    """
+    Run a broker on its own event loop in a daemon thread; returns once it is listening.
+
+    Raises the broker's startup error (e.g. an unusable socket path), or
+    TimeoutError when it is not listening within `timeout` seconds.
+    """
+    broker = ChannelBroker(**config)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    failure = []
+
+    def run():
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(broker.start())
+        except BaseException as e:
+            failure.append(e)
+            loop.close()
+            return
+        finally:
+            started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="channel-broker", daemon=True).start()
+    if not started.wait(timeout):
+        raise TimeoutError(f"Channel broker did not start listening on {broker.path} within {timeout}s")
+    if failure:
+        raise failure[0]
+    return broker
+
+
+class BrokerConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}
+        self.ids = itertools.count()
+        self.reader_task = asyncio.ensure_future(self.read_replies())
+
+    @property
+    def closed(self):
+        return self.writer.is_closing() or self.reader_task.done()
+
+    async def read_replies(self):
+        try:
+            while True:
+                status, rid, payload = await read_frame(self.reader)
+                future = self.pending.pop(rid, None)
+                if future is None or future.done():
+                    if status == "ok" and payload is not None:
+                        logger.warning("Dropped a message for a cancelled receive")
+                    continue
+                if status == "full":
+                    future.set_exception(ChannelFull(payload))
+                else:
+                    future.set_result(payload)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            error = ConnectionError(f"Channel broker connection lost: {e}")
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+            self.writer.close()
+
+    async def request(self, op, *args):
+        rid = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[rid] = future
+        self.writer.write(pack((op, rid, *args)))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if self.pending.pop(rid, None) is not None and op == "receive" and not self.closed:
+                self.writer.write(pack(("cancel", rid)))
+            raise
+
+    def close(self):
+        self.reader_task.cancel()
+        self.writer.close()
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """Channel layer client for a `ChannelBroker` on the same host."""
+    extensions = ["groups", "flush"]
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, expiry=60, group_expiry=86400, capacity=100,
+                 channel_capacity=None, connect_timeout=5, lossy_types=None, lossy_capacity=None):
+        # lossy_types and lossy_capacity are applied by the broker
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.path = path
+        self.group_expiry = group_expiry
+        self.connect_timeout = connect_timeout
+        self.client_prefix = uuid.uuid4().hex
+        # One connection per event loop, as async_to_sync callers run on their own loops
+        self.connections = weakref.WeakKeyDictionary()
+
+    async def connection(self):
+        loop = asyncio.get_running_loop()
+        connection = self.connections.get(loop)
+        if connection is None or connection.closed:
+            reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), self.connect_timeout)
+            existing = self.connections.get(loop)
+            if existing is not None and not existing.closed:
+                writer.close()
+                return existing
+            connection = self.connections[loop] = BrokerConnection(reader, writer)
+        return connection
+
+    async def request(self, op, *args):
+        return await (await self.connection()).request(op, *args)
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        await self.request("send", channel, message)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        return await self.request("receive", channel)
+
+    async def new_channel(self, prefix="specific"):
+        return f"{prefix}.{self.client_prefix}!{uuid.uuid4().hex}"
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self.request("group_add", group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self.request("group_discard", group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_group_name(group)
+        await self.request("group_send", group, message)
+
+    async def flush(self):
+        await self.request("flush")
+
+    async def close(self):
+        for connection in list(self.connections.values()):
+            connection.close()
+        self.connections.clear()
+
+
+BROKER_OPTIONS = ("path", "expiry", "group_expiry", "capacity", "channel_capacity", "lossy_types", "lossy_capacity")
+
+
+def get_broker_config(alias="default"):
+    """Broker options from CHANNEL_LAYERS when `alias` uses this backend, else None"""
+    from django.conf import settings
+
+    layer = settings.CHANNEL_LAYERS.get(alias, {})
+    if layer.get("BACKEND") != f"{__name__}.{UnixSocketChannelLayer.__name__}":
+        return None
+    return {key: value for key, value in layer.get("CONFIG", {}).items() if key in BROKER_OPTIONS}
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    `RedisChannelLayer` that places groups and channels with `goldenhorde.sharding`.
+
+    channels_redis picks a host with crc32 modulo the host count, which remaps
+    almost every key when a host is added. Here the same consistent hash ring
+    as the presence cache is used, and `voice_chat_<tent_id>` groups are placed
+    by tent id. `shards` names the hosts (in the same order) so the ring stays
+    the same when only the database number or credentials differ.
+    """
+
+    def __init__(self, hosts=None, shards=None, **kwargs):
+        super().__init__(hosts=hosts, **kwargs)
+        self.shards = list(shards or [str(host) for host in self.hosts])
+        if len(self.shards) != self.ring_size:
+            raise ValueError("ShardedRedisChannelLayer needs one shard name per host")
+
+    def consistent_hash(self, value):
+        if isinstance(value, bytes):
+            value = value.decode()
+        if "!" in value:
+            # send() hashes "specific.<prefix>!<id>" but receive_single() reads
+            # "specific.<prefix>!"; both must land on the inbox's shard
+            value = value.split("!", 1)[0] + "!"
+        return shard_index(value, self.shards)
@@ -0,0 +1,160 @@
+"""
+Bounded thread pool for async code that needs the ORM.
+
+asgiref's `sync_to_async` runs consumer DB calls on its default executor,
+where every thread keeps its own Django connection with no sizing control:
+under load we either exhaust Postgres `max_connections` or queue without
+bound. `DBExecutor` runs them on a fixed pool instead, so each worker process
+holds at most DB_EXECUTOR_WORKERS connections. Those connections are reused
+across calls (CONN_MAX_AGE, with health checks) and recycled through
+`close_old_connections` around each call, as channels does. With psycopg 3
+installed, DB_POOL=true switches Django 5's connection pool on as well.
+
+Calls past DB_EXECUTOR_MAX_PENDING fail at once, and calls that wait longer
+than DB_EXECUTOR_TIMEOUT for a free thread are cancelled; both raise
+`DBExecutorSaturated` so callers can shed load instead of piling up.
+Cleanup that must not be dropped (disconnect, drain) runs inside
+`without_shedding()`: its calls skip both limits and wait for a thread.
+Context variables (handler stats, tracing, replica pinning) are carried into
+the pool thread and changes are copied back, like `sync_to_async`.
+
+Settings:
+    DB_EXECUTOR_WORKERS       pool threads, i.e. DB connections per process; 0 keeps
+                              asgiref's thread-sensitive `sync_to_async` (default 8 in
+                              production, 0 elsewhere)
+    DB_EXECUTOR_MAX_PENDING   running + queued calls allowed (default 200)
+    DB_EXECUTOR_TIMEOUT       seconds a call may wait for a thread (default 2)
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from .metrics import DB_EXECUTOR_ACTIVE, DB_EXECUTOR_PENDING, DB_EXECUTOR_REJECTED, DB_EXECUTOR_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Same as a full worker: the client should retry, possibly on another node
+SATURATED_CLOSE_CODE = 4503
+
+_shedding = contextvars.ContextVar("db_executor_shedding", default=True)
+
+
+class DBExecutorSaturated(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def without_shedding():
+    """DB calls in this block queue without limit or timeout instead of raising DBExecutorSaturated."""
+    token = _shedding.set(False)
+    try:
+        yield
+    finally:
+        _shedding.reset(token)
+
+
+def _restore_context(context):
+    for var, value in context.items():
+        try:
+            if var.get() is value:
+                continue
+        except LookupError:
+            pass
+        var.set(value)
+
+
+class DBExecutor:
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="db")
+            return self._executor
+
+    def _acquire(self, shed=True):
+        with self._lock:
+            if shed and self._pending >= self.max_pending:
+                DB_EXECUTOR_REJECTED.inc(reason="queue_full")
+                logger.warning("DB executor queue full (%s pending), rejecting", self._pending)
+                raise DBExecutorSaturated()
+            self._pending += 1
+            DB_EXECUTOR_PENDING.set(self._pending)
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+            DB_EXECUTOR_PENDING.set(self._pending)
+
+    @staticmethod
+    def _call(submitted_at, context, func, args, kwargs):
+        DB_EXECUTOR_WAIT_SECONDS.observe(time.perf_counter() - submitted_at)
+        DB_EXECUTOR_ACTIVE.inc()
+        close_old_connections()
+        try:
+            return context.run(func, *args, **kwargs)
+        finally:
+            close_old_connections()
+            DB_EXECUTOR_ACTIVE.dec()
+
+    async def run(self, func, *args, **kwargs):
+        if self.workers <= 0:
+            return await sync_to_async(func)(*args, **kwargs)
+        shed = _shedding.get()
+        self._acquire(shed)
+        context = contextvars.copy_context()
+        try:
+            future = self._get_executor().submit(self._call, time.perf_counter(), context, func, args, kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        result = asyncio.wrap_future(future)
+        try:
+            done, _ = await asyncio.wait({result}, timeout=self.timeout if shed else None)
+            if not done and future.cancel():
+                # Still queued behind busy threads: give up rather than pile on
+                DB_EXECUTOR_REJECTED.inc(reason="timeout")
+                raise DBExecutorSaturated()
+            # Already running calls are allowed to finish
+            return await result
+        finally:
+            _restore_context(context)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+db_executor = DBExecutor(
+    workers=getattr(settings, "DB_EXECUTOR_WORKERS", 8),
+    max_pending=getattr(settings, "DB_EXECUTOR_MAX_PENDING", 200),
+    timeout=getattr(settings, "DB_EXECUTOR_TIMEOUT", 2.0),
+)
+
+
+def db_async(func):
+    """Decorator: run a sync ORM function on the bounded DB executor."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await db_executor.run(func, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,150 @@
+"""
+Route presence and catalog reads to read replicas.
+
+Reads of the models in DATABASE_REPLICA_MODELS go to the aliases in
+DATABASE_REPLICAS, round-robin over the replicas that are currently healthy.
+Everything else, including auth and token lookups, stays on `default`.
+
+Health: each replica is probed at most every DATABASE_REPLICA_HEALTH_INTERVAL
+seconds per process (connectivity, plus replay lag on Postgres). A replica that
+fails or lags more than DATABASE_REPLICA_MAX_LAG seconds is skipped until a
+later probe succeeds. A query on a replica connection that fails with a
+connection-level error marks that replica unhealthy at once, so it is not
+chosen again until the next probe; replicas set a short `connect_timeout` so
+the probe cannot hang on a dead host. With no healthy replica, reads fall back
+to `default`.
+
+Read-your-writes: a write pins the current context (the HTTP request, or the
+WebSocket consumer, whose handlers share one context) to `default` for
+DATABASE_REPLICA_PIN_SECONDS, long enough to cover replication lag, so e.g.
+the participant list read right after `get_or_create` sees the new row.
+Reads inside a transaction on `default` stay there too.
+"""
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+_pinned_until = contextvars.ContextVar("replica_pinned_until", default=0.0)
+
+POSTGRES_LAG_SQL = (
+    "SELECT CASE WHEN pg_is_in_recovery() "
+    "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END"
+)
+
+
+def pin_to_primary(seconds=None):
+    seconds = getattr(settings, "DATABASE_REPLICA_PIN_SECONDS", 5) if seconds is None else seconds
+    _pinned_until.set(time.monotonic() + seconds)
+
+
+def is_pinned():
+    return _pinned_until.get() > time.monotonic()
+
+
+class ReplicaHealth:
+    """Cached per-process health of each replica alias."""
+
+    def __init__(self, interval, max_lag, clock=time.monotonic):
+        self.interval = interval
+        self.max_lag = max_lag
+        self.clock = clock
+        self.status = {}  # alias -> (checked_at, healthy)
+        self.lock = threading.Lock()
+
+    def is_healthy(self, alias):
+        with self.lock:
+            checked_at, healthy = self.status.get(alias, (None, True))
+            if checked_at is not None and self.clock() - checked_at < self.interval:
+                return healthy
+            # Claim the probe so concurrent callers use the previous answer meanwhile
+            self.status[alias] = (self.clock(), healthy)
+        healthy = self.probe(alias)
+        with self.lock:
+            self.status[alias] = (self.clock(), healthy)
+        return healthy
+
+    def mark_unhealthy(self, alias):
+        with self.lock:
+            self.status[alias] = (self.clock(), False)
+
+    def probe(self, alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor == "postgresql":
+                    cursor.execute(POSTGRES_LAG_SQL)
+                    lag = float(cursor.fetchone()[0] or 0)
+                else:
+                    cursor.execute("SELECT 1")
+                    lag = 0
+        except DatabaseError as e:
+            logger.warning("Replica %s is unreachable: %s", alias, e)
+            connection.close()
+            return False
+        if lag > self.max_lag:
+            logger.warning("Replica %s lags %.1fs behind the primary", alias, lag)
+            return False
+        return True
+
+
+class ReplicaRouter:
+    def __init__(self, replicas=None, models=None, health=None):
+        self.replicas = list(getattr(settings, "DATABASE_REPLICAS", []) if replicas is None else replicas)
+        self.models = set(getattr(settings, "DATABASE_REPLICA_MODELS", []) if models is None else models)
+        self.health = health or ReplicaHealth(
+            interval=getattr(settings, "DATABASE_REPLICA_HEALTH_INTERVAL", 5),
+            max_lag=getattr(settings, "DATABASE_REPLICA_MAX_LAG", 10),
+        )
+        self.counter = itertools.count()
+        connection_created.connect(self.install_health_wrapper)
+
+    def install_health_wrapper(self, sender, connection, **kwargs):
+        # Fires on every (re)connect of the same wrapper, so only add it once
+        if connection.alias in self.replicas and self.health_wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self.health_wrapper)
+
+    def health_wrapper(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except (OperationalError, InterfaceError):
+            alias = context["connection"].alias
+            logger.warning("Replica %s failed a query, skipping it until the next probe", alias)
+            self.health.mark_unhealthy(alias)
+            raise
+
+    def is_eligible(self, model):
+        return model._meta.label_lower in self.models
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or not self.is_eligible(model) or is_pinned():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        start = next(self.counter)
+        for offset in range(len(self.replicas)):
+            alias = self.replicas[(start + offset) % len(self.replicas)]
+            if self.health.is_healthy(alias):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *self.replicas}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in self.replicas:
+            return False
+        return None
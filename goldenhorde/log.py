@@ -0,0 +1,94 @@
+"""
+Non-blocking structured logging.
+
+`NonBlockingHandler` is a `QueueHandler`: the calling thread (often the event
+loop) only appends the record to an in-memory queue, and a `QueueListener`
+thread formats and writes it. Records are not pre-formatted on enqueue, so
+`logger.debug("... %s", value)` arguments are rendered on the listener thread.
+When the queue is full, records are dropped and counted instead of blocking.
+
+`EventSamplingFilter` keeps 1 in N records for high-frequency events, keyed by
+the `event` passed in `extra` (e.g. `extra={"event": "ping"}`).
+"""
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else came from `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class NonBlockingHandler(QueueHandler):
+    def __init__(self, queue_size=10000, fmt="json", stream=None):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.dropped = 0
+        target = logging.StreamHandler(stream or sys.stderr)
+        if fmt == "json":
+            target.setFormatter(JsonFormatter())
+        else:
+            target.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+        self.listener = QueueListener(self.queue, target)
+        self.listener.start()
+        self._listening = True
+
+    def close(self):
+        # Called by logging.shutdown(): flush what is queued and stop the listener
+        if self._listening:
+            self._listening = False
+            try:
+                self.listener.stop()
+            except queue.Full:
+                pass
+        super().close()
+
+    def prepare(self, record):
+        # Defer message formatting to the listener; only resolve the traceback,
+        # which references live frames
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class EventSamplingFilter(logging.Filter):
+    """Keep every Nth record of sampled events; `rates` maps event name to N."""
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+        self.counters = {}
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        every = self.rates.get(event) if event else None
+        if not every or every <= 1:
+            return True
+        seen = self.counters.get(event, 0)
+        self.counters[event] = seen + 1
+        if seen % every:
+            return False
+        record.sample_rate = every
+        return True
@@ -0,0 +1,178 @@
+"""
+Event-loop lag watchdog for daphne workers.
+
+A heartbeat task on the event loop wakes every `interval` seconds and records
+how late it ran (loop lag). A separate sampling thread checks the heartbeat;
+when the loop has not come back for longer than `threshold`, it grabs the
+loop thread's current stack with `sys._current_frames()` and attributes the
+stall to the innermost frame in project code. Worst offenders are exported as
+metrics and logged periodically.
+
+Opt-in through settings:
+    LOOP_WATCHDOG_ENABLED          start the watchdog with the ASGI app (default False)
+    LOOP_WATCHDOG_THRESHOLD_MS     stall duration that triggers a stack sample (default 100)
+    LOOP_WATCHDOG_INTERVAL_MS      heartbeat interval (default 20)
+    LOOP_WATCHDOG_REPORT_INTERVAL  seconds between worst-offender log lines (default 60)
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from django.conf import settings
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = registry.histogram(
+    "goldenhorde_event_loop_lag_seconds", "Event loop heartbeat lateness",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_STALLS = registry.counter("goldenhorde_event_loop_stalls_total", "Event loop stalls over threshold by call site", ["site"])
+LOOP_STALL_SECONDS = registry.counter("goldenhorde_event_loop_stall_seconds_total", "Time the event loop was blocked by call site", ["site"])
+
+PROJECT_ROOT = str(settings.BASE_DIR)
+
+
+def _is_project_frame(filename):
+    return filename.startswith(PROJECT_ROOT) and "site-packages" not in filename and os.sep + "venv" not in filename
+
+
+class Offender:
+    __slots__ = ("site", "count", "total", "worst", "stack")
+
+    def __init__(self, site):
+        self.site = site
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.stack = ""
+
+
+class LoopWatchdog:
+    def __init__(self, threshold=0.1, interval=0.02, report_interval=60):
+        self.threshold = threshold
+        self.interval = interval
+        self.report_interval = report_interval
+        self.offenders = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_beat = time.monotonic()
+        self._stop = threading.Event()
+        self._task = None
+        self._thread = None
+
+    def start(self, loop=None):
+        """Start on `loop` (default: the running loop). Must be called from the loop thread."""
+        self._loop = loop or asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = self._loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._sample, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info("Event loop watchdog started (threshold %.0fms)", self.threshold * 1000)
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while not self._stop.is_set():
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG_SECONDS.observe(max(0.0, now - expected))
+            self._last_beat = now
+
+    def _sample(self):
+        stalled_since = None
+        stall_site = None
+        last_report = time.monotonic()
+        while not self._stop.wait(self.interval / 2):
+            now = time.monotonic()
+            blocked_for = now - self._last_beat - self.interval
+            if blocked_for > self.threshold:
+                if stalled_since is None:
+                    stalled_since = self._last_beat
+                    stall_site = self._capture()
+            elif stalled_since is not None:
+                # Loop came back: charge the whole stall to the sampled site
+                self._record(stall_site, self._last_beat - stalled_since - self.interval)
+                stalled_since = stall_site = None
+            if self.report_interval and now - last_report >= self.report_interval:
+                last_report = now
+                self.log_report()
+
+    def _capture(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        stack = traceback.extract_stack(frame)
+        site_frame = next((f for f in reversed(stack) if _is_project_frame(f.filename)), stack[-1])
+        filename = site_frame.filename
+        if _is_project_frame(filename):
+            filename = os.path.relpath(filename, PROJECT_ROOT)
+        site = f"{filename}:{site_frame.lineno} {site_frame.name}"
+        return site, "".join(traceback.format_list(stack[-15:]))
+
+    def _record(self, sample, duration):
+        if sample is None:
+            return
+        site, stack = sample
+        with self._lock:
+            offender = self.offenders.get(site)
+            if offender is None:
+                offender = self.offenders[site] = Offender(site)
+            offender.count += 1
+            offender.total += duration
+            if duration > offender.worst:
+                offender.worst = duration
+                offender.stack = stack
+        LOOP_STALLS.inc(site=site)
+        LOOP_STALL_SECONDS.inc(duration, site=site)
+        logger.warning("Event loop blocked for %.0fms at %s\n%s", duration * 1000, site, stack)
+
+    def worst_offenders(self, limit=10):
+        with self._lock:
+            offenders = sorted(self.offenders.values(), key=lambda o: o.total, reverse=True)[:limit]
+            return [{"site": o.site, "count": o.count, "total_ms": round(o.total * 1000, 1),
+                     "worst_ms": round(o.worst * 1000, 1)} for o in offenders]
+
+    def log_report(self):
+        offenders = self.worst_offenders()
+        if offenders:
+            logger.warning("%s", json.dumps({"event": "loop_blocking_report", "offenders": offenders}))
+
+
+watchdog = None
+
+
+def start_loop_watchdog():
+    """Start the process-wide watchdog once, from inside the running event loop."""
+    global watchdog
+    if watchdog is not None:
+        return watchdog
+    watchdog = LoopWatchdog(
+        threshold=getattr(settings, "LOOP_WATCHDOG_THRESHOLD_MS", 100) / 1000,
+        interval=getattr(settings, "LOOP_WATCHDOG_INTERVAL_MS", 20) / 1000,
+        report_interval=getattr(settings, "LOOP_WATCHDOG_REPORT_INTERVAL", 60),
+    )
+    watchdog.start()
+    return watchdog
+
+
+class LoopWatchdogMiddleware:
+    """ASGI wrapper that starts the watchdog on the worker's loop with the first connection."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if watchdog is None:
+            start_loop_watchdog()
+        return await self.app(scope, receive, send)
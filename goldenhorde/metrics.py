@@ -0,0 +1,339 @@
+"""
+In-process metrics registry with Prometheus text exposition.
+
+Counters, gauges and histograms live in plain dicts in each worker process.
+When `METRICS_DIR` is set, a background thread in every process writes its
+values to `<METRICS_DIR>/<pid>.json` and the `/metrics` endpoint merges all
+files, so several daphne workers on one host are reported as one without an
+external collector. Metric operations never touch the disk, so they are safe
+on the event loop. Counters and histograms of exited workers are folded into
+`archive.json` so totals stay monotonic; their gauges are dropped.
+
+Settings:
+    METRICS_DIR             shared directory for multi-process aggregation (default unset)
+    METRICS_FLUSH_INTERVAL  seconds between per-process file writes (default 1.0)
+    METRICS_TOKEN           bearer token required by `/metrics` (default unset)
+    METRICS_REQUIRE_TOKEN   refuse to serve `/metrics` without METRICS_TOKEN (default on in production)
+    METRICS_MAX_SERIES      label combinations kept per metric (default 500)
+"""
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+OVERFLOW_LABEL = "other"
+ARCHIVE_NAME = "archive"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+
+    def _key(self, labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        if key not in self.series and len(self.series) >= self.registry.max_series:
+            # Bound cardinality, e.g. client-controlled message types
+            key = tuple(OVERFLOW_LABEL for _ in self.labelnames)
+        return key
+
+    def dump(self):
+        return {"type": self.type, "help": self.documentation, "labels": list(self.labelnames),
+                "samples": [[list(key), value] for key, value in self.series.items()]}
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        with self.registry.lock:
+            key = self._key(labels)
+            self.series[key] = self.series.get(key, 0) + amount
+        self.registry.start_flusher()
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        with self.registry.lock:
+            key = self._key(labels)
+            self.series[key] = self.series.get(key, 0) + amount
+        self.registry.start_flusher()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self.series[self._key(labels)] = value
+        self.registry.start_flusher()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        with self.registry.lock:
+            key = self._key(labels)
+            sample = self.series.get(key)
+            if sample is None:
+                sample = self.series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample["buckets"][i] += 1
+                    break
+            sample["sum"] += value
+            sample["count"] += 1
+        self.registry.start_flusher()
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def dump(self):
+        data = super().dump()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self, directory=None, flush_interval=1.0, max_series=500):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_series = max_series
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(self, name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def dump(self):
+        with self.lock:
+            return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def start_flusher(self):
+        """Start this process's flush thread; cheap to call on every metric operation."""
+        pid = os.getpid()
+        if not self.directory or self._flusher_pid == pid:
+            return
+        with self._flush_lock:
+            # Checked per pid, a forked worker needs its own thread
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            logger.warning("Could not create metrics directory %s: %s", self.directory, e)
+        threading.Thread(target=self._flush_forever, name="metrics-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write this process's values to `<pid>.json`; I/O errors are logged, never raised."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with self._flush_lock:
+            try:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self.dump(), f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning("Could not write metrics file %s: %s", path, e)
+
+    def archive_dead_workers(self):
+        """Fold the counters and histograms of exited workers into the archive and remove their files."""
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            name = os.path.basename(path).split(".")[0]
+            if not name.isdigit() or _pid_alive(int(name)):
+                continue
+            # Renaming claims the file, so concurrent scrapes archive it once
+            claimed = f"{path}.{os.getpid()}.claimed"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            try:
+                with open(claimed) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            try:
+                self._add_to_archive({name: metric for name, metric in data.items() if metric["type"] != "gauge"})
+                os.remove(claimed)
+            except OSError as e:
+                logger.warning("Could not archive metrics file %s: %s", path, e)
+
+    def _add_to_archive(self, data):
+        archive_path = os.path.join(self.directory, f"{ARCHIVE_NAME}.json")
+        with open(os.path.join(self.directory, f".{ARCHIVE_NAME}.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(archive_path) as f:
+                    archive = json.load(f)
+            except (OSError, ValueError):
+                archive = {}
+            merged = merge_dumps([archive, data])
+            tmp_path = f"{archive_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({
+                    name: {**metric, "samples": [[list(key), value] for key, value in metric["samples"].items()]}
+                    for name, metric in merged.items()
+                }, f)
+            os.replace(tmp_path, archive_path)
+
+    def collect(self):
+        """Metric dumps of this process and, in multi-process mode, every other worker."""
+        if not self.directory:
+            return [self.dump()]
+        self.flush()
+        self.archive_dead_workers()
+        dumps = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as f:
+                    dumps.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return dumps
+
+    def render(self):
+        return render_prometheus(merge_dumps(self.collect()))
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge_dumps(dumps):
+    merged = {}
+    for data in dumps:
+        for name, metric in data.items():
+            target = merged.setdefault(name, {**metric, "samples": {}})
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = value
+                elif metric["type"] == "histogram":
+                    current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                    current["sum"] += value["sum"]
+                    current["count"] += value["count"]
+                else:
+                    target["samples"][key] = current + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def render_prometheus(merged):
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for labels, value in sorted(metric["samples"].items()):
+            if metric["type"] == "histogram":
+                cumulative = 0
+                for bound, count in zip(metric["buckets"], value["buckets"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(metric['labels'], labels, {'le': bound})} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(metric['labels'], labels, {'le': '+Inf'})} {value['count']}")
+                lines.append(f"{name}_sum{_format_labels(metric['labels'], labels)} {value['sum']}")
+                lines.append(f"{name}_count{_format_labels(metric['labels'], labels)} {value['count']}")
+            else:
+                lines.append(f"{name}{_format_labels(metric['labels'], labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry(
+    directory=getattr(settings, "METRICS_DIR", None),
+    flush_interval=getattr(settings, "METRICS_FLUSH_INTERVAL", 1.0),
+    max_series=getattr(settings, "METRICS_MAX_SERIES", 500),
+)
+
+# Realtime signaling metrics
+WS_CONNECTIONS = registry.gauge("goldenhorde_ws_connections", "Open WebSocket connections", ["consumer"])
+TENT_CONNECTIONS = registry.gauge("goldenhorde_tent_connections", "Open voice chat connections per tent", ["tent"])
+WS_MESSAGES = registry.counter("goldenhorde_ws_messages_total", "Inbound WebSocket messages by type", ["consumer", "type"])
+WS_ADMISSIONS = registry.counter("goldenhorde_ws_admissions_total", "WebSocket handshakes admitted or rejected", ["consumer", "result"])
+PRESENCE_EVENTS = registry.counter("goldenhorde_presence_events_total", "Presence events sent, collapsed or dropped", ["outcome"])
+TENT_REGISTRY = registry.counter("goldenhorde_tent_registry_lookups_total", "Tent registry lookups by result", ["result"])
+DB_EXECUTOR_PENDING = registry.gauge("goldenhorde_db_executor_pending", "DB executor calls running or queued")
+DB_EXECUTOR_ACTIVE = registry.gauge("goldenhorde_db_executor_active", "DB executor calls running")
+DB_EXECUTOR_WAIT_SECONDS = registry.histogram("goldenhorde_db_executor_wait_seconds", "Time DB calls wait for an executor thread")
+DB_EXECUTOR_REJECTED = registry.counter("goldenhorde_db_executor_rejected_total", "DB calls rejected by a saturated executor", ["reason"])
+WS_CLOSES = registry.counter("goldenhorde_ws_closes_total", "WebSocket disconnects by close code", ["consumer", "code"])
+HANDLER_SECONDS = registry.histogram("goldenhorde_consumer_handler_seconds", "Consumer handler duration", ["consumer", "event"])
+LAYER_SEND_SECONDS = registry.histogram("goldenhorde_channel_layer_send_seconds", "Channel layer send latency", ["kind"])
+CACHE_OP_SECONDS = registry.histogram("goldenhorde_cache_op_seconds", "CacheManager operation latency", ["op"])
+WS_AUTH = registry.counter("goldenhorde_ws_auth_total", "WebSocket token authentications by result", ["result"])
+WS_AUTH_SECONDS = registry.histogram("goldenhorde_ws_auth_seconds", "WebSocket token authentication latency")
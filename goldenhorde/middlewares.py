@@ -1,8 +1,10 @@
 # HeaderTokenAuthMiddleware
 from urllib.parse import parse_qs
-from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from rest_framework.authtoken.models import Token
+from .db_executor import SATURATED_CLOSE_CODE, DBExecutorSaturated, db_async
+from .metrics import WS_AUTH, WS_AUTH_SECONDS
+from .tracing import span, start_trace
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,12 +20,29 @@ class HeaderTokenAuthMiddleware:
         self.inner = inner
 
     async def __call__(self, scope, receive, send):
-        logger.debug(f"HeaderTokenAuthMiddleware: Start processing for path {scope.get('path', '')}")
-        token_key = self.get_token_from_scope(scope)
-        scope["user"] = await self.get_user(token_key)
-        logger.debug(f"HeaderTokenAuthMiddleware: Finished authentication for path {scope.get('path', '')}")
+        logger.debug("HeaderTokenAuthMiddleware: Start processing for path %s", scope.get('path', ''), extra={"event": "connect"})
+        with start_trace("ws.auth", path=scope.get('path', '')) as root:
+            with span("auth.parse_token"):
+                token_key = self.get_token_from_scope(scope)
+            try:
+                with span("auth.token_lookup"), WS_AUTH_SECONDS.time():
+                    scope["user"] = await self.get_user(token_key)
+            except DBExecutorSaturated:
+                WS_AUTH.inc(result="saturated")
+                return await self.reject(receive, send)
+        # The consumer's connect span joins this trace
+        scope["trace_id"] = root.trace_id
+        logger.debug("HeaderTokenAuthMiddleware: Finished authentication for path %s", scope.get('path', ''), extra={"event": "connect"})
         return await self.inner(scope, receive, send)
 
+    async def reject(self, receive, send):
+        # Accept before closing so the client sees the retry code instead of a bare 403
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        await send({"type": "websocket.accept"})
+        await send({"type": "websocket.close", "code": SATURATED_CLOSE_CODE})
+
     def get_token_from_scope(self, scope):
         # Check query string
         query_string = scope.get('query_string', b'').decode()
@@ -39,40 +58,184 @@ class HeaderTokenAuthMiddleware:
                     return auth.split(' ', 1)[1]
         return None
 
-    @database_sync_to_async
+    @db_async
     def get_user(self, token_key):
         if not token_key:
+            WS_AUTH.inc(result="anonymous")
             return AnonymousUser()
         try:
-            token = Token.objects.get(key=token_key)
+            token = Token.objects.select_related("user").get(key=token_key)
+            WS_AUTH.inc(result="ok")
             return token.user
         except Token.DoesNotExist:
-            logger.warning(f"Failed WebSocket token authentication attempt with token: {token_key}")
+            WS_AUTH.inc(result="invalid")
+            logger.warning("Failed WebSocket token authentication attempt with token: %s", token_key)
             return AnonymousUser()
 
 
-# QueryCountMiddleware
+# QueryProfilingMiddleware
+import contextvars
+import json
+import random
+import re
+import time
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
 from django.db import connection
-from django.utils.deprecation import MiddlewareMixin
-import logging
+from django.db.backends.signals import connection_created
 
-logger = logging.getLogger(__name__)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:\s*(?:%s|\?)\s*,?)+\)", re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """Collapse literals and IN lists so repeated statements with different parameters compare equal."""
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    return _IN_LIST.sub("IN (...)", sql)
+
+
+class QueryProfile:
+    """`connection.execute_wrapper` callable that records every statement and its duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def duplicates(self, threshold):
+        """Normalized statements executed at least `threshold` times, a likely N+1."""
+        counts = Counter(normalize_sql(sql) for sql, _ in self.queries)
+        return {sql: count for sql, count in counts.most_common() if count >= threshold}
+
+    def slowest(self, limit):
+        return sorted(self.queries, key=lambda query: query[1], reverse=True)[:limit]
+
+
+_current_profile = contextvars.ContextVar("query_profile", default=None)
+
+
+def profile_execute_wrapper(execute, sql, params, many, context):
+    """Route statements to the profile of the request being served, if any."""
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def install_profile_wrapper(connection, **kwargs):
+    if profile_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_execute_wrapper)
+
+
+# Async views run their queries on sync_to_async threads, each with its own
+# connection; the request's profile reaches them through the context variable
+connection_created.connect(install_profile_wrapper, dispatch_uid="query_profile_wrapper")
+
+
+class QueryProfilingMiddleware:
+    """
+    Per-request query profiling that works with DEBUG off.
+
+    Statements are captured through an execute wrapper on every connection,
+    so nothing depends on `connection.queries`, and the middleware is
+    async-capable: async views keep running on the event loop. A sampled request logs one structured
+    `query_profile` line with the query count, DB time, repeated statements and
+    the slowest statements; requests above the slow threshold log at WARNING.
+
+    Settings:
+        QUERY_PROFILE_SAMPLE_RATE       fraction of requests profiled (default 1.0, 0.01 in production)
+        QUERY_PROFILE_SLOW_REQUEST_MS   slow request threshold (default 500)
+        QUERY_PROFILE_DUPLICATE_THRESHOLD  repeats that flag an N+1 (default 3)
+        QUERY_PROFILE_TOP_SLOWEST       slow statements included (default 3)
+        QUERY_PROFILE_SERVER_TIMING     add a Server-Timing header (default False)
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.sample_rate = getattr(settings, "QUERY_PROFILE_SAMPLE_RATE", 1.0)
+        self.slow_request_ms = getattr(settings, "QUERY_PROFILE_SLOW_REQUEST_MS", 500)
+        self.duplicate_threshold = getattr(settings, "QUERY_PROFILE_DUPLICATE_THRESHOLD", 3)
+        self.top_slowest = getattr(settings, "QUERY_PROFILE_TOP_SLOWEST", 3)
+        self.server_timing = getattr(settings, "QUERY_PROFILE_SERVER_TIMING", False)
+
+    def sampled(self):
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        install_profile_wrapper(connection)
+        profile = QueryProfile()
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return self.report(request, response, profile, start)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        profile = QueryProfile()
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return self.report(request, response, profile, start)
+
+    def report(self, request, response, profile, start):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        db_ms = profile.total_time * 1000
+
+        duplicates = profile.duplicates(self.duplicate_threshold)
+        is_slow = elapsed_ms >= self.slow_request_ms
+        record = {
+            "event": "query_profile",
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(elapsed_ms, 2),
+            "db_ms": round(db_ms, 2),
+            "queries": profile.count,
+            "duplicates": duplicates,
+        }
+        if is_slow or duplicates:
+            record["slowest"] = [
+                {"sql": sql, "ms": round(duration * 1000, 2)} for sql, duration in profile.slowest(self.top_slowest)
+            ]
+        logger.log(logging.WARNING if is_slow or duplicates else logging.INFO, "%s", json.dumps(record))
 
-class QueryCountMiddleware(MiddlewareMixin):
-    def process_request(self, request):
-        # Clear any existing queries before the request starts
-        connection.queries.clear()
-
-    def process_response(self, request, response):
-        # After the view logic and before sending the response
-        query_count = len(connection.queries)
-        print(f"Number of queries for {request.path}: {query_count}")
-        
-        # Optionally log the SQL queries (be mindful of sensitive information in production)
-        if query_count > 0:
-            for query in connection.queries:
-                # logger.info(f"SQL Query: {query['sql']}")
-                # logger.debug(f"SQL Query: {query['sql']}")
-                pass
-
-        return response
\ No newline at end of file
+        if self.server_timing:
+            response["Server-Timing"] = (
+                f'db;dur={db_ms:.2f};desc="{profile.count} queries", app;dur={elapsed_ms:.2f}'
+            )
+        return response
@@ -120,7 +120,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'goldenhorde.middlewares.QueryCountMiddleware',
+    'goldenhorde.middlewares.QueryProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'goldenhorde.urls'
@@ -160,8 +160,36 @@ DATABASES = {
         'PASSWORD': env('DB_PASSWORD', default='qwer123456'),
         'HOST': env('DB_HOST', default='localhost'),
         'PORT': env('DB_PORT', default='5432'),
+        # Executor threads keep their connection between calls (see goldenhorde/db_executor.py)
+        'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=60),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
+# Django 5 connection pool, psycopg 3 only; pooled connections need CONN_MAX_AGE 0
+if env.bool('DB_POOL', default=False):
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {'pool': {
+        'min_size': env.int('DB_POOL_MIN_SIZE', default=2),
+        'max_size': env.int('DB_POOL_MAX_SIZE', default=8),
+        'timeout': env.float('DB_POOL_TIMEOUT', default=5),
+    }}
+
+# Read replicas for presence and catalog reads (see goldenhorde/db_router.py)
+DATABASE_REPLICAS = []
+for index, host in enumerate(env.list('DB_REPLICA_HOSTS', default=[])):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'},
+        # The health probe runs inline in db_for_read, so a dead host must fail fast
+        'OPTIONS': {**DATABASES['default'].get('OPTIONS', {}),
+                    'connect_timeout': env.int('DB_REPLICA_CONNECT_TIMEOUT', default=2)},
+    }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_REPLICA_MODELS = ['hordes.horde', 'hordes.tent', 'hordes.tentparticipant']
+DATABASE_REPLICA_HEALTH_INTERVAL = env.float('DB_REPLICA_HEALTH_INTERVAL', default=5)
+DATABASE_REPLICA_MAX_LAG = env.float('DB_REPLICA_MAX_LAG', default=10)
+DATABASE_REPLICA_PIN_SECONDS = env.float('DB_REPLICA_PIN_SECONDS', default=5)
+DATABASE_ROUTERS = ['goldenhorde.db_router.ReplicaRouter']
 
 # else:
 #     DATABASES = {
@@ -197,6 +225,68 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Query profiling (see goldenhorde/middlewares.py QueryProfilingMiddleware)
+QUERY_PROFILE_SAMPLE_RATE = env.float('QUERY_PROFILE_SAMPLE_RATE', default=0.01 if ENVIRONMENT == 'production' else 1.0)
+QUERY_PROFILE_SLOW_REQUEST_MS = env.int('QUERY_PROFILE_SLOW_REQUEST_MS', default=500)
+QUERY_PROFILE_DUPLICATE_THRESHOLD = env.int('QUERY_PROFILE_DUPLICATE_THRESHOLD', default=3)
+QUERY_PROFILE_TOP_SLOWEST = env.int('QUERY_PROFILE_TOP_SLOWEST', default=3)
+QUERY_PROFILE_SERVER_TIMING = env.bool('QUERY_PROFILE_SERVER_TIMING', default=ENVIRONMENT != 'production')
+
+# Prometheus metrics (see goldenhorde/metrics.py), METRICS_DIR enables multi-process aggregation
+METRICS_DIR = env('METRICS_DIR', default=None)
+METRICS_FLUSH_INTERVAL = env.float('METRICS_FLUSH_INTERVAL', default=1.0)
+METRICS_MAX_SERIES = env.int('METRICS_MAX_SERIES', default=500)
+METRICS_TOKEN = env('METRICS_TOKEN', default=None)
+METRICS_REQUIRE_TOKEN = env.bool('METRICS_REQUIRE_TOKEN', default=ENVIRONMENT == 'production')
+
+# Event loop lag watchdog (see goldenhorde/loopwatch.py)
+LOOP_WATCHDOG_ENABLED = env.bool('LOOP_WATCHDOG_ENABLED', default=False)
+LOOP_WATCHDOG_THRESHOLD_MS = env.int('LOOP_WATCHDOG_THRESHOLD_MS', default=100)
+LOOP_WATCHDOG_INTERVAL_MS = env.int('LOOP_WATCHDOG_INTERVAL_MS', default=20)
+LOOP_WATCHDOG_REPORT_INTERVAL = env.int('LOOP_WATCHDOG_REPORT_INTERVAL', default=60)
+
+# Connect path tracing (see goldenhorde/tracing.py), summarize with `manage.py trace_summary`
+TRACING_ENABLED = env.bool('TRACING_ENABLED', default=False)
+TRACE_FILE = env('TRACE_FILE', default=os.path.join(BASE_DIR, 'traces.jsonl'))
+TRACE_SAMPLE_RATE = env.float('TRACE_SAMPLE_RATE', default=1.0)
+
+# Signaling capture for replay (see hordes/capture.py)
+SIGNAL_CAPTURE_ENABLED = env.bool('SIGNAL_CAPTURE_ENABLED', default=False)
+SIGNAL_CAPTURE_FILE = env('SIGNAL_CAPTURE_FILE', default=os.path.join(BASE_DIR, 'signaling-capture.jsonl'))
+
+# Graceful drain on SIGTERM (see hordes/drain.py)
+DRAIN_ON_SIGTERM = env.bool('DRAIN_ON_SIGTERM', default=True)
+DRAIN_WAVE_SIZE = env.int('DRAIN_WAVE_SIZE', default=200)
+DRAIN_WAVE_INTERVAL = env.float('DRAIN_WAVE_INTERVAL', default=0.5)
+RECONNECT_BACKOFF_MIN_MS = env.int('RECONNECT_BACKOFF_MIN_MS', default=1000)
+RECONNECT_BACKOFF_MAX_MS = env.int('RECONNECT_BACKOFF_MAX_MS', default=15000)
+
+# WebSocket admission control, 0 disables a limit (see hordes/admission.py)
+ADMISSION_MAX_CONNECTIONS = env.int('ADMISSION_MAX_CONNECTIONS', default=0)
+ADMISSION_MAX_TENT_PARTICIPANTS = env.int('ADMISSION_MAX_TENT_PARTICIPANTS', default=0)
+ADMISSION_HANDSHAKE_RATE = env.float('ADMISSION_HANDSHAKE_RATE', default=0)
+ADMISSION_HANDSHAKE_BURST = env.int('ADMISSION_HANDSHAKE_BURST', default=0)
+ADMISSION_SEAT_TTL = env.int('ADMISSION_SEAT_TTL', default=300)
+
+# Process-local tent metadata cache (see hordes/registry.py)
+TENT_REGISTRY_SIZE = env.int('TENT_REGISTRY_SIZE', default=10000)
+TENT_REGISTRY_TTL = env.int('TENT_REGISTRY_TTL', default=300)
+TENT_REGISTRY_NEGATIVE_TTL = env.int('TENT_REGISTRY_NEGATIVE_TTL', default=30)
+
+# Presence priority lane, 0 sends presence immediately (see hordes/lanes.py)
+PRESENCE_FLUSH_INTERVAL = env.float('PRESENCE_FLUSH_INTERVAL', default=0.05)
+PRESENCE_MAX_PENDING = env.int('PRESENCE_MAX_PENDING', default=500)
+
+# Bounded DB executor for consumer and auth queries (see goldenhorde/db_executor.py)
+DB_EXECUTOR_WORKERS = env.int('DB_EXECUTOR_WORKERS', default=8 if ENVIRONMENT == 'production' else 0)
+DB_EXECUTOR_MAX_PENDING = env.int('DB_EXECUTOR_MAX_PENDING', default=200)
+DB_EXECUTOR_TIMEOUT = env.float('DB_EXECUTOR_TIMEOUT', default=2)
+
+# Password hashing process pool (see membership/hashing.py)
+PASSWORD_HASHING_WORKERS = env.int('PASSWORD_HASHING_WORKERS', default=2)
+PASSWORD_HASHING_MAX_PENDING = env.int('PASSWORD_HASHING_MAX_PENDING', default=32)
+PASSWORD_HASHING_TIMEOUT = env.int('PASSWORD_HASHING_TIMEOUT', default=10)
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -234,12 +324,21 @@ WS_CACHE_TTL = env.int('WS_CACHE_TTL', default=3600)  # 1 hour default
 # 24 hours for long connections
 WS_CACHE_EXTENDED_TTL = env.int('WS_CACHE_EXTENDED_TTL', default=86400)
 
+# Seconds between consumer_stats log lines (see hordes/instrumentation.py), 0 disables
+CONSUMER_STATS_LOG_INTERVAL = env.int('CONSUMER_STATS_LOG_INTERVAL', default=60)
+
 
 if ENVIRONMENT == 'production':
     STATIC_URL = 'static/'
     STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 
+# Channel layer flavour: 'redis' (lists), 'redis-pubsub' or 'unix' (single host)
+CHANNEL_LAYER = env('CHANNEL_LAYER', default='redis')
+# Comma-separated Redis base URLs; when set, the presence cache and the 'redis'
+# channel layer are sharded by tent id / username (see goldenhorde/sharding.py)
+REDIS_SHARDS = env.list('REDIS_SHARDS', default=[])
+
 if ENVIRONMENT == 'development':
     # if False:
     CACHES = {
@@ -293,24 +392,82 @@ else:
             },
         },
     }
+    if REDIS_SHARDS:
+        for index, shard in enumerate(REDIS_SHARDS):
+            CACHES[f"presence_{index}"] = {
+                "BACKEND": "django.core.cache.backends.redis.RedisCache",
+                "LOCATION": shard + "/" + cache_db_number,
+                "TIMEOUT": 3600,
+            }
+        CHANNEL_LAYERS["default"]["BACKEND"] = "goldenhorde.channel_layers.ShardedRedisChannelLayer"
+        CHANNEL_LAYERS["default"]["CONFIG"]["hosts"] = [shard + "/" + channel_layers_db_number for shard in REDIS_SHARDS]
+        CHANNEL_LAYERS["default"]["CONFIG"]["shards"] = REDIS_SHARDS
+    if CHANNEL_LAYER == 'redis-pubsub':
+        # One PUBLISH per group_send instead of one list push per member; messages
+        # for channels nobody is subscribed to are dropped rather than queued
+        CHANNEL_LAYERS = {
+            "default": {
+                "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+                "CONFIG": {
+                    "hosts": [channel_layers_redist_host],
+                },
+            },
+        }
+
+# Several workers on one host can share a Unix socket broker instead of Redis
+# (see goldenhorde/channel_layers.py)
+if CHANNEL_LAYER == 'unix':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "goldenhorde.channel_layers.UnixSocketChannelLayer",
+            "CONFIG": {
+                "path": env('CHANNEL_LAYER_SOCKET', default='/tmp/goldenhorde-channels.sock'),
+                "capacity": 1500,
+                "expiry": 3600,
+                "group_expiry": 86400,
+                "channel_capacity": {
+                    "http.request": 100,
+                    "http.response!*": 100,
+                    "websocket.send!*": 100,
+                },
+            },
+        },
+    }
+
+# Logging: non-blocking queue handler (see goldenhorde/log.py)
+LOG_LEVEL = env('LOG_LEVEL', default='INFO' if ENVIRONMENT == 'production' else 'DEBUG')
+LOG_FORMAT = env('LOG_FORMAT', default='json' if ENVIRONMENT == 'production' else 'text')
+# Keep 1 in N records of high-frequency consumer events
+LOG_SAMPLE_RATES = {
+    'ping': env.int('LOG_SAMPLE_PING', default=100),
+    'ice': env.int('LOG_SAMPLE_ICE', default=20),
+    'signal': env.int('LOG_SAMPLE_SIGNAL', default=1),
+}
 
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'event_sampling': {
+            '()': 'goldenhorde.log.EventSamplingFilter',
+            'rates': LOG_SAMPLE_RATES,
+        },
+    },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
+            '()': 'goldenhorde.log.NonBlockingHandler',
+            'fmt': LOG_FORMAT,
+            'filters': ['event_sampling'],
         },
     },
     'root': {
         'handlers': ['console'],
-        'level': 'DEBUG',  # or 'DEBUG' for more verbosity
+        'level': LOG_LEVEL,
     },
     'loggers': {
-        '': {
-            'handlers': ['console'],
-            'level': 'DEBUG',  # or 'DEBUG'
-            'propagate': True,
+        # SQL at DEBUG is far too chatty for the hot paths
+        'django.db.backends': {
+            'level': 'INFO',
         },
     },
 }
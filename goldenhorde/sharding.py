@@ -0,0 +1,90 @@
+"""
+Consistent hashing of tents and users onto Redis shards.
+
+With `REDIS_SHARDS` set (a list of Redis base URLs) the presence cache and the
+channel layer are both spread over the shards using the same `HashRing`, so a
+tent's `voice_chat_<id>` group and its seat counter live on one shard and a
+user's channel and tent entries on another. Each shard owns many virtual
+points on the ring; adding a shard only moves the keys that land on its new
+points (about 1/N of them), and removing one only moves that shard's keys.
+
+Shard keys:
+    voice_chat_<tent_id>, tent:<tent_id>    -> "tent:<tent_id>"
+    presence entries of a user              -> the username
+    anything else                           -> the name itself
+"""
+import bisect
+import hashlib
+import re
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import caches
+
+TENT_GROUP = re.compile(r"^voice_chat_(\w+)$")
+DEFAULT_REPLICAS = 160
+
+
+class HashRing:
+    def __init__(self, nodes=(), replicas=DEFAULT_REPLICAS):
+        self.replicas = replicas
+        self.ring = []
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def add_node(self, node):
+        for replica in range(self.replicas):
+            bisect.insort(self.ring, (self.hash(f"{node}#{replica}"), node))
+
+    def remove_node(self, node):
+        self.ring = [point for point in self.ring if point[1] != node]
+
+    def get_node(self, key):
+        if not self.ring:
+            raise ValueError("HashRing has no nodes")
+        index = bisect.bisect(self.ring, (self.hash(key), "")) % len(self.ring)
+        return self.ring[index][1]
+
+
+def shard_key(name):
+    """Map a group name or presence key to the value it is sharded on"""
+    match = TENT_GROUP.match(name)
+    if match:
+        return f"tent:{match.group(1)}"
+    return name
+
+
+def tent_shard_key(tent_id):
+    return f"tent:{tent_id}"
+
+
+@lru_cache(maxsize=None)
+def get_ring(shards):
+    return HashRing(shards)
+
+
+def shard_index(key, shards):
+    """Position in `shards` of the shard that owns `key`"""
+    return shards.index(get_ring(tuple(shards)).get_node(shard_key(key)))
+
+
+def presence_cache_alias(index):
+    return f"presence_{index}"
+
+
+def presence_cache(key):
+    """The cache holding presence entries for `key` (a username or tent_shard_key)"""
+    shards = getattr(settings, "REDIS_SHARDS", None)
+    if not shards:
+        return caches["default"]
+    return caches[presence_cache_alias(shard_index(key, shards))]
+
+
+def presence_caches():
+    shards = getattr(settings, "REDIS_SHARDS", None)
+    if not shards:
+        return [caches["default"]]
+    return [caches[presence_cache_alias(index)] for index in range(len(shards))]
@@ -0,0 +1,432 @@
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from unittest import mock, skipUnless
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+import tempfile
+import threading
+from asgiref.sync import iscoroutinefunction
+from channels.exceptions import ChannelFull
+from .channel_layers import ChannelBroker, ShardedRedisChannelLayer, UnixSocketChannelLayer, start_broker_thread
+from .db_executor import DBExecutor, DBExecutorSaturated, without_shedding
+from .db_router import ReplicaHealth, ReplicaRouter, _pinned_until
+from .log import EventSamplingFilter, JsonFormatter, NonBlockingHandler
+from .loopwatch import LoopWatchdog
+from .metrics import Registry, merge_dumps
+from .middlewares import QueryProfile, QueryProfilingMiddleware, normalize_sql
+from .sharding import HashRing, presence_cache, shard_index, shard_key
+from hordes.models import Tent
+
+
+User = get_user_model()
+
+
+class NormalizeSqlTestCase(TestCase):
+    def test_literals_and_in_lists_collapse(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE id = 12 AND name = 'khan' AND x IN (%s, %s, %s)"),
+            "SELECT * FROM t WHERE id = ? AND name = ? AND x IN (...)",
+        )
+
+
+class QueryProfileTestCase(TestCase):
+    def test_records_queries_and_detects_repeats(self):
+        User.objects.create_user(username='rider', password='riderpass123')
+        profile = QueryProfile()
+        with connection.execute_wrapper(profile):
+            for _ in range(3):
+                list(User.objects.filter(username='rider'))
+        self.assertEqual(profile.count, 3)
+        self.assertEqual(len(profile.duplicates(3)), 1)
+        self.assertGreaterEqual(profile.total_time, 0)
+
+
+@override_settings(DEBUG=False, QUERY_PROFILE_SERVER_TIMING=True, QUERY_PROFILE_SAMPLE_RATE=1.0)
+class QueryProfilingMiddlewareTestCase(TestCase):
+    def test_server_timing_header_with_debug_off(self):
+        with self.assertLogs('goldenhorde.middlewares', level='INFO') as logs:
+            response = self.client.get('/api/hordes/')
+        self.assertIn('Server-Timing', response)
+        self.assertIn('"event": "query_profile"', logs.output[-1])
+
+    def test_is_async_capable(self):
+        async def get_response(request):
+            return HttpResponse()
+        self.assertTrue(iscoroutinefunction(QueryProfilingMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(QueryProfilingMiddleware(lambda request: HttpResponse())))
+
+    async def test_profiles_async_views(self):
+        with self.assertLogs('goldenhorde.middlewares', level='INFO') as logs:
+            response = await self.async_client.get('/api/hordes/async/')
+        self.assertIn('Server-Timing', response)
+        self.assertIn('"event": "query_profile"', logs.output[-1])
+
+
+class MetricsRegistryTestCase(TestCase):
+    def test_render_prometheus_text(self):
+        registry = Registry()
+        registry.counter("messages_total", "Messages", ["type"]).inc(type="ping")
+        registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0)).observe(0.5)
+        text = registry.render()
+        self.assertIn('# TYPE messages_total counter', text)
+        self.assertIn('messages_total{type="ping"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 0', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn('latency_seconds_count 1', text)
+
+    def test_series_cardinality_is_bounded(self):
+        registry = Registry(max_series=2)
+        counter = registry.counter("messages_total", "Messages", ["type"])
+        for message_type in ("a", "b", "c", "d"):
+            counter.inc(type=message_type)
+        self.assertEqual(counter.series[("other",)], 2)
+
+    def test_merges_worker_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = Registry(directory=directory)
+            registry.counter("messages_total", "Messages").inc(3)
+            registry.gauge("connections", "Connections").set(2)
+            # A worker that has exited: counters are kept, gauges dropped
+            other = Registry()
+            other.counter("messages_total", "Messages").inc(4)
+            other.gauge("connections", "Connections").set(5)
+            with open(os.path.join(directory, "999999999.json"), "w") as f:
+                json.dump(other.dump(), f)
+            merged = merge_dumps(registry.collect())
+            # The exited worker's file is folded into the archive
+            self.assertFalse(os.path.exists(os.path.join(directory, "999999999.json")))
+            merged_again = merge_dumps(registry.collect())
+        self.assertEqual(merged["messages_total"]["samples"][()], 7)
+        self.assertEqual(merged["connections"]["samples"][()], 2)
+        self.assertEqual(merged_again["messages_total"]["samples"][()], 7)
+
+    def test_metric_operations_do_not_write_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = Registry(directory=directory, flush_interval=60)
+            registry.counter("messages_total", "Messages").inc()
+            self.assertEqual(os.listdir(directory), [])
+            registry.flush()
+            self.assertEqual(os.listdir(directory), [f"{os.getpid()}.json"])
+
+    def test_metrics_endpoint(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE goldenhorde_ws_connections gauge', response.content.decode())
+
+    @override_settings(METRICS_TOKEN=None, METRICS_REQUIRE_TOKEN=True)
+    def test_metrics_endpoint_requires_token_when_configured(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+class LoopWatchdogTestCase(TestCase):
+    def test_blocking_call_site_is_reported(self):
+        async def scenario():
+            watchdog = LoopWatchdog(threshold=0.05, interval=0.01, report_interval=0)
+            watchdog.start()
+            await asyncio.sleep(0.05)
+            block_the_loop(0.3)
+            await asyncio.sleep(0.1)
+            watchdog.stop()
+            return watchdog.worst_offenders()
+
+        with self.assertLogs('goldenhorde.loopwatch', level='WARNING'):
+            offenders = asyncio.run(scenario())
+        self.assertTrue(offenders)
+        self.assertIn('block_the_loop', offenders[0]['site'])
+        self.assertGreaterEqual(offenders[0]['worst_ms'], 150)
+
+
+class LoggingPipelineTestCase(TestCase):
+    def make_record(self, msg, *args, **extra):
+        record = logging.LogRecord("hordes.consumers", logging.DEBUG, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_sampling_keeps_one_in_n(self):
+        sampling = EventSamplingFilter({"ping": 10})
+        kept = [sampling.filter(self.make_record("ping", event="ping")) for _ in range(30)]
+        self.assertEqual(kept.count(True), 3)
+        self.assertTrue(sampling.filter(self.make_record("joined", event="connect")))
+
+    def test_json_formatter_includes_extra(self):
+        line = JsonFormatter().format(self.make_record("User %s joined", "khan", event="connect", tent_id="3"))
+        data = json.loads(line)
+        self.assertEqual(data["msg"], "User khan joined")
+        self.assertEqual(data["event"], "connect")
+        self.assertEqual(data["tent_id"], "3")
+
+    def test_handler_drops_instead_of_blocking(self):
+        stream = io.StringIO()
+        handler = NonBlockingHandler(queue_size=1, stream=stream)
+        handler.close()
+        for i in range(5):
+            handler.handle(self.make_record("message %s", i))
+        self.assertEqual(handler.dropped, 4)
+
+
+class UnixSocketChannelLayerTestCase(TestCase):
+    async def start_broker(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'channels.sock')
+        self.broker = ChannelBroker(path=self.path, capacity=2)
+        await self.broker.start()
+        self.sender = UnixSocketChannelLayer(path=self.path)
+        self.receiver = UnixSocketChannelLayer(path=self.path)
+
+    async def stop_broker(self):
+        await self.sender.close()
+        await self.receiver.close()
+        await self.broker.close()
+
+    def test_broker_thread_reports_startup_errors(self):
+        with self.assertRaises(OSError):
+            start_broker_thread(path=os.path.join(tempfile.mkdtemp(), 'missing', 'channels.sock'))
+
+    async def test_send_receive_and_capacity(self):
+        await self.start_broker()
+        try:
+            channel = await self.receiver.new_channel()
+            waiting = asyncio.ensure_future(self.receiver.receive(channel))
+            await self.sender.send(channel, {'type': 'signal', 'sdp': b'\x00v=0'})
+            self.assertEqual(await waiting, {'type': 'signal', 'sdp': b'\x00v=0'})
+
+            await self.sender.send(channel, {'type': 'one'})
+            await self.sender.send(channel, {'type': 'two'})
+            with self.assertRaises(ChannelFull):
+                await self.sender.send(channel, {'type': 'three'})
+            self.assertEqual((await self.receiver.receive(channel))['type'], 'one')
+        finally:
+            await self.stop_broker()
+
+    async def test_group_send_reaches_members_across_layers(self):
+        await self.start_broker()
+        try:
+            members = [await self.receiver.new_channel() for _ in range(3)]
+            for channel in members:
+                await self.receiver.group_add('voice_chat_1', channel)
+            await self.receiver.group_discard('voice_chat_1', members[0])
+            await self.sender.group_send('voice_chat_1', {'type': 'tent_event'})
+            for channel in members[1:]:
+                self.assertEqual(await self.receiver.receive(channel), {'type': 'tent_event'})
+
+            # Presence sits in a lossy lane behind signaling and never fills the channel
+            for i in range(5):
+                await self.sender.send(members[1], {'type': 'tent_event', 'i': i})
+            await self.sender.send(members[1], {'type': 'voice_chat_config'})
+            self.assertEqual((await self.receiver.receive(members[1]))['type'], 'voice_chat_config')
+            self.assertEqual([(await self.receiver.receive(members[1]))['i'] for _ in range(2)], [3, 4])
+
+            # A cancelled receive must not swallow the next message
+            waiting = asyncio.ensure_future(self.receiver.receive(members[0]))
+            await asyncio.sleep(0.05)
+            waiting.cancel()
+            await asyncio.sleep(0.05)
+            await self.sender.send(members[0], {'type': 'after_cancel'})
+            self.assertEqual(await self.receiver.receive(members[0]), {'type': 'after_cancel'})
+        finally:
+            await self.stop_broker()
+
+
+class ShardingTestCase(TestCase):
+    def test_adding_a_shard_only_moves_keys_onto_it(self):
+        keys = [f'tent:{i}' for i in range(2000)] + [f'rider{i}' for i in range(2000)]
+        ring = HashRing(['redis://a', 'redis://b', 'redis://c'])
+        before = {key: ring.get_node(key) for key in keys}
+        ring.add_node('redis://d')
+        moved = [key for key in keys if ring.get_node(key) != before[key]]
+        self.assertTrue(all(ring.get_node(key) == 'redis://d' for key in moved))
+        self.assertLess(len(moved), len(keys) * 0.4)
+        self.assertGreater(len(moved), len(keys) * 0.1)
+
+    def test_tent_group_and_tent_keys_share_a_shard(self):
+        shards = ['redis://a', 'redis://b', 'redis://c']
+        self.assertEqual(shard_key('voice_chat_42'), 'tent:42')
+        self.assertEqual(shard_index('voice_chat_42', shards), shard_index('tent:42', shards))
+        self.assertEqual(shard_key('tent_events'), 'tent_events')
+
+    @override_settings(
+        REDIS_SHARDS=['redis://a', 'redis://b'],
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+            'presence_0': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'presence-0'},
+            'presence_1': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'presence-1'},
+        },
+    )
+    def test_presence_entries_follow_the_username(self):
+        from hordes.consumers import CacheManager
+
+        usernames = [f'rider{i}' for i in range(20)]
+        for username in usernames:
+            CacheManager.set_user_channel(username, f'specific.{username}')
+        shards = {shard_index(username, ['redis://a', 'redis://b']) for username in usernames}
+        self.assertEqual(shards, {0, 1})
+        for username in usernames:
+            self.assertEqual(presence_cache(username).get(CacheManager.get_user_channel_key(username)), f'specific.{username}')
+            self.assertEqual(CacheManager.get_user_channel(username), f'specific.{username}')
+        CacheManager.delete_users(usernames)
+        self.assertTrue(all(CacheManager.get_user_channel(username) is None for username in usernames))
+
+
+class ShardedRedisChannelLayerTestCase(TestCase):
+    SHARDS = ['redis://a:6379', 'redis://b:6379', 'redis://c:6379']
+
+    def test_specific_channels_hash_like_their_inbox(self):
+        layer = ShardedRedisChannelLayer(hosts=self.SHARDS, shards=self.SHARDS)
+        indexes = set()
+        for _ in range(50):
+            prefix = f'specific.{uuid.uuid4().hex}!'
+            channel = f'{prefix}{uuid.uuid4().hex}'
+            self.assertEqual(layer.consistent_hash(channel), layer.consistent_hash(prefix))
+            self.assertEqual(layer.consistent_hash(channel.encode()), layer.consistent_hash(prefix))
+            indexes.add(layer.consistent_hash(prefix))
+        self.assertEqual(indexes, {0, 1, 2})
+
+    @skipUnless(os.environ.get('TEST_REDIS_SHARDS'), 'set TEST_REDIS_SHARDS to two or more Redis URLs')
+    async def test_send_receive_specific_channel_across_shards(self):
+        shards = os.environ['TEST_REDIS_SHARDS'].split(',')
+        receiver = ShardedRedisChannelLayer(hosts=shards, shards=shards)
+        sender = ShardedRedisChannelLayer(hosts=shards, shards=shards)
+        try:
+            for i in range(10):
+                channel = await receiver.new_channel()
+                await sender.send(channel, {'type': 'signal', 'n': i})
+                message = await asyncio.wait_for(receiver.receive(channel), timeout=5)
+                self.assertEqual(message, {'type': 'signal', 'n': i})
+        finally:
+            await receiver.flush()
+            await receiver.close_pools()
+            await sender.close_pools()
+
+
+class ScriptedHealth(ReplicaHealth):
+    def __init__(self, down=()):
+        super().__init__(interval=60, max_lag=10)
+        self.down = set(down)
+        self.probes = []
+
+    def probe(self, alias):
+        self.probes.append(alias)
+        return alias not in self.down
+
+
+class ReplicaRouterTestCase(SimpleTestCase):
+    def setUp(self):
+        token = _pinned_until.set(0.0)
+        self.addCleanup(_pinned_until.reset, token)
+        patcher = mock.patch.object(connections['default'], 'in_atomic_block', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def router(self, down=()):
+        return ReplicaRouter(replicas=['replica_0', 'replica_1', 'replica_2'], models=['hordes.tent'],
+                             health=ScriptedHealth(down))
+
+    def test_round_robin_over_healthy_replicas(self):
+        router = self.router(down={'replica_1'})
+        picks = [router.db_for_read(Tent) for _ in range(6)]
+        self.assertNotIn('replica_1', picks)
+        self.assertEqual(set(picks), {'replica_0', 'replica_2'})
+        # Health is probed once per interval, not on every read
+        self.assertEqual(sorted(router.health.probes), ['replica_0', 'replica_1', 'replica_2'])
+
+    def test_ineligible_models_unhealthy_replicas_and_transactions_use_default(self):
+        router = self.router(down={'replica_0', 'replica_1', 'replica_2'})
+        self.assertEqual(router.db_for_read(Tent), 'default')
+        router = self.router()
+        self.assertEqual(router.db_for_read(User), 'default')
+        with mock.patch.object(connections['default'], 'in_atomic_block', True):
+            self.assertEqual(router.db_for_read(Tent), 'default')
+
+    def test_reads_follow_a_write_to_the_primary(self):
+        router = self.router()
+        self.assertNotEqual(router.db_for_read(Tent), 'default')
+        self.assertEqual(router.db_for_write(Tent), 'default')
+        self.assertEqual(router.db_for_read(Tent), 'default')
+        with mock.patch('goldenhorde.db_router.time.monotonic', return_value=time.monotonic() + 60):
+            self.assertNotEqual(router.db_for_read(Tent), 'default')
+
+    def test_connection_errors_mark_the_replica_unhealthy(self):
+        router = self.router()
+        replica = mock.Mock(alias='replica_0', execute_wrappers=[])
+        router.install_health_wrapper(sender=None, connection=replica)
+        router.install_health_wrapper(sender=None, connection=replica)
+        self.assertEqual(replica.execute_wrappers, [router.health_wrapper])
+        primary = mock.Mock(alias='default', execute_wrappers=[])
+        router.install_health_wrapper(sender=None, connection=primary)
+        self.assertEqual(primary.execute_wrappers, [])
+
+        self.assertEqual(router.db_for_read(Tent), 'replica_0')
+        failing = mock.Mock(side_effect=OperationalError('server closed the connection unexpectedly'))
+        with self.assertRaises(OperationalError):
+            router.health_wrapper(failing, 'SELECT 1', None, False, {'connection': replica})
+        picks = {router.db_for_read(Tent) for _ in range(6)}
+        self.assertEqual(picks, {'replica_1', 'replica_2'})
+
+
+class DBExecutorTestCase(SimpleTestCase):
+    def executor(self, **kwargs):
+        executor = DBExecutor(**{"workers": 1, "max_pending": 10, "timeout": 5, **kwargs})
+        self.addCleanup(executor.shutdown)
+        return executor
+
+    async def test_rejects_immediately_when_queue_is_full(self):
+        executor = self.executor(max_pending=1)
+        release = threading.Event()
+        blocked = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.01)
+        with self.assertRaises(DBExecutorSaturated):
+            await executor.run(lambda: None)
+        release.set()
+        self.assertTrue(await blocked)
+        self.assertEqual(executor.pending, 0)
+
+    async def test_queued_call_times_out_without_running(self):
+        executor = self.executor(timeout=0.05)
+        release = threading.Event()
+        ran = []
+        blocked = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.01)
+        with self.assertRaises(DBExecutorSaturated):
+            await executor.run(ran.append, 1)
+        release.set()
+        await blocked
+        self.assertEqual(ran, [])
+        self.assertEqual(executor.pending, 0)
+
+    async def test_cleanup_without_shedding_waits_for_a_thread(self):
+        executor = self.executor(max_pending=1, timeout=0.05)
+        release = threading.Event()
+        blocked = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.01)
+        with without_shedding():
+            cleanup = asyncio.ensure_future(executor.run(lambda: "cleaned"))
+        await asyncio.sleep(0.1)
+        self.assertFalse(cleanup.done())
+        release.set()
+        self.assertEqual(await cleanup, "cleaned")
+        await blocked
+        self.assertEqual(executor.pending, 0)
+
+    async def test_runs_on_pool_thread_and_propagates_context(self):
+        executor = self.executor(workers=2)
+        var = contextvars.ContextVar("var", default="unset")
+
+        def work():
+            var.set("set in pool")
+            return threading.current_thread().name
+
+        name = await executor.run(work)
+        self.assertTrue(name.startswith("db"))
+        self.assertEqual(var.get(), "set in pool")
@@ -0,0 +1,177 @@
+"""
+Lightweight span tracing for the WebSocket connect path.
+
+Spans are context managers tracked in a context variable, so nested
+`with span(...)` blocks inside a handler become children of the handler's
+root span. Trace context is propagated across the channel layer by
+`inject()`, which adds a `_trace` key to outgoing layer messages; the
+receiving consumer continues the same trace.
+
+Finished spans are written as JSON lines by a background thread; summarize
+them with `manage.py trace_summary`.
+
+Settings:
+    TRACING_ENABLED     record spans (default False)
+    TRACE_FILE          JSON lines output path (default <BASE_DIR>/traces.jsonl)
+    TRACE_SAMPLE_RATE   fraction of new traces recorded (default 1.0)
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+ENABLED = getattr(settings, "TRACING_ENABLED", False)
+SAMPLE_RATE = getattr(settings, "TRACE_SAMPLE_RATE", 1.0)
+TRACE_FILE = getattr(settings, "TRACE_FILE", os.path.join(settings.BASE_DIR, "traces.jsonl"))
+
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+
+def new_id():
+    return os.urandom(8).hex()
+
+
+class JsonLinesExporter:
+    """Appends finished spans to a file from a daemon thread so the event loop never does file IO."""
+
+    def __init__(self, path, queue_size=10000):
+        self.path = path
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, record):
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        with open(self.path, "a") as f:
+            while True:
+                records = [self.queue.get()]
+                while not self.queue.empty() and len(records) < 500:
+                    records.append(self.queue.get_nowait())
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+                f.flush()
+
+
+exporter = JsonLinesExporter(TRACE_FILE)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attrs", "start", "_t0", "_token")
+
+    def __init__(self, name, trace_id, parent_id=None, attrs=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.attrs = attrs or {}
+
+    def set_attr(self, key, value):
+        self.attrs[key] = value
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._t0
+        _current_span.reset(self._token)
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(duration * 1000, 3),
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        exporter.export(record)
+        return False
+
+
+class _NoopSpan:
+    trace_id = None
+    span_id = None
+
+    def set_attr(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def start_trace(name, trace_id=None, parent_id=None, **attrs):
+    """Root span of a new trace, or of an existing one when `trace_id` is given."""
+    if not ENABLED:
+        return NOOP_SPAN
+    if trace_id is None:
+        if SAMPLE_RATE < 1.0 and random.random() >= SAMPLE_RATE:
+            return NOOP_SPAN
+        trace_id = new_id()
+    return Span(name, trace_id, parent_id, attrs)
+
+
+def span(name, **attrs):
+    """Child of the current span; a no-op outside a trace."""
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(name, parent.trace_id, parent.span_id, attrs)
+
+
+def inject(message):
+    """Attach the current trace context to a channel layer message."""
+    current = _current_span.get()
+    if current is not None:
+        message["_trace"] = {"trace_id": current.trace_id, "span_id": current.span_id}
+    return message
+
+
+def continue_trace(name, message):
+    """Span linked to the sender of a channel layer message, if it carried trace context."""
+    context = message.get("_trace")
+    if not ENABLED or not context:
+        return NOOP_SPAN
+    return Span(name, context["trace_id"], context["span_id"])
+
+
+def traced(name):
+    """Run an async function inside `span(name)`."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
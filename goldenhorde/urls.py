@@ -17,6 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.utils.translation import gettext_lazy as _
+from .views import metrics_view
 
 admin.site.site_header = _("Golden Horde Adminstration")
 admin.site.site_title = _("Golden Horde")
@@ -25,5 +26,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/membership/', include("membership.urls", namespace="membership")),
     path('api/hordes/', include("hordes.urls")),
+    path('metrics', metrics_view, name='metrics'),
     path('', admin.site.login),
 ]
@@ -0,0 +1,21 @@
+import logging
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@require_GET
+def metrics_view(request):
+    """Prometheus scrape endpoint, optionally protected by `METRICS_TOKEN` (`Authorization: Bearer <token>`)."""
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if not token and getattr(settings, "METRICS_REQUIRE_TOKEN", False):
+        logger.warning("Refusing to serve /metrics: METRICS_TOKEN is not set")
+        return HttpResponseForbidden()
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
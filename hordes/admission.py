@@ -0,0 +1,258 @@
+"""
+Admission control for WebSocket consumers.
+
+Under overload it is better to turn some sockets away than to let every
+connection degrade together. Three limits are enforced:
+
+    ADMISSION_MAX_CONNECTIONS        concurrent sockets per worker process
+    ADMISSION_HANDSHAKE_RATE/BURST   token bucket on new handshakes per worker
+    ADMISSION_MAX_TENT_PARTICIPANTS  voice chat participants per tent, counted
+                                     atomically in the tent's presence cache
+                                     shard so the cap holds across workers
+
+Tent seats are held per user, not counted: a reconnecting user keeps their
+one seat, and each seat expires ADMISSION_SEAT_TTL seconds after its last
+refresh (connect or ping), so seats of a crashed worker free themselves
+instead of leaving the tent "full". On Redis a seat map is a sorted set of
+usernames scored by expiry, updated by Lua scripts; other cache backends
+(locmem in development) use an equivalent per-process map.
+
+A value of 0 disables a limit. Rejected sockets are accepted and immediately
+closed with a distinct close code (a close before accept reaches the client as
+a bare HTTP 403), so clients can tell a full node from a full tent and retry
+elsewhere.
+
+A saturated DB executor (see goldenhorde/db_executor.py) is treated like a
+full worker: a handshake that cannot get a DB thread is closed with 4503, and
+a message that cannot is answered with a `busy` error instead of crashing the
+socket. Disconnect cleanup is never shed: it waits for a DB thread, so the
+participant row is always removed and the leave is always broadcast.
+"""
+import json
+import logging
+import threading
+import time
+from django.conf import settings
+from goldenhorde.db_executor import DBExecutorSaturated, without_shedding
+from goldenhorde.metrics import WS_ADMISSIONS
+from goldenhorde.sharding import presence_cache, tent_shard_key
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = getattr(settings, "ADMISSION_MAX_CONNECTIONS", 0)
+MAX_TENT_PARTICIPANTS = getattr(settings, "ADMISSION_MAX_TENT_PARTICIPANTS", 0)
+HANDSHAKE_RATE = getattr(settings, "ADMISSION_HANDSHAKE_RATE", 0)
+HANDSHAKE_BURST = getattr(settings, "ADMISSION_HANDSHAKE_BURST", 0)
+SEAT_TTL = getattr(settings, "ADMISSION_SEAT_TTL", 300)
+
+CLOSE_WORKER_FULL = 4503
+CLOSE_RATE_LIMITED = 4429
+CLOSE_TENT_FULL = 4409
+
+REJECTIONS = {
+    CLOSE_WORKER_FULL: "worker_full",
+    CLOSE_RATE_LIMITED: "rate_limited",
+    CLOSE_TENT_FULL: "tent_full",
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def take(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+# KEYS: seats sorted set, owners hash. Expired seats are pruned first; the
+# user's existing seat is renewed even when the tent is full.
+CLAIM_SEAT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if #expired > 0 then
+    redis.call('ZREM', KEYS[1], unpack(expired))
+    redis.call('HDEL', KEYS[2], unpack(expired))
+end
+if not redis.call('ZSCORE', KEYS[1], ARGV[4]) and redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[4])
+redis.call('HSET', KEYS[2], ARGV[4], ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+return 1
+"""
+
+# Only the socket that holds the seat may refresh or release it
+REFRESH_SEAT = """
+local owner = redis.call('HGET', KEYS[2], ARGV[1])
+if owner and owner ~= ARGV[2] then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return 1
+"""
+
+RELEASE_SEAT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+class AdmissionController:
+    """Per-worker connection count and handshake rate, plus shared per-tent seats."""
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, handshake_rate=HANDSHAKE_RATE,
+                 handshake_burst=HANDSHAKE_BURST, max_tent_participants=MAX_TENT_PARTICIPANTS,
+                 seat_ttl=SEAT_TTL, clock=time.time):
+        self.max_connections = max_connections
+        self.max_tent_participants = max_tent_participants
+        self.seat_ttl = seat_ttl
+        self.clock = clock
+        self.bucket = TokenBucket(handshake_rate, handshake_burst) if handshake_rate else None
+        self.active = 0
+        self._seats_lock = threading.Lock()
+
+    def admit(self):
+        """Admit a new socket to this worker, or return the close code to reject it with"""
+        if self.max_connections and self.active >= self.max_connections:
+            return CLOSE_WORKER_FULL
+        if self.bucket is not None and not self.bucket.take():
+            return CLOSE_RATE_LIMITED
+        self.active += 1
+        return None
+
+    def release(self):
+        self.active -= 1
+
+    @staticmethod
+    def get_tent_seats_key(tent_id):
+        return f"tent_seats_{tent_id}"
+
+    @staticmethod
+    def get_tent_seat_owners_key(tent_id):
+        return f"tent_seat_owners_{tent_id}"
+
+    def _run_seat_script(self, tent_id, script, args):
+        """Run a seat script on Redis; None when the tent's cache is not Redis"""
+        cache = presence_cache(tent_shard_key(tent_id))
+        get_client = getattr(getattr(cache, "_cache", None), "get_client", None)
+        if get_client is None:
+            return None
+        keys = [cache.make_key(self.get_tent_seats_key(tent_id)), cache.make_key(self.get_tent_seat_owners_key(tent_id))]
+        client = get_client(keys[0], write=True)
+        return client.register_script(script)(keys=keys, args=args)
+
+    def _update_local_seats(self, tent_id, update):
+        """Fallback for non-Redis caches: apply `update(seats)` to the {username: (expires, owner)} map"""
+        cache = presence_cache(tent_shard_key(tent_id))
+        key = self.get_tent_seats_key(tent_id)
+        with self._seats_lock:
+            now = self.clock()
+            seats = {user: seat for user, seat in (cache.get(key) or {}).items() if seat[0] > now}
+            result = update(seats, now)
+            cache.set(key, seats, timeout=self.seat_ttl)
+        return result
+
+    def claim_tent_seat(self, tent_id, username, owner):
+        """Take (or renew) `username`'s seat in the tent for socket `owner`; False when the tent is full"""
+        if not self.max_tent_participants:
+            return True
+        now = self.clock()
+        result = self._run_seat_script(tent_id, CLAIM_SEAT, [
+            now, now + self.seat_ttl, self.max_tent_participants, username, owner, self.seat_ttl,
+        ])
+        if result is not None:
+            return bool(result)
+
+        def claim(seats, now):
+            if username not in seats and len(seats) >= self.max_tent_participants:
+                return False
+            seats[username] = (now + self.seat_ttl, owner)
+            return True
+        return self._update_local_seats(tent_id, claim)
+
+    def refresh_tent_seat(self, tent_id, username, owner):
+        """Extend the seat's expiry, called on ping"""
+        if not self.max_tent_participants:
+            return
+        now = self.clock()
+        if self._run_seat_script(tent_id, REFRESH_SEAT, [username, owner, now + self.seat_ttl, self.seat_ttl]) is not None:
+            return
+
+        def refresh(seats, now):
+            if seats.get(username, (None, owner))[1] == owner:
+                seats[username] = (now + self.seat_ttl, owner)
+        self._update_local_seats(tent_id, refresh)
+
+    def release_tent_seat(self, tent_id, username, owner):
+        """Give the seat back, unless a newer socket of the same user has taken it over"""
+        if not self.max_tent_participants:
+            return
+        if self._run_seat_script(tent_id, RELEASE_SEAT, [username, owner]) is not None:
+            return
+
+        def release(seats, now):
+            if seats.get(username, (None, None))[1] == owner:
+                del seats[username]
+        self._update_local_seats(tent_id, release)
+
+
+admission = AdmissionController()
+
+
+class AdmissionControlMixin:
+    """Rejects handshakes over the worker cap or rate and counts admitted sockets."""
+    admitted = False
+    rejected = False
+
+    async def reject(self, code):
+        self.rejected = True
+        WS_ADMISSIONS.inc(consumer=self.get_metrics_name(), result=REJECTIONS[code])
+        await self.accept()
+        await self.close(code=code)
+
+    async def websocket_connect(self, message):
+        code = admission.admit()
+        if code is not None:
+            await self.reject(code)
+            return
+        self.admitted = True
+        WS_ADMISSIONS.inc(consumer=self.get_metrics_name(), result="admitted")
+        try:
+            await super().websocket_connect(message)
+        except DBExecutorSaturated:
+            # Not `reject`: seats and cache entries claimed so far still need the normal disconnect cleanup
+            WS_ADMISSIONS.inc(consumer=self.get_metrics_name(), result="db_saturated")
+            if not self.accepted:
+                await self.accept()
+            await self.close(code=CLOSE_WORKER_FULL)
+
+    async def websocket_receive(self, message):
+        try:
+            await super().websocket_receive(message)
+        except DBExecutorSaturated:
+            await self.send(text_data=json.dumps({"type": "error", "reason": "busy", "message": "Server is busy, try again."}))
+
+    async def websocket_disconnect(self, message):
+        if self.admitted:
+            self.admitted = False
+            admission.release()
+        with without_shedding():
+            await super().websocket_disconnect(message)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class HordesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'hordes'
+
+    def ready(self):
+        from . import signals  # noqa: F401
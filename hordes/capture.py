@@ -0,0 +1,75 @@
+"""
+Opt-in capture of inbound voice chat signaling for deterministic replay.
+
+Each join, inbound frame and leave of `VoiceChatConsumer` is written as one
+compact JSON line with an absolute wall-clock timestamp, so captures from
+several (or restarted) workers appended to one file stay comparable.
+Usernames and tent ids are replaced by stable HMAC aliases (the same in every
+worker), and every string in a frame except its `type` is replaced by a
+same-length filler, so SDP and ICE contents never reach the file while
+message sizes and timing are preserved.
+
+Replay a capture with `manage.py replay_signaling <file>`.
+
+Settings:
+    SIGNAL_CAPTURE_ENABLED  record signaling (default False)
+    SIGNAL_CAPTURE_FILE     output path (default <BASE_DIR>/signaling-capture.jsonl)
+"""
+import hashlib
+import hmac
+import os
+import time
+from django.conf import settings
+from goldenhorde.tracing import JsonLinesExporter
+
+ENABLED = getattr(settings, "SIGNAL_CAPTURE_ENABLED", False)
+CAPTURE_FILE = getattr(settings, "SIGNAL_CAPTURE_FILE", os.path.join(settings.BASE_DIR, "signaling-capture.jsonl"))
+
+# Fields holding usernames, aliased instead of blanked so replay can route them
+USERNAME_FIELDS = {"target_user", "sender", "username"}
+
+_writer = JsonLinesExporter(CAPTURE_FILE)
+
+
+def alias(prefix, value):
+    digest = hmac.new(settings.SECRET_KEY.encode(), str(value).encode(), hashlib.sha256).hexdigest()
+    return f"{prefix}{digest[:10]}"
+
+
+def anonymize(value, key=None):
+    if isinstance(value, dict):
+        return {k: anonymize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [anonymize(v) for v in value]
+    if isinstance(value, str):
+        if key == "type":
+            return value
+        if key in USERNAME_FIELDS:
+            return alias("p", value)
+        return "x" * len(value)
+    return value
+
+
+def _record(kind, consumer, **fields):
+    _writer.export({
+        "t": round(time.time(), 4),
+        "k": kind,
+        "tent": alias("t", consumer.tent_id),
+        "peer": alias("p", consumer.scope["user"].username),
+        **fields,
+    })
+
+
+def record_join(consumer):
+    if ENABLED:
+        _record("join", consumer)
+
+
+def record_frame(consumer, data):
+    if ENABLED:
+        _record("frame", consumer, data=anonymize(data))
+
+
+def record_leave(consumer, close_code):
+    if ENABLED:
+        _record("leave", consumer, code=close_code)
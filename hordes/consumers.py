@@ -1,14 +1,31 @@
 import logging
 import json
 from collections import defaultdict
-from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.core.cache import cache
 from django.conf import settings
-from .models import Tent, TentParticipant
+from django.db.models import Q
+from goldenhorde.metrics import TENT_CONNECTIONS, WS_MESSAGES
+from goldenhorde.sharding import presence_cache
+from goldenhorde.tracing import traced
+from . import capture
+from .admission import CLOSE_TENT_FULL, AdmissionControlMixin, admission
+from .drain import DrainableConsumerMixin
+from .instrumentation import InstrumentedConsumerMixin, db_sync_to_async, label_event, timed_cache_op
+from .lanes import PresenceLaneMixin
+from .models import TentParticipant
+from .registry import tent_registry
 
 logger = logging.getLogger(__name__)
 
+ICE_MESSAGE_TYPES = {"ice", "ice-candidate", "ice_candidate", "candidate"}
+
+
+def signal_event(data):
+    """Log event name for a signaling payload; ICE candidates are sampled separately from SDP."""
+    if data.get("type") in ICE_MESSAGE_TYPES or "candidate" in data:
+        return "ice"
+    return "signal"
+
 
 class CacheManager:
     """Utility class for managing WebSocket user cache operations"""
@@ -18,6 +35,11 @@ class CacheManager:
     # Extended TTL for long-running connections
     EXTENDED_WS_TTL = getattr(settings, 'WS_CACHE_EXTENDED_TTL', 86400)  # 24 hours default
     
+    @staticmethod
+    def cache_for(username):
+        """Presence cache shard that holds the user's entries"""
+        return presence_cache(username)
+
     @staticmethod
     def get_user_channel_key(username):
         """Generate cache key for user's WebSocket channel"""
@@ -29,6 +51,7 @@ class CacheManager:
         return f"ws_tent_{username}"
     
     @staticmethod
+    @timed_cache_op
     def set_user_channel(username, channel_name, timeout=None):
         """Set user's WebSocket channel in cache"""
         if timeout is None:
@@ -36,36 +59,39 @@ class CacheManager:
             
         try:
             cache_key = CacheManager.get_user_channel_key(username)
-            cache.set(cache_key, channel_name, timeout=timeout)
-            logger.info(f"User {username} channel registered in cache: {channel_name} (TTL: {timeout}s)")
+            CacheManager.cache_for(username).set(cache_key, channel_name, timeout=timeout)
+            logger.debug("User %s channel registered in cache: %s (TTL: %ss)", username, channel_name, timeout)
             return True
         except Exception as e:
-            logger.error(f"Failed to set cache for user {username}: {e}")
+            logger.error("Failed to set cache for user %s: %s", username, e)
             return False
     
     @staticmethod
+    @timed_cache_op
     def get_user_channel(username):
         """Get user's WebSocket channel from cache"""
         try:
             cache_key = CacheManager.get_user_channel_key(username)
-            return cache.get(cache_key)
+            return CacheManager.cache_for(username).get(cache_key)
         except Exception as e:
-            logger.error(f"Failed to get cache for user {username}: {e}")
+            logger.error("Failed to get cache for user %s: %s", username, e)
             return None
     
     @staticmethod
+    @timed_cache_op
     def delete_user_channel(username):
         """Delete user's WebSocket channel from cache"""
         try:
             cache_key = CacheManager.get_user_channel_key(username)
-            cache.delete(cache_key)
-            logger.info(f"User {username} channel removed from cache")
+            CacheManager.cache_for(username).delete(cache_key)
+            logger.debug("User %s channel removed from cache", username)
             return True
         except Exception as e:
-            logger.error(f"Failed to delete cache for user {username}: {e}")
+            logger.error("Failed to delete cache for user %s: %s", username, e)
             return False
     
     @staticmethod
+    @timed_cache_op
     def extend_user_channel_ttl(username, timeout=None):
         """Extend the TTL for a user's channel cache entry"""
         if timeout is None:
@@ -73,19 +99,21 @@ class CacheManager:
             
         try:
             cache_key = CacheManager.get_user_channel_key(username)
-            current_value = cache.get(cache_key)
+            shard = CacheManager.cache_for(username)
+            current_value = shard.get(cache_key)
             if current_value:
-                cache.set(cache_key, current_value, timeout=timeout)
-                logger.info(f"Extended TTL for user {username} channel to {timeout}s")
+                shard.set(cache_key, current_value, timeout=timeout)
+                logger.debug("Extended TTL for user %s channel to %ss", username, timeout, extra={"event": "ping"})
                 return True
             else:
-                logger.warning(f"Cannot extend TTL for user {username}: channel not found in cache")
+                logger.warning("Cannot extend TTL for user %s: channel not found in cache", username)
                 return False
         except Exception as e:
-            logger.error(f"Failed to extend TTL for user {username}: {e}")
+            logger.error("Failed to extend TTL for user %s: %s", username, e)
             return False
     
     @staticmethod
+    @timed_cache_op
     def set_user_tent(username, tent_id, timeout=None):
         """Set user's current tent in cache"""
         if timeout is None:
@@ -93,23 +121,54 @@ class CacheManager:
             
         try:
             cache_key = CacheManager.get_user_tent_key(username)
-            cache.set(cache_key, tent_id, timeout=timeout)
+            CacheManager.cache_for(username).set(cache_key, tent_id, timeout=timeout)
             return True
         except Exception as e:
-            logger.error(f"Failed to set tent cache for user {username}: {e}")
+            logger.error("Failed to set tent cache for user %s: %s", username, e)
             return False
     
     @staticmethod
+    @timed_cache_op
     def get_user_tent(username):
         """Get user's current tent from cache"""
         try:
             cache_key = CacheManager.get_user_tent_key(username)
-            return cache.get(cache_key)
+            return CacheManager.cache_for(username).get(cache_key)
         except Exception as e:
-            logger.error(f"Failed to get tent cache for user {username}: {e}")
+            logger.error("Failed to get tent cache for user %s: %s", username, e)
             return None
     
     @staticmethod
+    @timed_cache_op
+    def delete_user_tent(username):
+        """Delete user's current tent from cache"""
+        try:
+            cache_key = CacheManager.get_user_tent_key(username)
+            CacheManager.cache_for(username).delete(cache_key)
+            return True
+        except Exception as e:
+            logger.error("Failed to delete tent cache for user %s: %s", username, e)
+            return False
+
+    @staticmethod
+    @timed_cache_op
+    def delete_users(usernames):
+        """Delete channel and tent entries of many users in one round trip per shard"""
+        try:
+            shards = defaultdict(list)
+            for username in usernames:
+                shards[CacheManager.cache_for(username)].append(username)
+            for shard, names in shards.items():
+                keys = [CacheManager.get_user_channel_key(u) for u in names]
+                keys += [CacheManager.get_user_tent_key(u) for u in names]
+                shard.delete_many(keys)
+            return True
+        except Exception as e:
+            logger.error("Failed to delete cache for %s users: %s", len(usernames), e)
+            return False
+
+    @staticmethod
+    @timed_cache_op
     def extend_user_tent_ttl(username, timeout=None):
         """Extend the TTL for a user's tent cache entry"""
         if timeout is None:
@@ -117,20 +176,23 @@ class CacheManager:
             
         try:
             cache_key = CacheManager.get_user_tent_key(username)
-            current_value = cache.get(cache_key)
+            shard = CacheManager.cache_for(username)
+            current_value = shard.get(cache_key)
             if current_value:
-                cache.set(cache_key, current_value, timeout=timeout)
-                logger.info(f"Extended TTL for user {username} tent to {timeout}s")
+                shard.set(cache_key, current_value, timeout=timeout)
+                logger.debug("Extended TTL for user %s tent to %ss", username, timeout, extra={"event": "ping"})
                 return True
             else:
-                logger.warning(f"Cannot extend TTL for user {username}: tent not found in cache")
+                logger.warning("Cannot extend TTL for user %s: tent not found in cache", username)
                 return False
         except Exception as e:
-            logger.error(f"Failed to extend tent TTL for user {username}: {e}")
+            logger.error("Failed to extend tent TTL for user %s: %s", username, e)
             return False
 
 
-class TentEventsConsumer(AsyncWebsocketConsumer):
+class TentEventsConsumer(PresenceLaneMixin, DrainableConsumerMixin, AdmissionControlMixin, InstrumentedConsumerMixin, AsyncWebsocketConsumer):
+    metrics_name = "tent_events"
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.group_name = "tent_events"
@@ -140,10 +202,7 @@ class TentEventsConsumer(AsyncWebsocketConsumer):
         if not user or user.is_anonymous:
             await self.close()
             return
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
-        )
+        await self.group_add(self.group_name)
         await self.accept()
         # Send current users in all tents
         tent_users = defaultdict(list)
@@ -156,24 +215,24 @@ class TentEventsConsumer(AsyncWebsocketConsumer):
         }))
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
-        )
+        await self.group_discard(self.group_name)
 
     async def tent_event(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+        await self.send_presence(event["data"])
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
+        WS_MESSAGES.inc(consumer=self.metrics_name, type=text_data_json.get("type", "unknown"))
         # Handle ping from frontend
         if text_data_json.get("type") == "ping":
+            label_event("receive.ping")
             await self.send(text_data=json.dumps({"type": "pong", "ts": text_data_json.get("ts")}))
             return
 
     @staticmethod
+    @traced("db.get_all_participants")
     async def get_all_participants():
-        @sync_to_async
+        @db_sync_to_async
         def fetch():
             return list(TentParticipant.objects.select_related('user').values('tent_id', 'user__username'))
         participants = await fetch()
@@ -183,28 +242,22 @@ class TentEventsConsumer(AsyncWebsocketConsumer):
         return participants
 
 
-class VoiceChatConsumer(AsyncWebsocketConsumer):
+class VoiceChatConsumer(PresenceLaneMixin, DrainableConsumerMixin, AdmissionControlMixin, InstrumentedConsumerMixin, AsyncWebsocketConsumer):
+    metrics_name = "voice_chat"
+    tent_counted = False
+    seat_claimed = False
+
     async def connect(self):
         user = self.scope.get("user")
         if not user or user.is_anonymous:
             await self.close()
             return
         username = user.username
-        
-        # Register the user's channel name in cache with extended TTL for long connections
-        CacheManager.set_user_channel(username, self.channel_name, timeout=CacheManager.EXTENDED_WS_TTL)
-        
-        print(f"WebSocket connection attempt from {self.scope.get('client', 'unknown')}")
-        print(f"Headers: {self.scope.get('headers', [])}")
-        print(f"Path: {self.scope.get('path', 'unknown')}")
-        print("self.scope['url_route']['kwargs']", self.scope['url_route']['kwargs'])
         self.tent_id = self.scope['url_route']['kwargs']['tent_id']
         self.voice_chat_tent_id = f"voice_chat_{self.tent_id}"
-        print(f"Connecting to tent: {self.tent_id}")
-
-        await self.channel_layer.group_add(
-            self.voice_chat_tent_id,
-            self.channel_name
+        logger.debug(
+            "Voice chat connection attempt from %s to tent %s", self.scope.get('client'), self.tent_id,
+            extra={"event": "connect", "username": username, "tent_id": self.tent_id},
         )
 
         # Fetch tent once and handle if it does not exist
@@ -212,6 +265,17 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
         if tent is None:
             await self.close()
             return
+        # Only known tents get seats, so junk ids never create seat maps
+        if not admission.claim_tent_seat(self.tent_id, username, self.channel_name):
+            await self.reject(CLOSE_TENT_FULL)
+            return
+        self.seat_claimed = True
+
+        # Register the user's channel name in cache with extended TTL for long connections
+        CacheManager.set_user_channel(username, self.channel_name, timeout=CacheManager.EXTENDED_WS_TTL)
+
+        await self.group_add(self.voice_chat_tent_id)
+
         # Create TentParticipant entry using authenticated user
         await self.create_tent_participant(tent, user)
         
@@ -219,6 +283,9 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
         CacheManager.set_user_tent(username, self.tent_id, timeout=CacheManager.EXTENDED_WS_TTL)
 
         await self.accept()
+        TENT_CONNECTIONS.inc(tent=self.tent_id)
+        self.tent_counted = True
+        capture.record_join(self)
         # Get other users in the tent (excluding self)
         other_users = await self.get_other_users(tent, user)
         await self.send(text_data=json.dumps({
@@ -226,10 +293,11 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
             "username": username,
             "other_users": other_users,
         }))
-        print("WebSocket connection accepted successfully")
+        logger.info("User %s joined tent %s", username, self.tent_id,
+                    extra={"event": "connect", "username": username, "tent_id": self.tent_id})
         # Broadcast join event to tent_events group
 
-        await self.channel_layer.group_send(
+        await self.group_send(
             "tent_events",
             {
                 "type": "tent_event",
@@ -241,7 +309,7 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
             }
         )
         # Broadcast join event to the tent's own group
-        await self.channel_layer.group_send(
+        await self.group_send(
             self.voice_chat_tent_id,
             {
                 "type": "tent_event",
@@ -254,26 +322,39 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
         )
 
     async def disconnect(self, close_code):
-        print(f"WebSocket VoiceChatConsumer disconnected with code: {close_code}")
-        
+        logger.info("Voice chat disconnected with code %s", close_code,
+                    extra={"event": "disconnect", "tent_id": getattr(self, "tent_id", None), "close_code": close_code})
+        if self.tent_counted:
+            self.tent_counted = False
+            TENT_CONNECTIONS.dec(tent=self.tent_id)
+            capture.record_leave(self, close_code)
+
+        if self.rejected:
+            return
+        if self.seat_claimed:
+            self.seat_claimed = False
+            admission.release_tent_seat(self.tent_id, self.scope["user"].username, self.channel_name)
+        if self.drained:
+            # Presence was already flushed in bulk by the drain coordinator
+            if hasattr(self, "voice_chat_tent_id"):
+                await self.group_discard(self.voice_chat_tent_id)
+            return
+
         # Remove the user's channel name and tent from cache
         user = self.scope.get("user")
         if user and not user.is_anonymous:
             CacheManager.delete_user_channel(user.username)
             # Also remove tent association
-            cache.delete(CacheManager.get_user_tent_key(user.username))
+            CacheManager.delete_user_tent(user.username)
         
-        await self.channel_layer.group_discard(
-            self.voice_chat_tent_id,
-            self.channel_name
-        )
+        await self.group_discard(self.voice_chat_tent_id)
         # Remove TentParticipant entry
         tent = await self.get_tent(self.tent_id)
-        print("VoiceChatConsumer disconnect user tent", user.username, tent)
+        logger.debug("User %s leaving tent %s", user.username, tent, extra={"event": "disconnect"})
         if tent is not None:
             await self.delete_tent_participant(tent, self.scope["user"])
         # Broadcast leave event to tent_events group
-        await self.channel_layer.group_send(
+        await self.group_send(
             "tent_events",
             {
                 "type": "tent_event",
@@ -285,7 +366,7 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
             }
         )
         # Broadcast leave event to the tent's own group
-        await self.channel_layer.group_send(
+        await self.group_send(
             self.voice_chat_tent_id,
             {
                 "type": "tent_event",
@@ -299,27 +380,36 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
+        WS_MESSAGES.inc(consumer=self.metrics_name, type=text_data_json.get("type", "unknown"))
 
         # Handle ping from frontend
         if text_data_json.get("type") == "ping":
+            label_event("receive.ping")
             username = self.scope['user'].username
-            print(f"ping from {username} from channel_name: {self.channel_name}")
+            logger.debug("ping from %s from channel_name: %s", username, self.channel_name, extra={"event": "ping"})
             
             # Extend cache TTL on ping to support long-running connections
             CacheManager.extend_user_channel_ttl(username)
             CacheManager.extend_user_tent_ttl(username)
+            if self.seat_claimed:
+                admission.refresh_tent_seat(self.tent_id, username, self.channel_name)
             
             await self.send(text_data=json.dumps({"type": "pong", "ts": text_data_json.get("ts")}))
             return
-        
-        print("receive", text_data_json)
+
+        capture.record_frame(self, text_data_json)
+        logger.debug(
+            "receive %s from %s to %s", text_data_json.get("type"), self.scope['user'].username,
+            text_data_json.get("target_user") or self.voice_chat_tent_id, extra={"event": signal_event(text_data_json)},
+        )
 
         target_username = text_data_json.get("target_user")
+        label_event("receive.signal" if target_username else "receive.broadcast")
         if target_username:
             # Check if target user is a participant in the tent
             is_participant = await self.is_tent_participant(self.tent_id, target_username)
             if not is_participant:
-                print(target_username, "was not participant")
+                logger.info("Signal target %s is not a participant of tent %s", target_username, self.tent_id)
                 await self.send(text_data=json.dumps({
                     "type": "error",
                     "target_user": target_username,
@@ -328,9 +418,8 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
                 return
             # Look up the target user's channel name in cache
             target_channel = CacheManager.get_user_channel(target_username)
-            print("checking the target_channel for target_user", target_username, target_channel)
             if target_channel:
-                await self.channel_layer.send(
+                await self.layer_send(
                     target_channel,
                     {
                         "type": "voice_chat_config",
@@ -339,7 +428,7 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
                     }
                 )
             else:
-                print(f"User {target_username} is not connected.")
+                logger.info("Signal target %s is not connected", target_username)
                 await self.send(text_data=json.dumps({
                     "type": "error",
                     "target_user": target_username,
@@ -347,7 +436,7 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
                 }))
         else:
             # Send to group (all users in the room)
-            await self.channel_layer.group_send(
+            await self.group_send(
                 self.voice_chat_tent_id,
                 {
                     "type": "voice_chat_config",
@@ -357,46 +446,81 @@ class VoiceChatConsumer(AsyncWebsocketConsumer):
             )
 
     async def voice_chat_config(self, event):
-        print("voice_chat_config", event["data"])
+        logger.debug("voice_chat_config %s", event["data"].get("type"), extra={"event": signal_event(event["data"])})
         await self.send(text_data=json.dumps(event["data"]))
 
     async def tent_event(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+        await self.send_presence(event["data"])
+
+    @classmethod
+    async def flush_presence(cls, consumers):
+        """Remove the presence of many draining consumers with bulk operations."""
+        for c in consumers:
+            if c.seat_claimed:
+                c.seat_claimed = False
+                admission.release_tent_seat(c.tent_id, c.scope["user"].username, c.channel_name)
+        joined = [c for c in consumers if c.tent_counted]
+        if not joined:
+            return
+        CacheManager.delete_users([c.scope["user"].username for c in joined])
+        await cls.delete_tent_participants([(c.tent_id, c.scope["user"].pk) for c in joined])
+        by_tent = defaultdict(list)
+        for c in joined:
+            by_tent[c.tent_id].append(c.scope["user"].username)
+        layer = joined[0].channel_layer
+        for tent_id, usernames in by_tent.items():
+            # The usual per-user user_left events, carried in one group message per tent
+            event = {"type": "tent_event_batch", "events": [
+                {"type": "user_left", "tent_id": tent_id, "username": username} for username in usernames
+            ]}
+            await layer.group_send("tent_events", event)
+            await layer.group_send(f"voice_chat_{tent_id}", event)
 
     @staticmethod
+    @traced("db.delete_tent_participants")
+    async def delete_tent_participants(pairs):
+        @db_sync_to_async
+        def delete():
+            condition = Q()
+            for tent_id, user_id in pairs:
+                condition |= Q(tent_id=tent_id, user_id=user_id)
+            TentParticipant.objects.filter(condition).delete()
+        await delete()
+
+    @staticmethod
+    @traced("registry.get_tent")
     async def get_tent(tent_id):
-        @sync_to_async
-        def fetch():
-            try:
-                return Tent.objects.get(pk=tent_id)
-            except Tent.DoesNotExist:
-                return None
-        return await fetch()
+        """TentInfo from the process-local registry, or None for unknown ids"""
+        return await tent_registry.get(tent_id)
 
     @staticmethod
+    @traced("db.create_tent_participant")
     async def create_tent_participant(tent, user):
-        @sync_to_async
+        @db_sync_to_async
         def create():
-            TentParticipant.objects.get_or_create(tent=tent, user=user)
+            TentParticipant.objects.get_or_create(tent_id=tent.pk, user=user)
         await create()
 
     @staticmethod
+    @traced("db.delete_tent_participant")
     async def delete_tent_participant(tent, user):
-        @sync_to_async
+        @db_sync_to_async
         def delete():
-            TentParticipant.objects.filter(tent=tent, user=user).delete()
+            TentParticipant.objects.filter(tent_id=tent.pk, user=user).delete()
         await delete()
 
     @staticmethod
+    @traced("db.get_other_users")
     async def get_other_users(tent, user):
-        @sync_to_async
+        @db_sync_to_async
         def fetch():
-            return list(TentParticipant.objects.filter(tent=tent).exclude(user=user).values_list('user__username', flat=True))
+            return list(TentParticipant.objects.filter(tent_id=tent.pk).exclude(user=user).values_list('user__username', flat=True))
         return await fetch()
 
     @staticmethod
+    @traced("db.is_tent_participant")
     async def is_tent_participant(tent_id, username):
-        @sync_to_async
+        @db_sync_to_async
         def check():
             return TentParticipant.objects.filter(
                 tent__pk=tent_id, user__username=username
@@ -0,0 +1,146 @@
+"""
+Graceful drain of a worker's WebSocket connections.
+
+On SIGTERM the worker stops admitting new sockets, flushes the presence of all
+its voice chat users in bulk (one DELETE, one cache delete_many, one
+group message per tent carrying the usual per-user `user_left` events), then tells every client to reconnect with a
+randomized backoff hint and closes sockets in waves with code 1012 (service
+restart). Drained consumers skip their per-connection disconnect cleanup, and
+clients spread their reconnects over the backoff window instead of all
+reconnecting in the same second.
+
+Settings:
+    DRAIN_ON_SIGTERM            install the SIGTERM drain handler (default True)
+    DRAIN_WAVE_SIZE             sockets closed per wave (default 200)
+    DRAIN_WAVE_INTERVAL         seconds between waves (default 0.5)
+    RECONNECT_BACKOFF_MIN_MS    lower bound of the reconnect hint (default 1000)
+    RECONNECT_BACKOFF_MAX_MS    upper bound of the reconnect hint (default 15000)
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+from collections import defaultdict
+from django.conf import settings
+from goldenhorde.db_executor import without_shedding
+
+logger = logging.getLogger(__name__)
+
+# RFC 6455 "Service Restart": the client should reconnect
+CLOSE_SERVICE_RESTART = 1012
+
+WAVE_SIZE = getattr(settings, "DRAIN_WAVE_SIZE", 200)
+WAVE_INTERVAL = getattr(settings, "DRAIN_WAVE_INTERVAL", 0.5)
+BACKOFF_MIN_MS = getattr(settings, "RECONNECT_BACKOFF_MIN_MS", 1000)
+BACKOFF_MAX_MS = getattr(settings, "RECONNECT_BACKOFF_MAX_MS", 15000)
+
+
+class DrainCoordinator:
+    def __init__(self):
+        self.consumers = set()
+        self.draining = False
+
+    def register(self, consumer):
+        self.consumers.add(consumer)
+
+    def unregister(self, consumer):
+        self.consumers.discard(consumer)
+
+    async def drain(self, wave_size=WAVE_SIZE, wave_interval=WAVE_INTERVAL):
+        if self.draining:
+            return
+        self.draining = True
+        consumers = list(self.consumers)
+        logger.info("Draining %s WebSocket connections in waves of %s", len(consumers), wave_size)
+
+        by_class = defaultdict(list)
+        for consumer in consumers:
+            consumer.drained = True
+            by_class[type(consumer)].append(consumer)
+        for consumer_class, members in by_class.items():
+            flush = getattr(consumer_class, "flush_presence", None)
+            if flush is not None:
+                try:
+                    with without_shedding():
+                        await flush(members)
+                except Exception:
+                    logger.exception("Bulk presence flush failed for %s", consumer_class.__name__)
+        # Let the batched user_left broadcasts reach the consumers before they close
+        await asyncio.sleep(wave_interval)
+
+        random.shuffle(consumers)
+        for start in range(0, len(consumers), wave_size):
+            wave = consumers[start:start + wave_size]
+            await asyncio.gather(*(consumer.drain() for consumer in wave), return_exceptions=True)
+            if start + wave_size < len(consumers):
+                await asyncio.sleep(wave_interval)
+        logger.info("Drain complete")
+
+
+coordinator = DrainCoordinator()
+
+
+class DrainableConsumerMixin:
+    """Registers accepted consumers with the coordinator and refuses new sockets while draining."""
+    drained = False
+    rejected = False
+
+    async def websocket_connect(self, message):
+        if coordinator.draining:
+            # Nothing was set up, so there is nothing for disconnect() to clean
+            self.rejected = True
+            await self.close(code=CLOSE_SERVICE_RESTART)
+            return
+        await super().websocket_connect(message)
+
+    async def accept(self, *args, **kwargs):
+        await super().accept(*args, **kwargs)
+        coordinator.register(self)
+
+    async def websocket_disconnect(self, message):
+        coordinator.unregister(self)
+        await super().websocket_disconnect(message)
+
+    async def drain(self):
+        retry_after_ms = random.randint(BACKOFF_MIN_MS, BACKOFF_MAX_MS)
+        await self.send(text_data=json.dumps({"type": "reconnect", "retry_after_ms": retry_after_ms}))
+        await self.close(code=CLOSE_SERVICE_RESTART)
+
+
+def install_drain_handler(loop=None):
+    """
+    Run the drain on SIGTERM, then hand the signal to the server's own handler.
+
+    Must be called from inside the running event loop, after the server has
+    installed its handlers (e.g. on the first ASGI call).
+    """
+    loop = loop or asyncio.get_running_loop()
+    previous = signal.getsignal(signal.SIGTERM)
+
+    async def drain_then_exit():
+        try:
+            await coordinator.drain()
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    def handler(signum, frame):
+        loop.call_soon_threadsafe(lambda: asyncio.ensure_future(drain_then_exit()))
+
+    signal.signal(signal.SIGTERM, handler)
+
+
+class DrainMiddleware:
+    """ASGI wrapper that installs the SIGTERM drain handler with the first connection."""
+
+    def __init__(self, app):
+        self.app = app
+        self.installed = False
+
+    async def __call__(self, scope, receive, send):
+        if not self.installed:
+            self.installed = True
+            install_drain_handler()
+        return await self.app(scope, receive, send)
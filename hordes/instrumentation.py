@@ -0,0 +1,223 @@
+"""
+Per-handler instrumentation for the WebSocket consumers.
+
+Each consumer handler invocation (connect, receive, disconnect and channel
+layer events) gets a `HandlerStats` stored in a context variable. The context
+is copied into DB executor threads, so DB statements run through
+`db_sync_to_async` are attributed via `connection.execute_wrapper`, and
+`CacheManager` / channel-layer calls record themselves against the same stats.
+Totals are aggregated per event type in-process and logged periodically as a
+`consumer_stats` JSON line.
+"""
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db import connection
+from goldenhorde.db_executor import db_async
+from goldenhorde.metrics import CACHE_OP_SECONDS, HANDLER_SECONDS, LAYER_SEND_SECONDS, WS_CLOSES, WS_CONNECTIONS
+from goldenhorde.tracing import continue_trace, inject, span, start_trace
+
+logger = logging.getLogger(__name__)
+
+STATS_LOG_INTERVAL = getattr(settings, "CONSUMER_STATS_LOG_INTERVAL", 60)
+
+# Handlers that start (or, for connect, continue the auth middleware's) trace
+TRACED_EVENTS = {"websocket.connect", "websocket.receive", "websocket.disconnect"}
+
+_current_stats = contextvars.ContextVar("consumer_handler_stats", default=None)
+
+
+class HandlerStats:
+    __slots__ = ("event", "db_queries", "db_time", "cache_ops", "cache_time", "sends", "group_sends", "layer_sends")
+
+    def __init__(self, event):
+        self.event = event
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.cache_ops = 0
+        self.cache_time = 0.0
+        self.sends = 0
+        self.group_sends = 0
+        self.layer_sends = 0
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_time += time.perf_counter() - start
+
+
+class StatsAggregator:
+    """Thread-safe totals per event type."""
+
+    FIELDS = ("count", "duration", "db_queries", "db_time", "cache_ops", "cache_time", "sends", "group_sends", "layer_sends")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+        self._last_logged = time.monotonic()
+
+    def add(self, stats, duration):
+        with self._lock:
+            totals = self._totals[stats.event]
+            totals["count"] += 1
+            totals["duration"] += duration
+            for field in self.FIELDS[2:]:
+                totals[field] += getattr(stats, field)
+
+    def snapshot(self):
+        with self._lock:
+            return {event: dict(totals) for event, totals in self._totals.items()}
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+    def maybe_log(self):
+        now = time.monotonic()
+        if STATS_LOG_INTERVAL <= 0 or now - self._last_logged < STATS_LOG_INTERVAL:
+            return
+        self._last_logged = now
+        logger.info("%s", json.dumps({"event": "consumer_stats", "handlers": self.snapshot()}))
+
+
+aggregator = StatsAggregator()
+
+
+def current_stats():
+    return _current_stats.get()
+
+
+def label_event(event):
+    """Refine the event type of the running handler, e.g. `websocket.receive` -> `receive.ping`."""
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.event = event
+
+
+def record_cache_op(duration):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.cache_ops += 1
+        stats.cache_time += duration
+
+
+def timed_cache_op(func):
+    """Attribute a CacheManager call to the running handler and record its latency."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with span(f"cache.{func.__name__}"):
+                return func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            record_cache_op(duration)
+            CACHE_OP_SECONDS.observe(duration, op=func.__name__)
+    return wrapper
+
+
+def db_sync_to_async(func):
+    """Run `func` on the DB executor, attributing its statements to the running handler."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stats = _current_stats.get()
+        if stats is None:
+            return func(*args, **kwargs)
+        with connection.execute_wrapper(stats.db_wrapper):
+            return func(*args, **kwargs)
+    return db_async(wrapper)
+
+
+def group_kind(group):
+    """Group name without its per-tent suffix, e.g. `voice_chat_12` -> `voice_chat`."""
+    return group.rstrip("0123456789").rstrip("_") or group
+
+
+class InstrumentedConsumerMixin:
+    """
+    Wraps every dispatched handler in a `HandlerStats` scope.
+
+    Consumers talk to the channel layer through `group_add`, `group_discard`,
+    `group_send` and `layer_send` so those calls are counted, timed, traced and
+    carry trace context to the receiving consumer; `send` (to the client
+    socket) is counted too. Open connections and close codes are exported as
+    metrics under `metrics_name`.
+    """
+    metrics_name = None
+    accepted = False
+
+    def get_metrics_name(self):
+        return self.metrics_name or type(self).__name__
+
+    def start_handler_trace(self, message):
+        name = f"{self.get_metrics_name()}.{message.get('type', 'unknown')}"
+        if "_trace" in message:
+            return continue_trace(name, message)
+        if message.get("type") == "websocket.connect":
+            return start_trace(name, trace_id=self.scope.get("trace_id"))
+        if message.get("type") in TRACED_EVENTS:
+            return start_trace(name)
+        return span(name)
+
+    async def dispatch(self, message):
+        stats = HandlerStats(message.get("type", "unknown"))
+        token = _current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            with self.start_handler_trace(message):
+                await super().dispatch(message)
+        finally:
+            _current_stats.reset(token)
+            duration = time.perf_counter() - start
+            aggregator.add(stats, duration)
+            aggregator.maybe_log()
+            HANDLER_SECONDS.observe(duration, consumer=self.get_metrics_name(), event=stats.event)
+
+    async def accept(self, *args, **kwargs):
+        with span("accept"):
+            await super().accept(*args, **kwargs)
+        self.accepted = True
+        WS_CONNECTIONS.inc(consumer=self.get_metrics_name())
+
+    async def websocket_disconnect(self, message):
+        WS_CLOSES.inc(consumer=self.get_metrics_name(), code=message.get("code"))
+        if self.accepted:
+            self.accepted = False
+            WS_CONNECTIONS.dec(consumer=self.get_metrics_name())
+        await super().websocket_disconnect(message)
+
+    async def send(self, *args, **kwargs):
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.sends += 1
+        await super().send(*args, **kwargs)
+
+    async def group_add(self, group):
+        with span(f"group_add.{group_kind(group)}"):
+            await self.channel_layer.group_add(group, self.channel_name)
+
+    async def group_discard(self, group):
+        with span(f"group_discard.{group_kind(group)}"):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def group_send(self, group, message):
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.group_sends += 1
+        with span(f"group_send.{group_kind(group)}"), LAYER_SEND_SECONDS.time(kind="group"):
+            await self.channel_layer.group_send(group, inject(message))
+
+    async def layer_send(self, channel, message):
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.layer_sends += 1
+        with span("layer_send"), LAYER_SEND_SECONDS.time(kind="direct"):
+            await self.channel_layer.send(channel, inject(message))
@@ -0,0 +1,134 @@
+"""
+Priority lanes for consumer messages.
+
+Signaling (`voice_chat_config`: SDP offers/answers and ICE candidates) is
+latency-critical and must never queue behind presence (`tent_event`:
+joins/leaves), which is lossy-tolerant. Consumers send signaling to the socket
+as soon as it arrives, while presence goes through a per-connection
+`PresenceLane` that:
+
+    - flushes after PRESENCE_FLUSH_INTERVAL seconds, behind any signaling
+      handled in the meantime, so a join storm does not delay call setup
+    - collapses repeated events for the same user in the same tent to the
+      latest one (a join followed by a leave is sent as the leave)
+    - keeps at most PRESENCE_MAX_PENDING events, dropping the oldest under
+      pressure
+
+Because presence handlers no longer write to the socket, the consumer's inbox
+drains quickly, so signaling does not run into channel capacity
+(`ChannelFull`) during a storm. The price is latency: with the default
+PRESENCE_FLUSH_INTERVAL of 50 ms, every presence event reaches the client up
+to 50 ms later than before. PRESENCE_FLUSH_INTERVAL = 0 sends presence
+immediately, as before.
+"""
+import asyncio
+import itertools
+import json
+import logging
+from collections import OrderedDict
+from django.conf import settings
+from goldenhorde.metrics import PRESENCE_EVENTS
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, "PRESENCE_FLUSH_INTERVAL", 0.05)
+MAX_PENDING = getattr(settings, "PRESENCE_MAX_PENDING", 500)
+
+SIGNALING_TYPES = {"voice_chat_config"}
+PRESENCE_TYPES = {"tent_event", "tent_event_batch"}
+COLLAPSIBLE_EVENTS = {"user_joined", "user_left"}
+
+_unique = itertools.count()
+
+
+def presence_key(data):
+    """Events with the same key supersede each other; others are kept individually"""
+    if data.get("type") in COLLAPSIBLE_EVENTS and "username" in data:
+        return ("user", data.get("tent_id"), data["username"])
+    return ("event", next(_unique))
+
+
+class PresenceLane:
+    def __init__(self, send, interval=None, max_pending=None):
+        self.send = send
+        self.interval = FLUSH_INTERVAL if interval is None else interval
+        self.max_pending = MAX_PENDING if max_pending is None else max_pending
+        self.pending = OrderedDict()
+        self.flusher = None
+        self.closed = False
+
+    async def push(self, data):
+        if self.closed:
+            return
+        if not self.interval:
+            PRESENCE_EVENTS.inc(outcome="sent")
+            await self.send(data)
+            return
+        key = presence_key(data)
+        if key in self.pending:
+            del self.pending[key]
+            PRESENCE_EVENTS.inc(outcome="collapsed")
+        elif len(self.pending) >= self.max_pending:
+            self.pending.popitem(last=False)
+            PRESENCE_EVENTS.inc(outcome="dropped")
+        self.pending[key] = data
+        if self.flusher is None:
+            self.flusher = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.interval)
+        self.flusher = None
+        await self.flush()
+
+    async def flush(self):
+        while self.pending and not self.closed:
+            _, data = self.pending.popitem(last=False)
+            PRESENCE_EVENTS.inc(outcome="sent")
+            await self.send(data)
+
+    async def close(self):
+        """Send what is pending and stop accepting events"""
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        try:
+            await self.flush()
+        finally:
+            self.closed = True
+            self.pending.clear()
+
+
+class PresenceLaneMixin:
+    """Routes presence through a `PresenceLane`; flushes it before the socket closes."""
+    presence_lane = None
+
+    async def send_presence(self, data):
+        if self.presence_lane is None:
+            self.presence_lane = PresenceLane(lambda payload: self.send(text_data=json.dumps(payload)))
+        await self.presence_lane.push(data)
+
+    async def tent_event_batch(self, event):
+        """Several presence events sent as one group message, delivered to the client one by one"""
+        for data in event["events"]:
+            await self.send_presence(data)
+
+    async def close_presence_lane(self):
+        if self.presence_lane is not None:
+            await self.presence_lane.close()
+
+    async def drain(self):
+        # Deliver pending presence (e.g. the drain's user_left batch) ahead of the reconnect notice
+        await self.close_presence_lane()
+        await super().drain()
+
+    async def close(self, *args, **kwargs):
+        await self.close_presence_lane()
+        await super().close(*args, **kwargs)
+
+    async def websocket_disconnect(self, message):
+        if self.presence_lane is not None:
+            # The socket is gone, there is nothing to flush to
+            self.presence_lane.closed = True
+            if self.presence_lane.flusher is not None:
+                self.presence_lane.flusher.cancel()
+        await super().websocket_disconnect(message)
@@ -1,6 +1,6 @@
 import logging
 from django.core.management.base import BaseCommand
-from django.core.cache import cache
+from goldenhorde.sharding import presence_caches
 
 logger = logging.getLogger(__name__)
 
@@ -27,27 +27,28 @@ class Command(BaseCommand):
         if verbose:
             self.stdout.write("Starting WebSocket cache cleanup...")
 
-        # Get all cache keys (this is Redis-specific)
-        if hasattr(cache, '_cache') and hasattr(cache._cache, 'scan_iter'):
-            # Redis backend
-            keys_to_check = []
-            for key in cache._cache.scan_iter(match="ws_*"):
-                keys_to_check.append(key.decode('utf-8'))
-        else:
-            # For other backends, we can't easily scan all keys
-            self.stdout.write(
-                self.style.WARNING(
-                    "Cache backend doesn't support key scanning. "
-                    "Cleanup will be limited."
+        # Get all cache keys of every presence shard (this is Redis-specific)
+        keys_to_check = []
+        for cache in presence_caches():
+            if hasattr(cache, '_cache') and hasattr(cache._cache, 'scan_iter'):
+                # Redis backend
+                for key in cache._cache.scan_iter(match="ws_*"):
+                    keys_to_check.append((cache, key.decode('utf-8')))
+            else:
+                # For other backends, we can't easily scan all keys
+                self.stdout.write(
+                    self.style.WARNING(
+                        "Cache backend doesn't support key scanning. "
+                        "Cleanup will be limited."
+                    )
                 )
-            )
-            return
+                return
 
         if verbose:
             self.stdout.write(f"Found {len(keys_to_check)} WebSocket-related cache keys")
 
         cleaned_count = 0
-        for key in keys_to_check:
+        for cache, key in keys_to_check:
             if key.startswith('ws_channel_') or key.startswith('ws_tent_'):
                 if dry_run:
                     self.stdout.write(f"Would clean: {key}")
@@ -0,0 +1,136 @@
+import io
+import random
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.authtoken.models import Token
+from hordes.models import Horde, Tent, TentParticipant
+
+User = get_user_model()
+
+
+def synthetic_email_domain(prefix):
+    """Email domain that marks generated users; `.invalid` never belongs to a real account."""
+    return f"{prefix}.synthetic.invalid"
+
+
+def synthetic_users(prefix):
+    return User.objects.filter(email__endswith=f"@{synthetic_email_domain(prefix)}")
+
+
+def batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def tent_weights(count, distribution, alpha):
+    """Relative tent popularity: flat, or Zipf-like power law where tent k gets 1 / k**alpha."""
+    if distribution == "uniform":
+        return [1.0] * count
+    weights = [1.0 / (rank ** alpha) for rank in range(1, count + 1)]
+    random.shuffle(weights)
+    return weights
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate synthetic users, tokens, hordes, tents and tent participants for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--hordes', type=int, default=100)
+        parser.add_argument('--tents-per-horde', type=int, default=10)
+        parser.add_argument('--participants', type=float, default=0.3,
+                            help='Fraction of users currently sitting in a tent')
+        parser.add_argument('--distribution', choices=['uniform', 'powerlaw'], default='powerlaw',
+                            help='How participants spread over tents')
+        parser.add_argument('--alpha', type=float, default=1.2, help='Power-law exponent')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='synth', help='Username and name prefix of generated rows')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--copy', action='store_true', help='Load users and participants with COPY (PostgreSQL)')
+        parser.add_argument('--reset', action='store_true',
+                            help='Delete users generated with this prefix (tagged by their email domain) and their rows first')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        prefix = options['prefix']
+        batch_size = options['batch_size']
+        use_copy = options['copy'] and connection.vendor == 'postgresql'
+        start = time.perf_counter()
+
+        if options['reset']:
+            # Only users carrying the generated email domain; cascades to their tokens, hordes, tents and participants
+            deleted, _ = synthetic_users(prefix).delete()
+            self.stdout.write(f"Deleted {deleted} previously generated rows")
+
+        with transaction.atomic():
+            user_ids = self.create_users(prefix, options['users'], batch_size, use_copy)
+            self.step("users", len(user_ids), start)
+
+            Token.objects.bulk_create(
+                (Token(key=Token.generate_key(), user_id=user_id) for user_id in user_ids), batch_size=batch_size,
+            )
+            self.step("tokens", len(user_ids), start)
+
+            Horde.objects.bulk_create(
+                [Horde(name=f"{prefix} horde {i}", greatkhan_id=random.choice(user_ids)) for i in range(options['hordes'])],
+                batch_size=batch_size,
+            )
+            hordes = list(Horde.objects.filter(greatkhan__in=synthetic_users(prefix), name__startswith=f"{prefix} horde ")
+                          .values_list("pk", flat=True))
+            Tent.objects.bulk_create(
+                [Tent(name=f"{prefix} tent {h}-{i}", horde_id=horde_id)
+                 for h, horde_id in enumerate(hordes) for i in range(options['tents_per_horde'])],
+                batch_size=batch_size,
+            )
+            tent_ids = list(Tent.objects.filter(horde__in=hordes).values_list("pk", flat=True))
+            self.step("hordes and tents", len(hordes) + len(tent_ids), start)
+
+            # Each seated user sits in exactly one tent, as with live presence
+            seated = random.sample(user_ids, int(len(user_ids) * options['participants']))
+            chosen = random.choices(tent_ids, weights=tent_weights(len(tent_ids), options['distribution'], options['alpha']), k=len(seated))
+            rows = list(zip(chosen, seated))
+            if use_copy:
+                self.copy_rows(TentParticipant._meta.db_table, ["tent_id", "user_id", "joined_at"],
+                               ((tent_id, user_id, "now") for tent_id, user_id in rows))
+            else:
+                for batch in batched(rows, batch_size):
+                    TentParticipant.objects.bulk_create([TentParticipant(tent_id=t, user_id=u) for t, u in batch])
+            self.step("participants", len(rows), start)
+
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.perf_counter() - start:.1f}s"))
+
+    def create_users(self, prefix, count, batch_size, use_copy):
+        # Pre-hashed unusable password: hashing per row would dominate the run
+        names = [f"{prefix}_{i}" for i in range(count)]
+        domain = synthetic_email_domain(prefix)
+        if use_copy:
+            self.copy_rows(User._meta.db_table,
+                           ["username", "email", "password", "first_name", "last_name",
+                            "is_staff", "is_active", "is_superuser", "date_joined"],
+                           ((name, f"{name}@{domain}", "!", "", "", "f", "t", "f", "now") for name in names))
+        else:
+            for batch in batched(names, batch_size):
+                User.objects.bulk_create([User(username=name, email=f"{name}@{domain}", password="!") for name in batch])
+        return list(synthetic_users(prefix).values_list("pk", flat=True))
+
+    def copy_rows(self, table, columns, rows):
+        """COPY rows into `table`; timestamp columns may use PostgreSQL's special "now" input."""
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join(str(value) for value in row) + "\n")
+        buffer.seek(0)
+        sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, "copy_expert"):
+                # psycopg2
+                raw.copy_expert(sql, buffer)
+            else:
+                # psycopg 3, e.g. with the DB_POOL connection pool
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
+    def step(self, label, count, start):
+        self.stdout.write(f"{label}: {count} rows ({time.perf_counter() - start:.1f}s elapsed)")
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from rest_framework.authtoken.models import Token
+from hordes.models import Horde, Tent, TentParticipant
+
+User = get_user_model()
+
+
+def percentiles(values):
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    pick = lambda pct: values[min(len(values) - 1, int(len(values) * pct))] * 1000  # noqa: E731
+    return f"p50 {pick(0.5):.2f}ms  p95 {pick(0.95):.2f}ms  p99 {pick(0.99):.2f}ms"
+
+
+class Replay:
+    """Re-drives a capture against the in-process ASGI application and checks delivery."""
+
+    def __init__(self, events, tokens, tents, speed):
+        self.events = events
+        self.tokens = tokens
+        self.tents = tents
+        self.speed = speed
+        self.clients = {}
+        self.readers = {}
+        self.connected = defaultdict(set)
+        self.expected = {}
+        self.sent_at = {}
+        self.delivered = defaultdict(set)
+        self.latencies = []
+        self.schedule_lag = []
+
+    async def read(self, peer, communicator):
+        while True:
+            message = json.loads(await communicator.receive_from(timeout=3600))
+            seq = message.get("replay_seq")
+            if seq is not None:
+                self.delivered[seq].add(peer)
+                self.latencies.append(time.perf_counter() - self.sent_at[seq])
+
+    async def join(self, event):
+        from channels.testing import WebsocketCommunicator
+        from goldenhorde.asgi import application
+
+        peer, tent = event["peer"], event["tent"]
+        communicator = WebsocketCommunicator(
+            application, f"/ws/voice_chat/{self.tents[tent]}/?token={self.tokens[peer]}",
+            headers=[(b"origin", b"http://localhost"), (b"host", b"localhost")],
+        )
+        connected, _ = await communicator.connect(timeout=30)
+        if not connected:
+            return
+        self.clients[peer] = communicator
+        self.connected[tent].add(peer)
+        self.readers[peer] = asyncio.ensure_future(self.read(peer, communicator))
+
+    async def leave(self, event):
+        peer, tent = event["peer"], event["tent"]
+        communicator = self.clients.pop(peer, None)
+        if communicator is None:
+            return
+        self.readers.pop(peer).cancel()
+        self.connected[tent].discard(peer)
+        await communicator.disconnect()
+
+    async def frame(self, seq, event):
+        peer, tent = event["peer"], event["tent"]
+        communicator = self.clients.get(peer)
+        if communicator is None:
+            return
+        data = dict(event["data"], replay_seq=seq)
+        target = data.get("target_user")
+        if target:
+            self.expected[seq] = {target} if target in self.connected[tent] else set()
+        else:
+            # Broadcasts go to the whole tent group, sender included
+            self.expected[seq] = set(self.connected[tent])
+        self.sent_at[seq] = time.perf_counter()
+        await communicator.send_to(text_data=json.dumps(data))
+
+    async def run(self, settle):
+        start = time.perf_counter()
+        for seq, event in enumerate(self.events):
+            due = start + event["t"] / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.schedule_lag.append(-delay)
+            if event["k"] == "join":
+                await self.join(event)
+            elif event["k"] == "leave":
+                await self.leave(event)
+            else:
+                await self.frame(seq, event)
+        await asyncio.sleep(settle)
+        for peer in list(self.clients):
+            self.readers.pop(peer).cancel()
+            await self.clients.pop(peer).disconnect()
+        # The consumers' persistent connection lives on asgiref's sync thread; don't leave it open
+        await sync_to_async(connections.close_all)()
+        return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = 'Replay a captured signaling session (see hordes/capture.py) and check that delivery matches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('capture_file')
+        parser.add_argument('--speed', type=float, default=1.0, help='Time acceleration factor, e.g. 10 for 10x')
+        parser.add_argument('--settle', type=float, default=2.0, help='Seconds to wait for in-flight deliveries')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['capture_file']) as f:
+                events = sorted((json.loads(line) for line in f if line.strip()), key=lambda e: e["t"])
+        except FileNotFoundError:
+            raise CommandError(f"Capture file {options['capture_file']} not found")
+        if not events:
+            raise CommandError("Capture file is empty")
+        # Timestamps are absolute and may come from several workers; replay relative to the first event
+        origin = events[0]["t"]
+        events = [dict(event, t=event["t"] - origin) for event in events]
+
+        tokens, tents = self.prepare(events)
+        replay = Replay(events, tokens, tents, options['speed'])
+        elapsed = asyncio.run(replay.run(options['settle']))
+
+        frames = len(replay.expected)
+        mismatched = [seq for seq, expected in replay.expected.items() if replay.delivered.get(seq, set()) != expected]
+        missing = sum(len(expected - replay.delivered.get(seq, set())) for seq, expected in replay.expected.items())
+        unexpected = sum(len(replay.delivered.get(seq, set()) - expected) for seq, expected in replay.expected.items())
+        self.stdout.write(f"Replayed {len(events)} events ({frames} frames) in {elapsed:.2f}s at {options['speed']}x")
+        self.stdout.write(f"Delivery latency: {percentiles(replay.latencies)}")
+        if replay.schedule_lag:
+            self.stdout.write(f"Fell behind schedule on {len(replay.schedule_lag)} events, worst {max(replay.schedule_lag) * 1000:.1f}ms")
+        if mismatched:
+            self.stdout.write(self.style.ERROR(
+                f"Delivery mismatch on {len(mismatched)} frames: {missing} missing, {unexpected} unexpected deliveries"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS("Delivery matches the capture"))
+
+    def prepare(self, events):
+        """Create a user with a token per peer alias and a tent per tent alias."""
+        peers = sorted({event["peer"] for event in events})
+        existing = set(User.objects.filter(username__in=peers).values_list("username", flat=True))
+        User.objects.bulk_create([User(username=peer) for peer in peers if peer not in existing])
+        users = list(User.objects.filter(username__in=peers))
+        with_token = set(Token.objects.filter(user__in=users).values_list("user_id", flat=True))
+        Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users if user.pk not in with_token])
+        tokens = dict(Token.objects.filter(user__in=users).values_list("user__username", "key"))
+        TentParticipant.objects.filter(user__in=users).delete()
+
+        khan, _ = User.objects.get_or_create(username="replay_khan")
+        horde, _ = Horde.objects.get_or_create(name="replay", greatkhan=khan)
+        tents = {}
+        for alias in sorted({event["tent"] for event in events}):
+            tent, _ = Tent.objects.get_or_create(name=alias, horde=horde)
+            tents[alias] = tent.pk
+        return tokens, tents
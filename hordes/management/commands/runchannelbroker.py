@@ -0,0 +1,23 @@
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+from goldenhorde.channel_layers import ChannelBroker, get_broker_config
+
+
+class Command(BaseCommand):
+    help = 'Run the single-host channel layer broker used by UnixSocketChannelLayer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help='Socket path (defaults to the CHANNEL_LAYERS config)')
+
+    def handle(self, *args, **options):
+        config = get_broker_config()
+        if config is None:
+            raise CommandError("CHANNEL_LAYERS['default'] does not use UnixSocketChannelLayer")
+        if options['path']:
+            config['path'] = options['path']
+        broker = ChannelBroker(**config)
+        self.stdout.write(f"Channel broker listening on {broker.path}")
+        try:
+            asyncio.run(broker.serve_forever())
+        except KeyboardInterrupt:
+            pass
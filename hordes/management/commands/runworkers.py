@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from goldenhorde.channel_layers import get_broker_config, start_broker_thread
+
+logger = logging.getLogger(__name__)
+
+
+def read_rss(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Worker:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.restart_at = 0
+        self.last_exit_code = None
+
+    def status(self):
+        alive = self.process is not None and self.process.poll() is None
+        return {
+            "index": self.index,
+            "pid": self.process.pid if self.process else None,
+            "alive": alive,
+            "uptime": round(time.time() - self.started_at, 1) if alive else 0,
+            "restarts": self.restarts,
+            "last_exit_code": self.last_exit_code,
+            "rss_bytes": read_rss(self.process.pid) if alive else None,
+        }
+
+
+class Supervisor:
+    """
+    Runs N daphne workers on one inherited listening socket.
+
+    The kernel load-balances accepted connections across the workers. Crashed
+    workers are restarted with backoff; on SIGTERM/SIGINT the listening socket
+    is closed and workers get SIGTERM, then SIGKILL after the grace period.
+    """
+
+    def __init__(self, sock, count, application, grace, daphne_args):
+        self.sock = sock
+        self.application = application
+        self.grace = grace
+        self.daphne_args = daphne_args
+        self.workers = [Worker(i) for i in range(count)]
+        self.stopping = threading.Event()
+
+    def spawn(self, worker):
+        fd = self.sock.fileno()
+        command = [sys.executable, "-m", "daphne", "--fd", str(fd), *self.daphne_args, self.application]
+        env = dict(os.environ, GOLDENHORDE_WORKER_INDEX=str(worker.index))
+        worker.process = subprocess.Popen(command, pass_fds=(fd,), env=env)
+        worker.started_at = time.time()
+        logger.info("Started worker %s (pid %s)", worker.index, worker.process.pid)
+
+    def run(self):
+        for worker in self.workers:
+            self.spawn(worker)
+        while not self.stopping.wait(0.5):
+            now = time.time()
+            for worker in self.workers:
+                if worker.process is None:
+                    if now >= worker.restart_at:
+                        self.spawn(worker)
+                    continue
+                code = worker.process.poll()
+                if code is None:
+                    continue
+                worker.last_exit_code = code
+                worker.restarts += 1
+                # Back off when a worker keeps crashing right after start
+                delay = min(30, 2 ** min(worker.restarts, 5)) if now - worker.started_at < 5 else 0
+                logger.warning("Worker %s (pid %s) exited with %s, restarting in %ss",
+                               worker.index, worker.process.pid, code, delay)
+                worker.process = None
+                worker.restart_at = now + delay
+        self.drain()
+
+    def drain(self):
+        # Stop accepting: workers still hold the fd, but no new worker will
+        self.sock.close()
+        for worker in self.workers:
+            if worker.process and worker.process.poll() is None:
+                worker.process.send_signal(signal.SIGTERM)
+        deadline = time.time() + self.grace
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.process.wait(timeout=max(0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                logger.warning("Worker %s did not drain in %ss, killing", worker.index, self.grace)
+                worker.process.kill()
+                worker.process.wait()
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def status(self):
+        return {"workers": [worker.status() for worker in self.workers], "stopping": self.stopping.is_set()}
+
+
+def make_health_handler(supervisor):
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status = supervisor.status()
+            healthy = all(worker["alive"] for worker in status["workers"]) and not status["stopping"]
+            body = json.dumps(status).encode()
+            self.send_response(200 if healthy else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return HealthHandler
+
+
+class Command(BaseCommand):
+    help = 'Run several daphne workers sharing one listening socket, with restarts and graceful drain'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1)))
+        parser.add_argument('--bind', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--health-port', type=int, default=None, help='Serve per-worker status JSON on this port')
+        parser.add_argument('--grace', type=float, default=30.0, help='Seconds workers get to drain on shutdown')
+        parser.add_argument('--application', default='goldenhorde.asgi:application')
+        parser.add_argument('daphne_args', nargs='*', help='Extra arguments passed to daphne (after --)')
+
+    def handle(self, *args, **options):
+        if options['workers'] > 1 and settings.CHANNEL_LAYERS['default']['BACKEND'] == 'channels.layers.InMemoryChannelLayer':
+            self.stdout.write(self.style.WARNING(
+                "InMemoryChannelLayer is per-process: signaling between users on different workers will not work"
+            ))
+        if options['workers'] > 1 and not getattr(settings, 'METRICS_DIR', None):
+            self.stdout.write(self.style.WARNING("METRICS_DIR is not set: /metrics will only show the answering worker"))
+
+        sock = socket.socket(socket.AF_INET6 if ':' in options['bind'] else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((options['bind'], options['port']))
+        sock.listen(1024)
+        sock.set_inheritable(True)
+
+        broker_config = get_broker_config()
+        if broker_config is not None:
+            # Workers share the supervisor's broker, which outlives worker restarts
+            try:
+                broker = start_broker_thread(**broker_config)
+            except (OSError, TimeoutError) as e:
+                raise CommandError(f"Could not start the channel broker: {e}")
+            self.stdout.write(f"Channel broker listening on {broker.path}")
+
+        supervisor = Supervisor(sock, options['workers'], options['application'], options['grace'], options['daphne_args'])
+        signal.signal(signal.SIGTERM, supervisor.stop)
+        signal.signal(signal.SIGINT, supervisor.stop)
+
+        if options['health_port']:
+            health = ThreadingHTTPServer((options['bind'], options['health_port']), make_health_handler(supervisor))
+            threading.Thread(target=health.serve_forever, daemon=True).start()
+
+        self.stdout.write(f"Serving {options['application']} on {options['bind']}:{options['port']} "
+                          f"with {options['workers']} workers")
+        supervisor.run()
+        self.stdout.write(self.style.SUCCESS("All workers stopped"))
@@ -0,0 +1,59 @@
+import json
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = 'Summarize recorded trace spans: p50/p95/p99 duration per stage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=None, help='Trace file (defaults to TRACE_FILE)')
+        parser.add_argument('--prefix', default='', help='Only stages whose name starts with this prefix')
+        parser.add_argument('--trace', default=None, help='Print the spans of a single trace id')
+
+    def handle(self, *args, **options):
+        path = options['file'] or settings.TRACE_FILE
+        try:
+            with open(path) as f:
+                spans = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            raise CommandError(f"Trace file {path} not found; is TRACING_ENABLED set?")
+
+        if options['trace']:
+            self.print_trace([s for s in spans if s['trace_id'] == options['trace']])
+            return
+
+        durations = defaultdict(list)
+        for s in spans:
+            if s['name'].startswith(options['prefix']):
+                durations[s['name']].append(s['duration_ms'])
+
+        self.stdout.write(f"{'stage':<40} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name in sorted(durations, key=lambda n: -percentile(sorted(durations[n]), 95)):
+            values = sorted(durations[name])
+            self.stdout.write(
+                f"{name:<40} {len(values):>7} {percentile(values, 50):>9.2f} {percentile(values, 95):>9.2f} "
+                f"{percentile(values, 99):>9.2f} {values[-1]:>9.2f}"
+            )
+
+    def print_trace(self, spans):
+        if not spans:
+            raise CommandError("No spans recorded for that trace id")
+        children = defaultdict(list)
+        ids = {s['span_id'] for s in spans}
+        for s in sorted(spans, key=lambda s: s['start']):
+            children[s['parent_id'] if s['parent_id'] in ids else None].append(s)
+
+        def walk(parent_id, depth):
+            for s in children[parent_id]:
+                self.stdout.write(f"{'  ' * depth}{s['name']} {s['duration_ms']:.2f}ms")
+                walk(s['span_id'], depth + 1)
+        walk(None, 0)
@@ -0,0 +1,158 @@
+"""
+Process-local registry of tent metadata.
+
+`VoiceChatConsumer` needs to know a tent exists on every connect and
+disconnect, and tents almost never change. The registry keeps
+tent id -> `TentInfo(pk, horde_id, name)` in an LRU with a TTL, and remembers
+unknown ids for a shorter NEGATIVE_TTL so junk `tent_id` values from the
+`\\w+` route cost at most one query (non-numeric ids cost none).
+
+Saving or deleting a Tent or Horde invalidates the affected entries locally
+and, after the transaction commits, on every worker through the `tent_registry`
+channel layer group (see hordes/signals.py). The TTL bounds staleness if a
+broadcast is lost.
+
+Settings:
+    TENT_REGISTRY_SIZE          entries kept, positive and negative (default 10000)
+    TENT_REGISTRY_TTL           seconds a known tent is trusted (default 300)
+    TENT_REGISTRY_NEGATIVE_TTL  seconds an unknown id is remembered (default 30)
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from channels.layers import get_channel_layer
+from django.conf import settings
+from goldenhorde.metrics import TENT_REGISTRY
+from .instrumentation import db_sync_to_async
+from .models import Tent
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_GROUP = "tent_registry"
+INVALIDATE_MESSAGE = "tent_registry.invalidate"
+
+SIZE = getattr(settings, "TENT_REGISTRY_SIZE", 10000)
+TTL = getattr(settings, "TENT_REGISTRY_TTL", 300)
+NEGATIVE_TTL = getattr(settings, "TENT_REGISTRY_NEGATIVE_TTL", 30)
+# Re-join the group well before channels_redis' default group expiry
+LISTENER_REJOIN_INTERVAL = 3600
+
+TentInfo = namedtuple("TentInfo", "pk horde_id name")
+
+
+def parse_tent_id(tent_id):
+    try:
+        return int(tent_id)
+    except (TypeError, ValueError):
+        return None
+
+
+class TentRegistry:
+    def __init__(self, size=SIZE, ttl=TTL, negative_ttl=NEGATIVE_TTL, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.entries = OrderedDict()  # tent id -> (expires_at, TentInfo or None)
+        # Invalidation runs in sync signal handlers on other threads
+        self.lock = threading.Lock()
+        self.listener = None
+        # Bumped by every invalidation, so a load that raced one is not stored
+        self.generation = 0
+
+    def lookup(self, tent_id):
+        """Return (found, info) from the registry without touching the DB"""
+        with self.lock:
+            entry = self.entries.get(tent_id)
+            if entry is None:
+                return False, None
+            if entry[0] < self.clock():
+                del self.entries[tent_id]
+                return False, None
+            self.entries.move_to_end(tent_id)
+            return True, entry[1]
+
+    def store(self, tent_id, info, generation=None):
+        """Cache `info` unless an invalidation happened since `generation` was read"""
+        ttl = self.ttl if info is not None else self.negative_ttl
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[tent_id] = (self.clock() + ttl, info)
+            self.entries.move_to_end(tent_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, tent_id=None, horde_id=None):
+        with self.lock:
+            self.generation += 1
+            if tent_id is not None:
+                self.entries.pop(tent_id, None)
+            if horde_id is not None:
+                for key in [k for k, (_, info) in self.entries.items() if info is not None and info.horde_id == horde_id]:
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    async def get(self, tent_id):
+        """TentInfo for `tent_id`, or None when no such tent exists"""
+        self.ensure_listener()
+        pk = parse_tent_id(tent_id)
+        if pk is None:
+            TENT_REGISTRY.inc(result="invalid")
+            return None
+        found, info = self.lookup(pk)
+        if found:
+            TENT_REGISTRY.inc(result="hit" if info is not None else "negative_hit")
+            return info
+        TENT_REGISTRY.inc(result="miss")
+        generation = self.generation
+        info = await self.load(pk)
+        self.store(pk, info, generation)
+        return info
+
+    @staticmethod
+    @db_sync_to_async
+    def load(pk):
+        row = Tent.objects.filter(pk=pk).values_list("pk", "horde_id", "name").first()
+        return TentInfo(*row) if row else None
+
+    def ensure_listener(self):
+        if self.listener is None or self.listener.done() or self.listener.get_loop() is not asyncio.get_running_loop():
+            self.listener = asyncio.ensure_future(self.listen())
+
+    async def listen(self):
+        """Apply invalidations broadcast by other workers until cancelled"""
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        channel = await layer.new_channel()
+        try:
+            while True:
+                await layer.group_add(REGISTRY_GROUP, channel)
+                # A missed broadcast leaves entries stale for at most TTL
+                rejoin_at = time.monotonic() + LISTENER_REJOIN_INTERVAL
+                while time.monotonic() < rejoin_at:
+                    try:
+                        message = await asyncio.wait_for(layer.receive(channel), LISTENER_REJOIN_INTERVAL)
+                    except asyncio.TimeoutError:
+                        break
+                    if message.get("type") == INVALIDATE_MESSAGE:
+                        self.invalidate(tent_id=message.get("tent_id"), horde_id=message.get("horde_id"))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Tent registry listener failed, entries now expire by TTL only until restarted")
+        finally:
+            try:
+                await layer.group_discard(REGISTRY_GROUP, channel)
+            except Exception:
+                pass
+
+
+tent_registry = TentRegistry()
@@ -1,14 +1,44 @@
 from rest_framework import serializers
 from .models import Horde, Tent
 
+# Maximum number of usernames returned in a tent's occupancy preview
+OCCUPANCY_PREVIEW_SIZE = 5
+
+
 class TentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tent
         fields = "__all__"
 
 
+class TentWithOccupancySerializer(TentSerializer):
+    """
+    Tent payload with live occupancy.
+
+    `participant_count` comes from the `Count('participants')` annotation and
+    `participants_preview` from the prefetched `preview_participants` list,
+    which is already limited to OCCUPANCY_PREVIEW_SIZE rows per tent, so
+    serializing never issues per-tent queries.
+    """
+    participant_count = serializers.IntegerField(read_only=True)
+    participants_preview = serializers.SerializerMethodField()
+
+    def get_participants_preview(self, obj):
+        participants = getattr(obj, "preview_participants", None)
+        if participants is None:
+            return None
+        return [p.user.username for p in participants]
+
+
 class HordeWithTentsSerializer(serializers.ModelSerializer):
     tents = TentSerializer(many=True)
     class Meta:
         model = Horde
-        fields = "__all__"
\ No newline at end of file
+        fields = "__all__"
+
+
+class HordeWithOccupancySerializer(serializers.ModelSerializer):
+    tents = TentWithOccupancySerializer(many=True)
+    class Meta:
+        model = Horde
+        fields = "__all__"
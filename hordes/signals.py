@@ -0,0 +1,37 @@
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Horde, Tent
+from .registry import INVALIDATE_MESSAGE, REGISTRY_GROUP, tent_registry
+
+logger = logging.getLogger(__name__)
+
+
+def broadcast_invalidation(**ids):
+    """Invalidate locally now and on every worker once the transaction commits"""
+    tent_registry.invalidate(**ids)
+
+    def send():
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        try:
+            async_to_sync(layer.group_send)(REGISTRY_GROUP, {"type": INVALIDATE_MESSAGE, **ids})
+        except Exception:
+            logger.exception("Failed to broadcast tent registry invalidation %s", ids)
+    transaction.on_commit(send)
+
+
+@receiver(post_save, sender=Tent)
+@receiver(post_delete, sender=Tent)
+def invalidate_tent(sender, instance, **kwargs):
+    broadcast_invalidation(tent_id=instance.pk)
+
+
+@receiver(post_save, sender=Horde)
+@receiver(post_delete, sender=Horde)
+def invalidate_horde(sender, instance, **kwargs):
+    broadcast_invalidation(horde_id=instance.pk)
@@ -1,3 +1,442 @@
-from django.test import TestCase
+import asyncio
+import json
+import tempfile
+from io import StringIO
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from goldenhorde import tracing
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework import status
+from .admission import CLOSE_RATE_LIMITED, CLOSE_TENT_FULL, CLOSE_WORKER_FULL, AdmissionController, TokenBucket
+from .capture import alias, anonymize
+from .consumers import TentEventsConsumer
+from .drain import CLOSE_SERVICE_RESTART, DrainCoordinator
+from .instrumentation import aggregator
+from .lanes import PresenceLane
+from .registry import INVALIDATE_MESSAGE, REGISTRY_GROUP, TentInfo, TentRegistry
+from .models import Horde, Tent, TentParticipant
+from .routing import websocket_urlpatterns
+
+
+User = get_user_model()
+
+
+class HordesOccupancyTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.khan = User.objects.create_user(username='khan', password='khanpass123')
+        self.token = Token.objects.create(user=self.khan)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.horde = Horde.objects.create(name='Blue Horde', greatkhan=self.khan)
+        self.busy_tent = Tent.objects.create(name='Busy', horde=self.horde)
+        self.empty_tent = Tent.objects.create(name='Empty', horde=self.horde)
+        for i in range(3):
+            user = User.objects.create_user(username=f'rider{i}', password='riderpass123')
+            TentParticipant.objects.create(tent=self.busy_tent, user=user)
+
+    def get_tents(self, response):
+        return {tent['name']: tent for tent in response.data[0]['tents']}
+
+    def test_base_response_has_no_occupancy(self):
+        response = self.client.get('/api/hordes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tents = self.get_tents(response)
+        self.assertNotIn('participant_count', tents['Busy'])
+
+    def test_occupancy_counts(self):
+        response = self.client.get('/api/hordes/?include=occupancy')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tents = self.get_tents(response)
+        self.assertEqual(tents['Busy']['participant_count'], 3)
+        self.assertEqual(tents['Empty']['participant_count'], 0)
+        self.assertIsNone(tents['Busy']['participants_preview'])
+
+    def test_occupancy_with_participants_preview(self):
+        response = self.client.get('/api/hordes/?include=occupancy,participants')
+        tents = self.get_tents(response)
+        self.assertEqual(tents['Busy']['participants_preview'], ['rider0', 'rider1', 'rider2'])
+        self.assertEqual(tents['Empty']['participants_preview'], [])
+
+    def test_participants_preview_is_limited_per_tent(self):
+        for i in range(3, 8):
+            user = User.objects.create_user(username=f'rider{i}', password='riderpass123')
+            TentParticipant.objects.create(tent=self.busy_tent, user=user)
+        tents = self.get_tents(self.client.get('/api/hordes/?include=occupancy,participants'))
+        self.assertEqual(tents['Busy']['participant_count'], 8)
+        self.assertEqual(tents['Busy']['participants_preview'], [f'rider{i}' for i in range(5)])
+
+    def test_occupancy_query_count_is_constant(self):
+        other = Horde.objects.create(name='Red Horde', greatkhan=self.khan)
+        for i in range(5):
+            Tent.objects.create(name=f'Red {i}', horde=other)
+        # token auth + hordes + annotated tents + participants preview
+        with self.assertNumQueries(4):
+            self.client.get('/api/hordes/?include=occupancy,participants')
+
+
+class AsyncHordesViewsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.khan = User.objects.create_user(username='khan', password='khanpass123')
+        self.token = Token.objects.create(user=self.khan)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.horde = Horde.objects.create(name='Blue Horde', greatkhan=self.khan)
+        self.tent = Tent.objects.create(name='Busy', horde=self.horde)
+        TentParticipant.objects.create(tent=self.tent, user=self.khan)
+
+    def assertSameResponse(self, sync_url, async_url):
+        sync_response = self.client.get(sync_url)
+        async_response = self.client.get(async_url)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.content, sync_response.content)
+
+    def test_list_matches_viewset(self):
+        self.assertSameResponse('/api/hordes/', '/api/hordes/async/')
+        self.assertSameResponse('/api/hordes/?include=occupancy,participants', '/api/hordes/async/?include=occupancy,participants')
+
+    def test_detail_matches_viewset(self):
+        self.assertSameResponse(f'/api/hordes/{self.horde.pk}/', f'/api/hordes/async/{self.horde.pk}/')
+        self.assertSameResponse('/api/hordes/999999/', '/api/hordes/async/999999/')
+
+    def test_tent_detail(self):
+        response = self.client.get(f'/api/hordes/async/tents/{self.tent.pk}/?include=occupancy')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['participant_count'], 1)
+
+    def test_invalid_token_matches_viewset(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token not-a-real-token')
+        self.assertSameResponse('/api/hordes/', '/api/hordes/async/')
+
+
+class ConsumerInstrumentationTestCase(TestCase):
+    def setUp(self):
+        aggregator.reset()
+        self.user = User.objects.create_user(username='watcher', password='watcherpass123')
+
+    async def test_handlers_are_attributed_per_event(self):
+        communicator = WebsocketCommunicator(TentEventsConsumer.as_asgi(), '/ws/tent-events/')
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'ping', 'ts': 1})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'pong')
+        await communicator.disconnect()
+
+        stats = aggregator.snapshot()
+        self.assertEqual(stats['websocket.connect']['db_queries'], 1)
+        self.assertEqual(stats['websocket.connect']['sends'], 1)
+        self.assertEqual(stats['receive.ping']['count'], 1)
+        self.assertEqual(stats['receive.ping']['sends'], 1)
+        self.assertEqual(stats['receive.ping']['db_queries'], 0)
+
+
+class TraceSummaryTestCase(TestCase):
+    def test_spans_are_linked_and_summarized(self):
+        exported = []
+        with mock.patch.object(tracing, 'ENABLED', True), \
+                mock.patch.object(tracing.exporter, 'export', exported.append):
+            with tracing.start_trace('voice_chat.websocket.connect'):
+                with tracing.span('db.get_tent'):
+                    pass
+                message = tracing.inject({'type': 'tent_event'})
+            with tracing.continue_trace('tent_events.tent_event', message):
+                pass
+
+        names = [record['name'] for record in exported]
+        self.assertEqual(names, ['db.get_tent', 'voice_chat.websocket.connect', 'tent_events.tent_event'])
+        self.assertEqual(len({record['trace_id'] for record in exported}), 1)
+        self.assertEqual(exported[2]['parent_id'], exported[1]['span_id'])
+
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in exported))
+            f.flush()
+            out = StringIO()
+            call_command('trace_summary', '--file', f.name, stdout=out)
+        self.assertIn('db.get_tent', out.getvalue())
+        self.assertIn('p99 ms', out.getvalue())
+
+
+class SignalCaptureTestCase(TestCase):
+    def test_anonymize_keeps_shape_and_aliases_users(self):
+        frame = {'type': 'offer', 'target_user': 'khan', 'sdp': 'v=0 o=- 42', 'meta': {'candidate': 'abc', 'n': 3}}
+        anonymized = anonymize(frame)
+        self.assertEqual(anonymized['type'], 'offer')
+        self.assertEqual(anonymized['target_user'], alias('p', 'khan'))
+        self.assertEqual(anonymized['sdp'], 'x' * len(frame['sdp']))
+        self.assertEqual(anonymized['meta'], {'candidate': 'xxx', 'n': 3})
+
+
+class ReplaySignalingTestCase(TransactionTestCase):
+    def test_replays_a_capture_with_several_peers(self):
+        events = [
+            {'t': 1000.0, 'k': 'join', 'tent': 't1', 'peer': 'pa'},
+            {'t': 1000.1, 'k': 'join', 'tent': 't1', 'peer': 'pb'},
+            {'t': 1000.2, 'k': 'frame', 'tent': 't1', 'peer': 'pa', 'data': {'type': 'offer', 'target_user': 'pb', 'sdp': 'xxx'}},
+            {'t': 1000.3, 'k': 'frame', 'tent': 't1', 'peer': 'pb', 'data': {'type': 'mute', 'muted': True}},
+            {'t': 1000.4, 'k': 'leave', 'tent': 't1', 'peer': 'pb'},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as f:
+            f.write(''.join(json.dumps(event) + '\n' for event in events))
+            f.flush()
+            out = StringIO()
+            call_command('replay_signaling', f.name, '--speed', '10', '--settle', '0.5', stdout=out)
+        self.assertIn('Delivery matches the capture', out.getvalue())
+        tokens = Token.objects.filter(user__username__in=['pa', 'pb'])
+        self.assertEqual(len({token.key for token in tokens}), 2)
+
+
+class DrainTestCase(TransactionTestCase):
+    def setUp(self):
+        self.watcher = User.objects.create_user(username='watcher', password='watcherpass123')
+        self.horde = Horde.objects.create(name='Drained Horde', greatkhan=self.watcher)
+        self.tent = Tent.objects.create(name='Drained Tent', horde=self.horde)
+        self.speakers = [User.objects.create_user(username=f'speaker{i}', password='speakerpass123') for i in range(3)]
+
+    def communicator(self, path, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        communicator.scope['user'] = user
+        return communicator
+
+    async def test_drain_flushes_presence_in_bulk_and_closes_with_restart(self):
+        coordinator = DrainCoordinator()
+        with mock.patch('hordes.drain.coordinator', coordinator):
+            watcher = self.communicator('/ws/tent-events/', self.watcher)
+            await watcher.connect()
+            await watcher.receive_json_from()
+            speakers = []
+            for user in self.speakers:
+                speaker = self.communicator(f'/ws/voice_chat/{self.tent.pk}/', user)
+                connected, _ = await speaker.connect()
+                self.assertTrue(connected)
+                speakers.append(speaker)
+                self.assertEqual((await watcher.receive_json_from())['type'], 'user_joined')
+            for speaker in speakers:
+                while not await speaker.receive_nothing():
+                    await speaker.receive_output()
+
+            await coordinator.drain(wave_size=2, wave_interval=0.05)
+
+            # Existing clients only understand per-user user_left events
+            left = [await watcher.receive_json_from() for _ in self.speakers]
+            self.assertEqual({event['type'] for event in left}, {'user_left'})
+            self.assertCountEqual([event['username'] for event in left], [u.username for u in self.speakers])
+            for speaker in speakers:
+                for _ in self.speakers:
+                    self.assertEqual((await speaker.receive_json_from())['type'], 'user_left')
+                message = await speaker.receive_json_from()
+                self.assertEqual(message['type'], 'reconnect')
+                self.assertGreater(message['retry_after_ms'], 0)
+                self.assertEqual((await speaker.receive_output())['code'], CLOSE_SERVICE_RESTART)
+            self.assertFalse(await TentParticipant.objects.filter(tent=self.tent).aexists())
+
+            # New sockets are turned away while draining
+            late = self.communicator(f'/ws/voice_chat/{self.tent.pk}/', self.speakers[0])
+            connected, _ = await late.connect()
+            self.assertFalse(connected)
+
+
+class AdmissionControllerTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_token_bucket_refills_over_time(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+        self.assertTrue(bucket.take())
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+        now[0] = 0.5
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+
+    def test_worker_cap_and_handshake_rate(self):
+        controller = AdmissionController(max_connections=2, handshake_rate=0)
+        self.assertIsNone(controller.admit())
+        self.assertIsNone(controller.admit())
+        self.assertEqual(controller.admit(), CLOSE_WORKER_FULL)
+        controller.release()
+        self.assertIsNone(controller.admit())
+
+        controller = AdmissionController(handshake_rate=1, handshake_burst=1)
+        self.assertIsNone(controller.admit())
+        self.assertEqual(controller.admit(), CLOSE_RATE_LIMITED)
+
+    def test_tent_seats_are_per_user_and_expire(self):
+        now = [1000.0]
+        controller = AdmissionController(max_tent_participants=2, seat_ttl=60, clock=lambda: now[0])
+        self.assertTrue(controller.claim_tent_seat(1, 'rider0', 'old-socket'))
+        # A reconnect renews the user's seat instead of taking a second one
+        self.assertTrue(controller.claim_tent_seat(1, 'rider0', 'new-socket'))
+        self.assertTrue(controller.claim_tent_seat(1, 'rider1', 'socket'))
+        self.assertFalse(controller.claim_tent_seat(1, 'rider2', 'socket'))
+        # The replaced socket's late disconnect leaves the new seat alone
+        controller.release_tent_seat(1, 'rider0', 'old-socket')
+        self.assertFalse(controller.claim_tent_seat(1, 'rider2', 'socket'))
+        # Seats not refreshed within the TTL (e.g. a crashed worker's) free themselves
+        now[0] += 30
+        controller.refresh_tent_seat(1, 'rider1', 'socket')
+        now[0] += 45
+        self.assertTrue(controller.claim_tent_seat(1, 'rider2', 'socket'))
+        self.assertFalse(controller.claim_tent_seat(1, 'rider3', 'socket'))
+
+
+class AdmissionConsumerTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.khan = User.objects.create_user(username='khan', password='khanpass123')
+        self.horde = Horde.objects.create(name='Crowded Horde', greatkhan=self.khan)
+        self.tent = Tent.objects.create(name='Crowded Tent', horde=self.horde)
+        self.riders = [User.objects.create_user(username=f'rider{i}', password='riderpass123') for i in range(3)]
+
+    def communicator(self, path, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        communicator.scope['user'] = user
+        return communicator
+
+    async def test_unknown_tent_does_not_create_seats(self):
+        with mock.patch('hordes.consumers.admission', AdmissionController(max_tent_participants=2)):
+            communicator = self.communicator('/ws/voice_chat/999999/', self.riders[0])
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+        self.assertIsNone(cache.get(AdmissionController.get_tent_seats_key('999999')))
+
+    async def test_tent_cap_rejects_with_distinct_code_and_frees_seats(self):
+        with mock.patch('hordes.consumers.admission', AdmissionController(max_tent_participants=2)):
+            path = f'/ws/voice_chat/{self.tent.pk}/'
+            first, second, third = (self.communicator(path, user) for user in self.riders)
+            for communicator in (first, second):
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+            connected, _ = await third.connect()
+            self.assertTrue(connected)
+            self.assertEqual((await third.receive_output())['code'], CLOSE_TENT_FULL)
+            self.assertEqual(await TentParticipant.objects.filter(tent=self.tent).acount(), 2)
+
+            await first.disconnect()
+            retry = self.communicator(path, self.riders[2])
+            connected, _ = await retry.connect()
+            self.assertTrue(connected)
+            self.assertEqual((await retry.receive_json_from())['type'], 'connect_info')
+            await second.disconnect()
+            await retry.disconnect()
+
+
+class PresenceLaneTestCase(TestCase):
+    def setUp(self):
+        self.watcher = User.objects.create_user(username='watcher', password='watcherpass123')
+
+    async def test_presence_is_deferred_collapsed_and_bounded(self):
+        sent = []
+
+        async def send(data):
+            sent.append(data)
+
+        lane = PresenceLane(send, interval=0.01, max_pending=2)
+        await lane.push({'type': 'user_joined', 'tent_id': 1, 'username': 'khan'})
+        await lane.push({'type': 'user_left', 'tent_id': 1, 'username': 'khan'})
+        self.assertEqual(sent, [])
+        await asyncio.sleep(0.05)
+        self.assertEqual(sent, [{'type': 'user_left', 'tent_id': 1, 'username': 'khan'}])
+
+        for username in ('a', 'b', 'c'):
+            await lane.push({'type': 'user_joined', 'tent_id': 1, 'username': username})
+        await lane.close()
+        self.assertEqual([data['username'] for data in sent[1:]], ['b', 'c'])
+        await lane.push({'type': 'user_joined', 'tent_id': 1, 'username': 'd'})
+        self.assertEqual(len(sent), 3)
+
+    async def test_signaling_is_not_queued_behind_presence(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/tent-events/')
+        communicator.scope['user'] = self.watcher
+        await communicator.connect()
+        await communicator.receive_json_from()
+        layer = get_channel_layer()
+        for i in range(20):
+            await layer.group_send('tent_events', {'type': 'tent_event', 'data': {
+                'type': 'user_joined', 'tent_id': 1, 'username': f'rider{i % 5}'}})
+        await communicator.send_json_to({'type': 'ping', 'ts': 1})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'pong')
+        presence = [await communicator.receive_json_from() for _ in range(5)]
+        self.assertCountEqual([p['username'] for p in presence], [f'rider{i}' for i in range(5)])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+class TentRegistryTestCase(TestCase):
+    def setUp(self):
+        self.khan = User.objects.create_user(username='khan', password='khanpass123')
+        self.horde = Horde.objects.create(name='Golden Horde', greatkhan=self.khan)
+        self.tent = Tent.objects.create(name='Great Tent', horde=self.horde)
+        self.now = [0.0]
+        self.registry = TentRegistry(size=2, ttl=60, negative_ttl=5, clock=lambda: self.now[0])
+
+    def get(self, tent_id):
+        return async_to_sync(self.registry.get)(tent_id)
+
+    def test_hits_misses_and_negative_caching(self):
+        expected = TentInfo(self.tent.pk, self.horde.pk, 'Great Tent')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(self.tent.pk), expected)
+            self.assertEqual(self.get(str(self.tent.pk)), expected)
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.get(self.tent.pk + 1000))
+            self.assertIsNone(self.get(self.tent.pk + 1000))
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.get('not_a_tent'))
+
+        self.now[0] = 10
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.get(self.tent.pk + 1000))
+        self.now[0] = 100
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(self.tent.pk), expected)
+
+    def test_lru_evicts_least_recently_used(self):
+        other = Tent.objects.create(name='Small Tent', horde=self.horde)
+        self.get(self.tent.pk)
+        self.get(other.pk)
+        self.get(self.tent.pk)
+        self.get(other.pk + 1000)
+        self.assertEqual(list(self.registry.entries), [self.tent.pk, other.pk + 1000])
+
+    def test_invalidation_during_load_is_not_overwritten(self):
+        load = self.registry.load
+
+        async def racing_load(pk):
+            info = await load(pk)
+            self.registry.invalidate(tent_id=pk)
+            return info
+
+        with mock.patch.object(self.registry, 'load', racing_load):
+            self.assertEqual(self.get(self.tent.pk).name, 'Great Tent')
+        self.assertEqual(self.registry.lookup(self.tent.pk), (False, None))
+
+    def test_saves_invalidate_through_signals_and_broadcast(self):
+        with mock.patch('hordes.signals.tent_registry', self.registry):
+            self.get(self.tent.pk)
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                self.tent.name = 'Renamed Tent'
+                self.tent.save()
+            self.assertEqual(len(callbacks), 1)
+            self.assertEqual(self.get(self.tent.pk).name, 'Renamed Tent')
+            self.horde.name = 'Blue Horde'
+            self.horde.save()
+            self.assertEqual(self.registry.lookup(self.tent.pk), (False, None))
+
+    async def test_listener_applies_broadcast_invalidations(self):
+        await self.registry.get(self.tent.pk)
+        await asyncio.sleep(0.05)
+        await get_channel_layer().group_send(REGISTRY_GROUP, {'type': INVALIDATE_MESSAGE, 'tent_id': self.tent.pk})
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.registry.lookup(self.tent.pk), (False, None))
+        self.registry.listener.cancel()
 
-# Create your tests here.
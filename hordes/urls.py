@@ -1,8 +1,14 @@
+from django.urls import path
 from rest_framework import routers
-from .views import HordesViewSet
+from .views import HordesViewSet, async_horde_list, async_horde_detail, async_tent_detail
 
 router = routers.DefaultRouter()
 
 router.register(r'', HordesViewSet, basename='hordes')
 
-urlpatterns = router.urls
\ No newline at end of file
+# Async routes must come first, the router's detail pattern would match "async/"
+urlpatterns = [
+    path('async/', async_horde_list, name='async-hordes-list'),
+    path('async/<int:pk>/', async_horde_detail, name='async-hordes-detail'),
+    path('async/tents/<int:pk>/', async_tent_detail, name='async-tents-detail'),
+] + router.urls
@@ -1,10 +1,145 @@
-from rest_framework import viewsets, authentication
-from .models import Horde
-from .serializers import HordeWithTentsSerializer
+from functools import wraps
+from django.db.models import Count, F, Prefetch, Window
+from django.db.models.functions import RowNumber
+from django.http import HttpResponse
+from rest_framework import viewsets, authentication, exceptions, status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from .models import Horde, Tent, TentParticipant
+from .serializers import OCCUPANCY_PREVIEW_SIZE, HordeWithTentsSerializer, HordeWithOccupancySerializer, TentSerializer, TentWithOccupancySerializer
+
+
+def parse_includes(raw):
+    return {part.strip() for part in raw.split(",") if part.strip()}
+
+
+def get_tents_queryset(includes):
+    if "occupancy" not in includes:
+        return Tent.objects.all()
+    tents = Tent.objects.annotate(participant_count=Count('participants'))
+    if "participants" in includes:
+        # Rank participants per tent in SQL so only the preview rows are loaded
+        preview = TentParticipant.objects.select_related('user').annotate(
+            preview_rank=Window(RowNumber(), partition_by=F('tent'), order_by=F('joined_at').asc()),
+        ).filter(preview_rank__lte=OCCUPANCY_PREVIEW_SIZE).order_by('joined_at')
+        tents = tents.prefetch_related(Prefetch('participants', queryset=preview, to_attr='preview_participants'))
+    return tents
+
+
+def get_hordes_queryset(includes):
+    if "occupancy" not in includes:
+        return Horde.objects.prefetch_related('tents')
+    return Horde.objects.prefetch_related(Prefetch('tents', queryset=get_tents_queryset(includes)))
+
 
 class HordesViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Hordes with their tents.
+
+    Pass `?include=occupancy` to add per-tent participant counts, and
+    `?include=occupancy,participants` to also add a username preview.
+    Occupancy is resolved with one annotated tents query (plus one participants
+    query for the preview), never with per-tent queries.
+    """
     serializer_class = HordeWithTentsSerializer
     authentication_classes = [authentication.TokenAuthentication]
 
+    def get_includes(self):
+        return parse_includes(self.request.query_params.get("include", ""))
+
+    def get_serializer_class(self):
+        if "occupancy" in self.get_includes():
+            return HordeWithOccupancySerializer
+        return super().get_serializer_class()
+
     def get_queryset(self):
-        return Horde.objects.prefetch_related('tents')
+        return get_hordes_queryset(self.get_includes())
+
+
+# Async read views
+#
+# Native async counterparts of HordesViewSet for daphne. They run on the event
+# loop instead of being bridged through the sync thread pool, and render with
+# DRF's JSONRenderer so the bytes match the viewset responses.
+
+ITERATOR_CHUNK_SIZE = 2000
+
+
+def render_json(data, status_code=status.HTTP_200_OK, headers=None):
+    response = HttpResponse(JSONRenderer().render(data), content_type="application/json", status=status_code)
+    for header, value in (headers or {}).items():
+        response[header] = value
+    return response
+
+
+async def aauthenticate_token(request):
+    """
+    Async equivalent of `TokenAuthentication.authenticate`.
+
+    Returns the user, None when no token header was sent, or raises
+    `AuthenticationFailed` with the same messages DRF uses.
+    """
+    auth = authentication.get_authorization_header(request).split()
+    if not auth or auth[0].lower() != b'token':
+        return None
+    if len(auth) == 1:
+        raise exceptions.AuthenticationFailed('Invalid token header. No credentials provided.')
+    if len(auth) > 2:
+        raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain spaces.')
+    try:
+        key = auth[1].decode()
+    except UnicodeError:
+        raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+    try:
+        token = await Token.objects.select_related('user').aget(key=key)
+    except Token.DoesNotExist:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    return token.user
+
+
+def async_token_view(view):
+    """Authenticate the request with `aauthenticate_token` before calling an async view."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "GET":
+            return render_json({"detail": f'Method "{request.method}" not allowed.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
+        try:
+            user = await aauthenticate_token(request)
+        except exceptions.AuthenticationFailed as e:
+            return render_json({"detail": e.detail}, status.HTTP_401_UNAUTHORIZED, {"WWW-Authenticate": "Token"})
+        if user is not None:
+            request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@async_token_view
+async def async_horde_list(request):
+    includes = parse_includes(request.GET.get("include", ""))
+    serializer_class = HordeWithOccupancySerializer if "occupancy" in includes else HordeWithTentsSerializer
+    hordes = [horde async for horde in get_hordes_queryset(includes).aiterator(chunk_size=ITERATOR_CHUNK_SIZE)]
+    return render_json(serializer_class(hordes, many=True).data)
+
+
+@async_token_view
+async def async_horde_detail(request, pk):
+    includes = parse_includes(request.GET.get("include", ""))
+    serializer_class = HordeWithOccupancySerializer if "occupancy" in includes else HordeWithTentsSerializer
+    try:
+        horde = await get_hordes_queryset(includes).aget(pk=pk)
+    except (Horde.DoesNotExist, ValueError):
+        return render_json({"detail": "No Horde matches the given query."}, status.HTTP_404_NOT_FOUND)
+    return render_json(serializer_class(horde).data)
+
+
+@async_token_view
+async def async_tent_detail(request, pk):
+    includes = parse_includes(request.GET.get("include", ""))
+    serializer_class = TentWithOccupancySerializer if "occupancy" in includes else TentSerializer
+    try:
+        tent = await get_tents_queryset(includes).aget(pk=pk)
+    except (Tent.DoesNotExist, ValueError):
+        return render_json({"detail": "No Tent matches the given query."}, status.HTTP_404_NOT_FOUND)
+    return render_json(serializer_class(tent).data)
@@ -0,0 +1,156 @@
+"""
+Password hashing offloaded to a bounded process pool.
+
+PBKDF2 costs hundreds of milliseconds of CPU per hash. Running it on the
+request worker stalls the daphne process that also relays voice signaling, so
+hashing is submitted to a small pool of worker processes instead. The number
+of pending hashes is capped; past the cap callers get `HashingUnavailable`
+(HTTP 503) rather than queueing without bound.
+
+Settings:
+    PASSWORD_HASHING_WORKERS      pool size, 0 hashes inline (default 2)
+    PASSWORD_HASHING_MAX_PENDING  in-flight + queued hashes allowed (default 32)
+    PASSWORD_HASHING_TIMEOUT      seconds to wait for a result (default 10)
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+
+class HashingUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Server is busy, please retry shortly."
+    default_code = "hashing_unavailable"
+
+
+def _init_worker(settings_module):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+    django.setup()
+
+
+def _make_password(raw_password):
+    return hashers.make_password(raw_password)
+
+
+def _check_password(raw_password, encoded):
+    """Return (is_correct, must_update) for an encoded password."""
+    if not encoded or not hashers.is_password_usable(encoded):
+        # Run the default hasher once so unknown users cost the same as known ones
+        hashers.make_password(raw_password)
+        return False, False
+    if not hashers.check_password(raw_password, encoded):
+        return False, False
+    return True, hashers.identify_hasher(encoded).must_update(encoded)
+
+
+class PasswordHashingService:
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(os.environ.get("DJANGO_SETTINGS_MODULE", "goldenhorde.settings"),),
+                )
+            return self._executor
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                logger.warning("Password hashing queue full (%s pending), rejecting", self._pending)
+                raise HashingUnavailable()
+            self._pending += 1
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn, *args):
+        """Submit `fn` to the pool and return a concurrent future."""
+        self._acquire()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HashingUnavailable()
+
+    async def arun(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        future = self.submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise HashingUnavailable()
+
+    def make_password(self, raw_password):
+        return self.run(_make_password, raw_password)
+
+    def check_password(self, raw_password, encoded):
+        return self.run(_check_password, raw_password, encoded)
+
+    async def amake_password(self, raw_password):
+        return await self.arun(_make_password, raw_password)
+
+    async def acheck_password(self, raw_password, encoded):
+        return await self.arun(_check_password, raw_password, encoded)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+hashing_service = PasswordHashingService(
+    workers=getattr(settings, "PASSWORD_HASHING_WORKERS", 2),
+    max_pending=getattr(settings, "PASSWORD_HASHING_MAX_PENDING", 32),
+    timeout=getattr(settings, "PASSWORD_HASHING_TIMEOUT", 10),
+)
+
+
+def set_password(user, raw_password):
+    """Offloaded equivalent of `user.set_password(raw_password)`."""
+    user.password = hashing_service.make_password(raw_password)
+    user._password = raw_password
+
+
+async def aset_password(user, raw_password):
+    """Async `set_password` that awaits the pool instead of blocking the calling thread."""
+    user.password = await hashing_service.amake_password(raw_password)
+    user._password = raw_password
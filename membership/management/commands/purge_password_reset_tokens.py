@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from membership.models import PasswordResetToken
+
+
+class Command(BaseCommand):
+    help = 'Delete expired password reset tokens in bounded batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows deleted per statement')
+        parser.add_argument('--sleep', type=float, default=0.0, help='Seconds to pause between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count expired tokens')
+
+    def handle(self, *args, **options):
+        expired = PasswordResetToken.objects.expired()
+        if options['dry_run']:
+            self.stdout.write(f"Would purge {expired.count()} expired tokens")
+            return
+
+        purged = 0
+        while True:
+            # Select a bounded set of ids through the expires_at index, then delete by pk
+            ids = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted, _ = PasswordResetToken.objects.filter(pk__in=ids).delete()
+            purged += deleted
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} expired tokens"))
@@ -0,0 +1,127 @@
+import logging
+import time
+from datetime import timedelta
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from membership.models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def claim_batch(batch_size, lease):
+    """
+    Claim up to `batch_size` due messages for this sender.
+
+    Rows are picked with SELECT ... FOR UPDATE SKIP LOCKED so several senders
+    can drain the outbox without double delivery, and leased by moving
+    `next_attempt_at` forward. The transaction ends before any SMTP traffic, so
+    no row locks are held while sending; a sender that dies mid-batch leaves
+    its unsent rows to be picked up again once the lease runs out.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        OutboundEmail.objects.filter(pk__in=[outbound.pk for outbound in batch]).update(
+            next_attempt_at=now + timedelta(seconds=lease),
+        )
+    return batch
+
+
+def deliver_batch(connection, batch_size, max_attempts, backoff_base, lease=300):
+    """
+    Send one batch of due outbox messages over an open connection.
+
+    Each message's outcome is committed as soon as it is known. If the SMTP
+    connection cannot be re-established after a failure, the rest of the batch
+    is put back (without counting an attempt) and the batch stops.
+    Returns (sent, failed, connected).
+    """
+    sent = failed = 0
+    batch = claim_batch(batch_size, lease)
+    for index, outbound in enumerate(batch):
+        message = EmailMessage(
+            outbound.subject, outbound.body, outbound.from_email, outbound.recipients, connection=connection,
+        )
+        attempts = outbound.attempts + 1
+        try:
+            message.send(fail_silently=False)
+        except Exception as e:
+            failed += 1
+            if attempts >= max_attempts:
+                OutboundEmail.objects.filter(pk=outbound.pk).update(
+                    status=OutboundEmail.FAILED, attempts=attempts, last_error=str(e),
+                )
+                logger.error("Giving up on outbox email %s after %s attempts: %s", outbound.pk, attempts, e)
+            else:
+                OutboundEmail.objects.filter(pk=outbound.pk).update(
+                    attempts=attempts, last_error=str(e),
+                    next_attempt_at=timezone.now() + timedelta(seconds=backoff_base * 2 ** (attempts - 1)),
+                )
+                logger.warning("Outbox email %s failed (attempt %s): %s", outbound.pk, attempts, e)
+            # A broken SMTP session fails every following message; reconnect
+            try:
+                connection.close()
+                connection.open()
+            except Exception as e:
+                logger.warning("SMTP reconnect failed, returning %s messages to the outbox: %s", len(batch) - index - 1, e)
+                OutboundEmail.objects.filter(pk__in=[rest.pk for rest in batch[index + 1:]]).update(
+                    next_attempt_at=timezone.now() + timedelta(seconds=backoff_base),
+                )
+                return sent, failed, False
+        else:
+            OutboundEmail.objects.filter(pk=outbound.pk).update(
+                status=OutboundEmail.SENT, attempts=attempts, sent_at=timezone.now(), last_error="",
+            )
+            sent += 1
+    return sent, failed, True
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued outbox emails over a single reused SMTP connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain due messages once and exit')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--backoff', type=float, default=30.0, help='Base retry delay in seconds, doubled per attempt')
+        parser.add_argument('--lease', type=float, default=300.0, help='Seconds a claimed message is hidden from other senders')
+
+    def handle(self, *args, **options):
+        connection = get_connection(fail_silently=False)
+        total_sent = total_failed = 0
+        try:
+            try:
+                connection.open()
+            except Exception as e:
+                # The backend opens a connection on the next send anyway
+                logger.warning("Could not open SMTP connection: %s", e)
+            while True:
+                try:
+                    sent, failed, connected = deliver_batch(
+                        connection, options['batch_size'], options['max_attempts'], options['backoff'], options['lease'],
+                    )
+                except Exception:
+                    logger.exception("Outbox delivery batch failed")
+                    sent = failed = 0
+                    connected = False
+                total_sent += sent
+                total_failed += failed
+                if sent or failed:
+                    self.stdout.write(f"Sent {sent}, failed {failed}")
+                if connected and (sent or failed):
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+        self.stdout.write(self.style.SUCCESS(f"Outbox drained: {total_sent} sent, {total_failed} failed"))
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+INDEX_NAME = "membership_auth_user_email_ci_uniq"
+
+
+def check_duplicates(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT LOWER(email), COUNT(*) FROM auth_user WHERE email <> '' "
+            "GROUP BY LOWER(email) HAVING COUNT(*) > 1 ORDER BY 2 DESC LIMIT 20"
+        )
+        duplicates = cursor.fetchall()
+    if duplicates:
+        listed = ", ".join(f"{email} ({count})" for email, count in duplicates)
+        raise RuntimeError(
+            f"auth_user has emails that differ only by case, merge or rename them before migrating: {listed}"
+        )
+
+
+def drop_invalid_index(schema_editor):
+    # A failed CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS would skip
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = %s AND NOT i.indisvalid",
+            [INDEX_NAME],
+        )
+        invalid = cursor.fetchone() is not None
+    if invalid:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+
+
+def create_index(apps, schema_editor):
+    check_duplicates(schema_editor)
+    # CONCURRENTLY keeps auth_user writable while the index builds on large tables
+    concurrently = ""
+    if schema_editor.connection.vendor == "postgresql":
+        concurrently = "CONCURRENTLY "
+        drop_invalid_index(schema_editor)
+    schema_editor.execute(
+        f"CREATE UNIQUE INDEX {concurrently}IF NOT EXISTS {INDEX_NAME} "
+        f"ON auth_user (LOWER(email)) WHERE email <> ''"
+    )
+
+
+def drop_index(apps, schema_editor):
+    concurrently = "CONCURRENTLY " if schema_editor.connection.vendor == "postgresql" else ""
+    schema_editor.execute(f"DROP INDEX {concurrently}IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('membership', '0002_rename_passwordreset_passwordresettoken'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
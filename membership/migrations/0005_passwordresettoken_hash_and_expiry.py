@@ -0,0 +1,50 @@
+# Generated by Django 5.2.3 on 2026-10-19 07:40
+
+import hashlib
+from datetime import timedelta
+import membership.models
+from django.db import migrations, models
+from django.db.models import F
+
+
+def hash_existing_tokens(apps, schema_editor):
+    PasswordResetToken = apps.get_model('membership', 'PasswordResetToken')
+    for reset in PasswordResetToken.objects.only('pk', 'token').iterator():
+        reset.token_hash = hashlib.sha256(reset.token.encode()).hexdigest()
+        reset.save(update_fields=['token_hash'])
+    PasswordResetToken.objects.update(expires_at=F('created_at') + timedelta(hours=1))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('membership', '0004_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='passwordresettoken',
+            name='token_hash',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='passwordresettoken',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, default=membership.models.default_reset_token_expiry),
+        ),
+        migrations.RunPython(hash_existing_tokens, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='passwordresettoken',
+            name='token',
+        ),
+        migrations.AlterField(
+            model_name='passwordresettoken',
+            name='token_hash',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='passwordresettoken',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -1,12 +1,85 @@
+import hashlib
 from datetime import timedelta
 from django.utils import timezone
 from django.db import models
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models.functions import Now
+
+PASSWORD_RESET_TOKEN_TTL = timedelta(hours=1)
+
+
+def hash_reset_token(raw_token):
+    """Reset tokens are stored as SHA-256 digests; only the emailed link has the raw value."""
+    return hashlib.sha256(raw_token.encode()).hexdigest()
+
+
+def default_reset_token_expiry():
+    return timezone.now() + PASSWORD_RESET_TOKEN_TTL
+
+
+class PasswordResetTokenQuerySet(models.QuerySet):
+    def for_token(self, raw_token):
+        return self.filter(token_hash=hash_reset_token(raw_token))
+
+    def with_expired(self):
+        """Annotate `expired`, evaluated against the database clock."""
+        return self.annotate(expired=ExpressionWrapper(Q(expires_at__lte=Now()), output_field=BooleanField()))
+
+    def expired(self):
+        return self.filter(expires_at__lte=Now())
 
 
 class PasswordResetToken(models.Model):
     email = models.EmailField()
-    token = models.CharField(max_length=100, unique=True, db_index=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    token_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    expires_at = models.DateTimeField(default=default_reset_token_expiry, db_index=True)
+
+    objects = PasswordResetTokenQuerySet.as_manager()
 
     def is_expired(self):
-        return timezone.now() > self.created_at + timedelta(hours=1)
+        return timezone.now() >= self.expires_at
+
+    @classmethod
+    def issue(cls, email, raw_token):
+        return cls.objects.create(email=email, token_hash=hash_reset_token(raw_token))
+
+
+class OutboundEmail(models.Model):
+    """
+    Persistent email outbox.
+
+    Views queue messages here instead of talking SMTP on the request worker;
+    `manage.py send_outbox_emails` drains the table over one reused connection.
+    """
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="outbox_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, subject, body, from_email, recipient_list):
+        return cls.objects.create(subject=subject, body=body, from_email=from_email, recipients=list(recipient_list))
@@ -1,5 +1,7 @@
 from django.contrib.auth import get_user_model
+from django.contrib.auth.validators import UnicodeUsernameValidator
 from rest_framework import serializers
+from .hashing import set_password
 
 User = get_user_model()
 
@@ -16,13 +18,17 @@ class CreateUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['username', 'email', 'password']
+        # Uniqueness is enforced by the database on insert, see views.sign_up
+        extra_kwargs = {
+            'username': {'validators': [UnicodeUsernameValidator()]},
+        }
 
     def create(self, validated_data):
         user = User(
             username=validated_data["username"],
             email=validated_data["email"],
         )
-        user.set_password(validated_data["password"])
+        set_password(user, validated_data["password"])
         user.save()
         return user
 
@@ -34,3 +40,8 @@ class ForgotPasswordSerializer(serializers.Serializer):
 class ResetPasswordSerializer(serializers.Serializer):
     token = serializers.CharField(required=True)
     new_password = serializers.CharField(required=True)
+
+
+class SignInSerializer(serializers.Serializer):
+    username = serializers.CharField(required=True)
+    password = serializers.CharField(required=True, trim_whitespace=False, write_only=True)
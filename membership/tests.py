@@ -1,10 +1,16 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core import mail
+from django.core.management import call_command
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import PasswordResetToken
+from .hashing import hashing_service
+from .models import OutboundEmail, PasswordResetToken, hash_reset_token
 
 
 User = get_user_model()
@@ -36,45 +42,147 @@ class MembershipViewsTestCase(TestCase):
         data['username'] = 'existinguser'
         response = self.client.post(self.signup_url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertIn('username', response.data)
+        self.assertIn('username', response.json())
 
     def test_signup_duplicate_email(self):
         data = self.user_data.copy()
         data['email'] = 'existing@example.com'
         response = self.client.post(self.signup_url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertIn('email', response.data)
+        self.assertIn('email', response.json())
+
+    def test_signup_duplicate_email_case_insensitive(self):
+        data = self.user_data.copy()
+        data['email'] = 'Existing@Example.com'
+        response = self.client.post(self.signup_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('email', response.json())
+
+    def test_signup_single_insert(self):
+        # savepoint, INSERT, release savepoint
+        with self.assertNumQueries(3):
+            response = self.client.post(self.signup_url, self.user_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_signin_success(self):
+        response = self.client.post(self.signin_url, {'username': 'existinguser', 'password': 'existingpass123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('token', response.json())
+
+    def test_signin_wrong_password(self):
+        response = self.client.post(self.signin_url, {'username': 'existinguser', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('non_field_errors', response.json())
+
+    def test_signin_unknown_user(self):
+        response = self.client.post(self.signin_url, {'username': 'nobody', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('non_field_errors', response.json())
+
+    def test_hashing_overload_returns_503(self):
+        with mock.patch.object(hashing_service, 'workers', 1), mock.patch.object(hashing_service, 'max_pending', 0):
+            response = self.client.post(self.signup_url, self.user_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(User.objects.filter(username='testuser').exists())
 
     def test_forgot_password_success(self):
         response = self.client.post(self.forgot_password_url, {'email': 'existing@example.com'}, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue(PasswordResetToken.objects.filter(email='existing@example.com').exists())
+        reset = PasswordResetToken.objects.get(email='existing@example.com')
+        self.assertEqual(len(reset.token_hash), 64)
+        # Queued in the outbox, not sent on the request
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertTrue(OutboundEmail.objects.filter(recipients=['existing@example.com']).exists())
 
     def test_forgot_password_invalid_email(self):
         response = self.client.post(self.forgot_password_url, {'email': 'notfound@example.com'}, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_password_reset_success(self):
-        reset = PasswordResetToken.objects.create(email='existing@example.com', token='resettoken123', created_at=timezone.now())
+        PasswordResetToken.issue('existing@example.com', 'resettoken123')
         url = reverse('membership:reset-password')
-        response = self.client.post(url, {'token': reset.token, 'new_password': 'newpass456'}, format='json')
+        response = self.client.post(url, {'token': 'resettoken123', 'new_password': 'newpass456'}, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.user.refresh_from_db()
         self.assertTrue(self.user.check_password('newpass456'))
-        self.assertFalse(PasswordResetToken.objects.filter(token='resettoken123').exists())
+        self.assertFalse(PasswordResetToken.objects.for_token('resettoken123').exists())
+
+    def test_password_reset_expired_token(self):
+        reset = PasswordResetToken.issue('existing@example.com', 'oldtoken')
+        PasswordResetToken.objects.filter(pk=reset.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        url = reverse('membership:reset-password')
+        response = self.client.post(url, {'token': 'oldtoken', 'new_password': 'newpass456'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PasswordResetToken.objects.filter(pk=reset.pk).exists())
+
+    def test_reset_token_stored_hashed(self):
+        reset = PasswordResetToken.issue('existing@example.com', 'plaintoken')
+        self.assertEqual(reset.token_hash, hash_reset_token('plaintoken'))
+        self.assertNotIn('plaintoken', reset.token_hash)
 
     def test_password_reset_invalid_token(self):
         url = reverse('membership:reset-password')
         response = self.client.post(url, {'token': 'invalidtoken', 'new_password': 'newpass456'}, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertIn('message', response.data)
+        self.assertIn('message', response.json())
 
     def test_password_reset_no_user(self):
-        PasswordResetToken.objects.create(email='notfound@example.com', token='othertoken', created_at=timezone.now())
+        PasswordResetToken.issue('notfound@example.com', 'othertoken')
         url = reverse('membership:reset-password')
         response = self.client.post(url, {'token': 'othertoken', 'new_password': 'newpass456'}, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertIn('message', response.data)
+        self.assertIn('message', response.json())
+
+class OutboxDeliveryTestCase(TestCase):
+    def queue(self, count):
+        for i in range(count):
+            OutboundEmail.enqueue(f"subject {i}", "body", "noreply@example.com", [f"user{i}@example.com"])
+
+    def test_drains_pending_messages(self):
+        self.queue(3)
+        call_command('send_outbox_emails', '--once', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.SENT).count(), 3)
+
+    def test_failed_message_is_retried_with_backoff(self):
+        self.queue(1)
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=OSError("connection refused")):
+            call_command('send_outbox_emails', '--once', stdout=StringIO())
+        outbound = OutboundEmail.objects.get()
+        self.assertEqual(outbound.status, OutboundEmail.PENDING)
+        self.assertEqual(outbound.attempts, 1)
+        self.assertGreater(outbound.next_attempt_at, timezone.now())
+        self.assertIn("connection refused", outbound.last_error)
+
+    def test_gives_up_after_max_attempts(self):
+        self.queue(1)
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=OSError("connection refused")):
+            call_command('send_outbox_emails', '--once', '--max-attempts', '1', stdout=StringIO())
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.FAILED)
+
+    def test_reconnect_failure_keeps_committed_outcomes(self):
+        self.queue(3)
+        send = mock.patch('django.core.mail.EmailMessage.send', side_effect=[1, OSError("connection reset")])
+        reopen = mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=[None, OSError("smtp down")])
+        with send, reopen:
+            call_command('send_outbox_emails', '--once', stdout=StringIO())
+        first, second, third = OutboundEmail.objects.order_by('pk')
+        self.assertEqual(first.status, OutboundEmail.SENT)
+        self.assertEqual((second.status, second.attempts), (OutboundEmail.PENDING, 1))
+        # Never attempted: returned to the outbox without using up an attempt
+        self.assertEqual((third.status, third.attempts), (OutboundEmail.PENDING, 0))
+        self.assertGreater(third.next_attempt_at, timezone.now())
+
+
+class PurgePasswordResetTokensTestCase(TestCase):
+    def test_purges_only_expired_tokens_in_batches(self):
+        for i in range(5):
+            PasswordResetToken.issue('user@example.com', f'expired{i}')
+        PasswordResetToken.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        PasswordResetToken.issue('user@example.com', 'fresh')
+        call_command('purge_password_reset_tokens', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(list(PasswordResetToken.objects.values_list('token_hash', flat=True)), [hash_reset_token('fresh')])
+
 
 class MembershipURLReverseTestCase(TestCase):
     def test_reverse_sign_up(self):
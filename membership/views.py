@@ -1,35 +1,59 @@
 import os
+from functools import wraps
+from asgiref.sync import sync_to_async
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
-from django.core.mail import send_mail
 from django.contrib.auth import get_user_model
-from rest_framework import generics, status, mixins
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import generics, status
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import APIException
 from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.response import Response
-from .models import PasswordResetToken
-from .serializers import CreateUserSerializer, ForgotPasswordSerializer, ResetPasswordSerializer
+from rest_framework.settings import api_settings
+from .hashing import aset_password, hashing_service
+from .models import OutboundEmail, PasswordResetToken
+from .serializers import CreateUserSerializer, ForgotPasswordSerializer, ResetPasswordSerializer, SignInSerializer
 
 User = get_user_model()
 
 
-class SignUpView(mixins.CreateModelMixin, generics.GenericAPIView):
-    queryset = User.objects.all()
-    serializer_class = CreateUserSerializer
+# Unique constraints on auth_user that signup can violate, by Postgres name:
+# the LOWER(email) index from migration 0003 and the column-level UNIQUE that
+# Django creates for `username`
+EMAIL_UNIQUE_INDEX = "membership_auth_user_email_ci_uniq"
+DUPLICATE_FIELD_CONSTRAINTS = {
+    EMAIL_UNIQUE_INDEX: "email",
+    "auth_user_username_key": "username",
+}
 
-    def post(self, request, *args, **kwargs):
-        try:
-            username = request.data.get("username")
-            if User.objects.filter(username=username).exists():
-                return Response({
-                    "username": ["A user with this username is already signed up"]
-                }, status=status.HTTP_400_BAD_REQUEST)
-            email = request.data.get("email")
-            if User.objects.filter(email=email).exists():
-                return Response({
-                    "email": ["A user with this email is already signed up"]
-                }, status=status.HTTP_400_BAD_REQUEST)
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        return self.create(request, *args, **kwargs)
+DUPLICATE_FIELD_MESSAGES = {
+    "username": "A user with this username is already signed up",
+    "email": "A user with this email is already signed up",
+}
+
+
+def get_duplicate_field(error):
+    """Map a unique-violation IntegrityError on auth_user to the offending field."""
+    diag = getattr(error.__cause__, "diag", None)
+    return DUPLICATE_FIELD_CONSTRAINTS.get(getattr(diag, "constraint_name", None))
+
+
+def users_by_email(email):
+    """
+    Case-insensitive email lookup that matches the LOWER(email) unique index.
+
+    The `email <> ''` condition lets PostgreSQL use the partial index.
+    """
+    return User.objects.alias(email_lower=Lower('email')).exclude(email='').filter(email_lower=email.lower())
+
+
+def get_user_by_email(email):
+    return users_by_email(email).get()
 
 
 class ForgotPasswordView(generics.GenericAPIView):
@@ -41,61 +65,138 @@ class ForgotPasswordView(generics.GenericAPIView):
         serializer.is_valid(raise_exception=True)
         email = request.data['email']
         try:
-            user = User.objects.get(email=email)
+            user = get_user_by_email(email)
         except User.DoesNotExist:
             return Response({"message": "User with this email not found"}, status=status.HTTP_404_NOT_FOUND)
 
         token_generator = PasswordResetTokenGenerator()
         token = token_generator.make_token(user)
-        reset = PasswordResetToken(
-            email=email, token=token)
-        reset.save()
+        PasswordResetToken.issue(email, token)
 
         front_auth_reset_password_url = 'auth/reset-password'
 
         reset_url = f"{os.environ['FRONTEND_URL']}/{front_auth_reset_password_url}/{token}"
 
-        send_mail(
+        # Delivered by `manage.py send_outbox_emails`, never on the request worker
+        OutboundEmail.enqueue(
             "Golden Horde - request for reset password",
             f"Dear {user.username}\nyou can reset your password using this url {reset_url}",
             from_email=os.environ['EMAIL_HOST_USER'],
             recipient_list=[user.email],
-            fail_silently=False,
         )
 
         return Response({'message': 'We have sent you an email containing a link for password reset '}, status=status.HTTP_200_OK)
 
 
-class ResetPasswordView(generics.GenericAPIView):
-    serializer_class = ResetPasswordSerializer
-    permission_classes = []
+# Async credential views
+#
+# Signing up, signing in and resetting a password each hash a password. These
+# views await the hashing pool on the event loop instead of blocking daphne's
+# single thread-sensitive sync thread for the whole hash. Bodies are parsed
+# with DRF's parsers and errors rendered like DRF's so the payloads match the
+# previous APIViews.
 
-    def post(self, request):
-        serializer = self.serializer_class(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        data = serializer.validated_data
-
-        token = data.get('token')
-        new_password = data['new_password']
-
-        reset_obj = PasswordResetToken.objects.filter(token=token).first()
+def render_json(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(JSONRenderer().render(data), content_type="application/json", status=status_code)
 
-        if not reset_obj:
-            return Response({'message': 'Token not found'}, status=status.HTTP_404_NOT_FOUND)
-
-        # Check if token is expired
-        if reset_obj.is_expired():
-            reset_obj.delete()
-            return Response({'message': 'Token expired'}, status=status.HTTP_400_BAD_REQUEST)
 
+def async_api_view(view):
+    """POST-only async view taking the parsed request data, with APIException mapped to responses."""
+    @csrf_exempt
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "POST":
+            return render_json({"detail": f'Method "{request.method}" not allowed.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
         try:
-            user = User.objects.get(email=reset_obj.email)
-        except User.DoesNotExist:
-            reset_obj.delete()
-            return Response({'message': 'No user found'}, status=status.HTTP_404_NOT_FOUND)
+            data = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES]).data
+            return await view(request, data, *args, **kwargs)
+        except APIException as e:
+            return render_json({"detail": e.detail}, e.status_code)
+    return wrapper
 
-        user.set_password(new_password)
+
+def create_user(user):
+    with transaction.atomic():
         user.save()
-        reset_obj.delete()
 
-        return Response({'message': 'Password updated'}, status=status.HTTP_200_OK)
+
+@async_api_view
+async def sign_up(request, data):
+    """
+    Sign up with a single INSERT.
+
+    Duplicate usernames and (case-insensitive) emails are rejected by unique
+    indexes on auth_user instead of `exists()` checks, which also closes the
+    race where two concurrent signups both passed the checks.
+    """
+    serializer = CreateUserSerializer(data=data)
+    if not serializer.is_valid():
+        return render_json(serializer.errors, status.HTTP_400_BAD_REQUEST)
+    user = User(username=serializer.validated_data["username"], email=serializer.validated_data["email"])
+    await aset_password(user, serializer.validated_data["password"])
+    try:
+        await sync_to_async(create_user)(user)
+    except IntegrityError as e:
+        field = get_duplicate_field(e)
+        if field is None:
+            raise
+        return render_json({field: [DUPLICATE_FIELD_MESSAGES[field]]}, status.HTTP_400_BAD_REQUEST)
+    return render_json(CreateUserSerializer(user).data, status.HTTP_201_CREATED)
+
+
+@async_api_view
+async def sign_in(request, data):
+    """
+    Token sign-in with the password check offloaded to the hashing pool.
+
+    Drop-in replacement for DRF's `obtain_auth_token`: same request fields and
+    the same `{"token": ...}` / `non_field_errors` responses.
+    """
+    serializer = SignInSerializer(data=data)
+    if not serializer.is_valid():
+        return render_json(serializer.errors, status.HTTP_400_BAD_REQUEST)
+    username = serializer.validated_data['username']
+    password = serializer.validated_data['password']
+
+    user = await User._default_manager.filter(**{User.USERNAME_FIELD: username}).afirst()
+    is_correct, must_update = await hashing_service.acheck_password(password, user.password if user else None)
+    if not is_correct or not user.is_active:
+        return render_json({
+            "non_field_errors": ["Unable to log in with provided credentials."]
+        }, status.HTTP_400_BAD_REQUEST)
+
+    if must_update:
+        await aset_password(user, password)
+        await user.asave(update_fields=['password'])
+    token, _ = await Token.objects.aget_or_create(user=user)
+    return render_json({'token': token.key})
+
+
+@async_api_view
+async def reset_password(request, data):
+    serializer = ResetPasswordSerializer(data=data)
+    if not serializer.is_valid():
+        return render_json(serializer.errors, status.HTTP_400_BAD_REQUEST)
+    token = serializer.validated_data.get('token')
+    new_password = serializer.validated_data['new_password']
+
+    reset_obj = await PasswordResetToken.objects.for_token(token).with_expired().afirst()
+
+    if not reset_obj:
+        return render_json({'message': 'Token not found'}, status.HTTP_404_NOT_FOUND)
+
+    # Expiry is evaluated in the query itself
+    if reset_obj.expired:
+        await reset_obj.adelete()
+        return render_json({'message': 'Token expired'}, status.HTTP_400_BAD_REQUEST)
+
+    user = await users_by_email(reset_obj.email).afirst()
+    if user is None:
+        await reset_obj.adelete()
+        return render_json({'message': 'No user found'}, status.HTTP_404_NOT_FOUND)
+
+    await aset_password(user, new_password)
+    await user.asave()
+    await reset_obj.adelete()
+
+    return render_json({'message': 'Password updated'})